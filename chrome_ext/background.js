@@ -1,3 +1,8 @@
+const CONNECTOR_URL = "http://127.0.0.1:8765";
+
+// a partir de quantas chaves o lote vira um único .zip (em vez de um download por XML)
+const ARCHIVE_MIN_KEYS = 20;
+
 function onlyDigits(s) {
   return String(s || "").replace(/\D/g, "");
 }
@@ -17,10 +22,32 @@ async function getSettings() {
   };
 }
 
+async function saveXml(tipo, chave, xml, cfg) {
+  const ch = onlyDigits(chave);
+  const baseName = `${tipo}_${ch}.xml`;
+
+  const folder = normalizeFolder(cfg.folder);
+  const filename = folder ? `${folder}/${baseName}` : baseName;
+
+  const blob = new Blob([xml], { type: "application/xml" });
+  const url = URL.createObjectURL(blob);
+
+  await new Promise((resolve) => {
+    chrome.downloads.download(
+      { url, filename, saveAs: cfg.saveAs },
+      () => resolve()
+    );
+  });
+
+  setTimeout(() => URL.revokeObjectURL(url), 5000);
+
+  return filename;
+}
+
 async function downloadOne(tipo, chave, cfg) {
   const payload = { tipo, chave };
 
-  const r = await fetch("http://127.0.0.1:8765/download", {
+  const r = await fetch(`${CONNECTOR_URL}/download`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify(payload)
@@ -32,25 +59,74 @@ async function downloadOne(tipo, chave, cfg) {
     return { ok: false, msg: data.msg || "Falha no conector" };
   }
 
-  const ch = onlyDigits(chave);
-  const baseName = `${tipo}_${ch}.xml`;
+  const filename = await saveXml(tipo, chave, data.xml, cfg);
+  return { ok: true, msg: "Download disparado.", filename };
+}
 
+// Lote grande: o conector monta o .zip com os XMLs originais e o Chrome baixa direto dele
+async function saveArchive(tipo, batchId, cfg) {
   const folder = normalizeFolder(cfg.folder);
+  const baseName = `${tipo}_lote_${batchId}.zip`;
   const filename = folder ? `${folder}/${baseName}` : baseName;
-
-  const blob = new Blob([data.xml], { type: "application/xml" });
-  const url = URL.createObjectURL(blob);
+  const url = `${CONNECTOR_URL}/jobs/${encodeURIComponent(batchId)}/archive`;
 
   await new Promise((resolve) => {
-    chrome.downloads.download(
-      { url, filename, saveAs: cfg.saveAs },
-      () => resolve()
-    );
+    chrome.downloads.download({ url, filename, saveAs: cfg.saveAs }, () => resolve());
   });
 
-  setTimeout(() => URL.revokeObjectURL(url), 5000);
+  return filename;
+}
 
-  return { ok: true, msg: "Download disparado.", filename };
+// Lote: o conector baixa em paralelo e devolve uma linha NDJSON por chave.
+// O lote fica salvo no conector: reenviar o mesmo batch_id retoma de onde parou.
+// Com archive, as linhas trazem só o progresso e os XMLs vão num .zip no fim.
+async function downloadBatch(tipo, chaves, cfg, onItem, batchId, archive) {
+  const r = await fetch(`${CONNECTOR_URL}/download/batch`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      tipo,
+      chaves,
+      concurrency: 4,
+      batch_id: batchId || "",
+      format: "ndjson.gz",
+      include_xml: !archive
+    })
+  });
+
+  if (!r.ok || !r.body) {
+    throw new Error(`Conector respondeu HTTP ${r.status}`);
+  }
+
+  const reader = r.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (value) buf += decoder.decode(value, { stream: true });
+
+    let nl;
+    while ((nl = buf.indexOf("\n")) !== -1) {
+      const line = buf.slice(0, nl).trim();
+      buf = buf.slice(nl + 1);
+      if (!line) continue;
+
+      const item = JSON.parse(line);
+      let resp;
+      if (item.ok && archive) {
+        resp = { ok: true, msg: "Baixado (vai no .zip do lote)." };
+      } else if (item.ok && item.xml) {
+        const filename = await saveXml(tipo, item.chave, item.xml, cfg);
+        resp = { ok: true, msg: "Download disparado.", filename };
+      } else {
+        resp = { ok: false, msg: item.msg || "Falha no conector" };
+      }
+      await onItem(item.chave, resp);
+    }
+
+    if (done) break;
+  }
 }
 
 async function sendToTab(tabId, message) {
@@ -96,10 +172,10 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
           errCount
         });
 
-        for (let i = 0; i < chaves.length; i++) {
-          const chave = chaves[i];
-          const resp = await downloadOne(tipo, chave, cfg);
-
+        const archive = chaves.length >= ARCHIVE_MIN_KEYS;
+        let index = 0;
+        await downloadBatch(tipo, chaves, cfg, async (chave, resp) => {
+          index++;
           if (resp.ok) okCount++;
           else errCount++;
 
@@ -109,14 +185,17 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
             batchId,
             status: "running",
             total: chaves.length,
-            index: i + 1,
+            index,
             currentKey: chave,
             okCount,
             errCount,
             last: resp
           });
+        }, batchId, archive);
 
-          await new Promise((r) => setTimeout(r, 350));
+        let archiveName = "";
+        if (archive && okCount > 0) {
+          archiveName = await saveArchive(tipo, batchId, cfg);
         }
 
         const finalMsg = {
@@ -126,7 +205,8 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
           status: "done",
           total: chaves.length,
           okCount,
-          errCount
+          errCount,
+          archive: archiveName
         };
 
         await sendToTab(tabId, finalMsg);
@@ -152,7 +232,7 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
 
   (async () => {
     try {
-      const r = await fetch("http://127.0.0.1:8765/status", { method: "GET" });
+      const r = await fetch(`${CONNECTOR_URL}/status`, { method: "GET" });
       const data = await r.json();
       sendResponse({ ok: true, data });
     } catch (e) {
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import zipfile
+import zlib
+from typing import AsyncIterator
+
+# nível de compressão: XML comprime muito bem já no nível 6, acima disso só gasta CPU
+COMPRESS_LEVEL = 6
+
+
+class _ZipSink:
+    """
+    Destino do ZipFile sem seek/tell: o zipfile grava em modo streaming
+    (data descriptor depois de cada arquivo) e a gente repassa os bytes conforme saem.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def write(self, data) -> int:
+        self._buf += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Comprime um stream em gzip sem esperar o fim: cada pedaço sai com sync flush,
+    então quem lê (fetch do navegador com Content-Encoding: gzip) recebe as linhas na hora.
+    """
+    z = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        out = z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+        if out:
+            yield out
+    yield z.flush()
+
+
+async def zip_stream(entries: AsyncIterator[list[tuple[str, bytes]]]) -> AsyncIterator[bytes]:
+    """
+    Monta um .zip em streaming a partir de rajadas de (nome, bytes).
+    Os bytes entram no zip exatamente como vieram (sem decodificar o XML).
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as zf:
+        async for files in entries:
+            for name, data in files:
+                zf.writestr(name, data)
+            out = sink.take()
+            if out:
+                yield out
+    yield sink.take()
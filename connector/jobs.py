@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# estados de cada chave no lote
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+
+class JobStore:
+    """
+    Fila persistente de downloads (SQLite em ~/.xsist/jobs.sqlite).
+
+    Cada chave de um lote guarda estado, tentativas, mensagem e o XML do resultado,
+    então um lote interrompido (conector fechado, PC reiniciado) continua de onde parou
+    e chaves já baixadas não voltam para a SEFAZ.
+    """
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                tipo TEXT NOT NULL,
+                concurrency INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                batch_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                chave TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                msg TEXT NOT NULL DEFAULT '',
+                result BLOB,
+                not_before REAL NOT NULL DEFAULT 0,
+                finished_seq INTEGER,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (batch_id, chave)
+            );
+            CREATE INDEX IF NOT EXISTS ix_jobs_state ON jobs(state, not_before);
+            CREATE INDEX IF NOT EXISTS ix_jobs_finished ON jobs(batch_id, finished_seq);
+            """
+        )
+        self._db.commit()
+        row = self._db.execute("SELECT COALESCE(MAX(finished_seq), 0) FROM jobs").fetchone()
+        self._seq = int(row[0])
+
+    def create_batch(self, tipo: str, chaves: list[str], concurrency: int, batch_id: str = "") -> str:
+        """
+        Cria o lote (ou acrescenta chaves a um lote existente com o mesmo id).
+        Chaves já baixadas mantêm o resultado; as que terminaram em erro voltam para a fila.
+        """
+        batch_id = batch_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO batches (id, tipo, concurrency, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET concurrency = excluded.concurrency",
+                (batch_id, tipo, concurrency, now),
+            )
+            # chaves acrescentadas a um lote existente continuam a numeração depois das que já estão nele
+            (start,) = self._db.execute(
+                "SELECT COALESCE(MAX(idx), -1) + 1 FROM jobs WHERE batch_id = ?", (batch_id,)
+            ).fetchone()
+            self._db.executemany(
+                "INSERT OR IGNORE INTO jobs (batch_id, idx, chave, state, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(batch_id, i, ch, PENDING, now) for i, ch in enumerate(chaves, start)],
+            )
+            self._db.executemany(
+                "UPDATE jobs SET state = ?, attempts = 0, not_before = 0, finished_seq = NULL, updated_at = ? "
+                "WHERE batch_id = ? AND chave = ? AND state = ?",
+                [(PENDING, now, batch_id, ch, ERROR) for ch in chaves],
+            )
+            self._db.commit()
+        return batch_id
+
+    def reset_running(self) -> int:
+        """
+        No startup: o que estava 'running' foi interrompido no meio, volta para a fila.
+        """
+        with self._lock:
+            cur = self._db.execute("UPDATE jobs SET state = ? WHERE state = ?", (PENDING, RUNNING))
+            self._db.commit()
+            return cur.rowcount
+
+    def pending(self, limit: int = 200) -> list[tuple]:
+        """
+        Próximas chaves prontas para rodar: (batch_id, chave, tipo, attempts, concurrency).
+        No máximo `concurrency` chaves por lote: um lote grande e antigo não ocupa o limit
+        inteiro e deixa os outros lotes sem vez quando já está no próprio limite.
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT batch_id, chave, tipo, attempts, concurrency FROM ("
+                " SELECT j.batch_id, j.chave, b.tipo, j.attempts, b.concurrency, b.created_at, j.idx,"
+                "  ROW_NUMBER() OVER (PARTITION BY j.batch_id ORDER BY j.idx) AS rn"
+                " FROM jobs j JOIN batches b ON b.id = j.batch_id"
+                " WHERE j.state = ? AND j.not_before <= ?"
+                ") WHERE rn <= concurrency "
+                "ORDER BY created_at, idx LIMIT ?",
+                (PENDING, time.time(), limit),
+            ).fetchall()
+
+    def next_wakeup(self) -> float | None:
+        with self._lock:
+            row = self._db.execute("SELECT MIN(not_before) FROM jobs WHERE state = ?", (PENDING,)).fetchone()
+        return row[0]
+
+    def mark_running(self, batch_id: str, chave: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE batch_id = ? AND chave = ?",
+                (RUNNING, time.time(), batch_id, chave),
+            )
+            self._db.commit()
+
+    def requeue(self, batch_id: str, chave: str, msg: str, delay: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, msg = ?, not_before = ?, updated_at = ? WHERE batch_id = ? AND chave = ?",
+                (PENDING, msg, now + delay, now, batch_id, chave),
+            )
+            self._db.commit()
+
+    def finish(self, batch_id: str, chave: str, ok: bool, msg: str, result: bytes | None) -> None:
+        with self._lock:
+            self._seq += 1
+            self._db.execute(
+                "UPDATE jobs SET state = ?, msg = ?, result = ?, finished_seq = ?, updated_at = ? "
+                "WHERE batch_id = ? AND chave = ?",
+                (DONE if ok else ERROR, msg, result if ok else None, self._seq, time.time(), batch_id, chave),
+            )
+            self._db.commit()
+
+    def results(self, batch_id: str, after_seq: int = 0) -> list[tuple]:
+        """
+        Chaves concluídas (ok ou erro) depois de after_seq:
+        (finished_seq, idx, chave, state, attempts, msg, result).
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT finished_seq, idx, chave, state, attempts, msg, result FROM jobs "
+                "WHERE batch_id = ? AND finished_seq > ? ORDER BY finished_seq",
+                (batch_id, after_seq),
+            ).fetchall()
+
+    def summary(self, batch_id: str) -> dict | None:
+        with self._lock:
+            b = self._db.execute("SELECT tipo, created_at FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            if not b:
+                return None
+            counts = dict(self._db.execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE batch_id = ? GROUP BY state", (batch_id,)
+            ).fetchall())
+        total = sum(counts.values())
+        return {
+            "batch_id": batch_id,
+            "tipo": b[0],
+            "created_at": b[1],
+            "total": total,
+            "pending": counts.get(PENDING, 0) + counts.get(RUNNING, 0),
+            "done": counts.get(DONE, 0),
+            "error": counts.get(ERROR, 0),
+            # lote sem chaves já nasce terminado (senão quem acompanha espera para sempre)
+            "finished": counts.get(PENDING, 0) + counts.get(RUNNING, 0) == 0,
+        }
+
+    def list_batches(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            ids = [r[0] for r in self._db.execute(
+                "SELECT id FROM batches ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()]
+        return [self.summary(i) for i in ids]
+
+    def purge(self, older_than_days: int = 30) -> int:
+        """
+        Remove lotes já terminados mais antigos que N dias.
+        """
+        cutoff = time.time() - older_than_days * 86400
+        with self._lock:
+            old = [r[0] for r in self._db.execute(
+                "SELECT id FROM batches b WHERE created_at < ? AND NOT EXISTS "
+                "(SELECT 1 FROM jobs j WHERE j.batch_id = b.id AND j.state IN (?, ?))",
+                (cutoff, PENDING, RUNNING),
+            ).fetchall()]
+            for bid in old:
+                self._db.execute("DELETE FROM jobs WHERE batch_id = ?", (bid,))
+                self._db.execute("DELETE FROM batches WHERE id = ?", (bid,))
+            self._db.commit()
+        return len(old)
+
+
+class JobRunner:
+    """
+    Executa a fila do JobStore no event loop do conector.
+
+    process(chave, tipo) -> (ok, xml_bytes, msg) faz o download; retry(attempts, msg)
+    devolve o atraso para nova tentativa ou None para desistir.
+    Limite global de `concurrency` downloads e, por lote, o concurrency do lote.
+    """
+
+    def __init__(self, store: JobStore, process, retry, concurrency: int):
+        self.store = store
+        self.process = process
+        self.retry = retry
+        self.concurrency = concurrency
+        self._running: dict[str, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._changed = asyncio.Condition()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    async def wait_change(self, timeout: float) -> None:
+        # usado por quem acompanha um lote (streaming): acorda quando alguma chave termina
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _announce(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _run_one(self, batch_id: str, chave: str, tipo: str, attempts: int) -> None:
+        try:
+            try:
+                ok, data, msg = await self.process(chave, tipo)
+            except Exception as e:
+                ok, data, msg = False, None, f"Erro inesperado: {e}"
+
+            delay = None if ok else self.retry(attempts, msg)
+            if delay is None:
+                self.store.finish(batch_id, chave, bool(ok and data), msg, data)
+            else:
+                # volta para a fila com atraso; o estado fica salvo caso o conector feche
+                self.store.requeue(batch_id, chave, msg, delay)
+        finally:
+            self._running[batch_id] -= 1
+            self.notify()
+            await self._announce()
+
+    async def run(self) -> None:
+        self.store.reset_running()
+        while True:
+            self._wake.clear()
+            free = self.concurrency - sum(self._running.values())
+
+            if free > 0:
+                for batch_id, chave, tipo, attempts, batch_conc in self.store.pending():
+                    if free <= 0:
+                        break
+                    if self._running.get(batch_id, 0) >= batch_conc:
+                        continue
+                    self.store.mark_running(batch_id, chave)
+                    self._running[batch_id] = self._running.get(batch_id, 0) + 1
+                    free -= 1
+                    task = asyncio.create_task(self._run_one(batch_id, chave, tipo, attempts + 1))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+            # dorme até alguma chave terminar, chegar lote novo ou vencer um atraso de retry
+            nxt = self.store.next_wakeup()
+            now = time.time()
+            timeout = 30.0 if nxt is None or nxt <= now else min(30.0, nxt - now)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -1,15 +1,23 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 import json
 from pathlib import Path
 
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
-
-from services.sefaz import download_xml_by_key
+from connector.bulk import gzip_stream, zip_stream
+from connector.jobs import JobRunner, JobStore
+from connector.nsu_sync import NsuSync
+from connector.xml_cache import XmlCache
+from services.cert_utils import invalidate_cert_cache, load_cert_bundle, verify_pfx_bytes
+from services.rate_limit import BLOCK_656_SECONDS, retry_delay, sefaz_limiter
+from services.sefaz import download_xml_by_key_async
+from services.sefaz_nfe import NFE_DIST_URL, is_transient_failure, warmup_nfe_dist_async
+from services.soap_client import POOL_MAXSIZE, close_async_soap_clients, close_soap_sessions
 
 app = FastAPI()
 
@@ -20,6 +28,21 @@ CERT_PATH = BASE_DIR / "cert.pfx"
 CFG_PATH = BASE_DIR / "config.json"
 
 
+# limite de downloads simultâneos no lote (não passa do pool de conexões mTLS)
+MAX_BATCH_CONCURRENCY = POOL_MAXSIZE
+
+# lote: novas tentativas para falhas transitórias (rede, 5xx, 656)
+MAX_ATTEMPTS = 4
+# a fila é persistente, então dá para esperar um bloqueio 656 inteiro em vez de desistir
+MAX_RETRY_WAIT = BLOCK_656_SECONDS + 60
+
+# lotes terminados somem da fila depois de N dias
+JOBS_KEEP_DAYS = 30
+
+# formatos de saída do lote: uma linha JSON por chave, o mesmo em gzip, ou um .zip com os XMLs
+BATCH_FORMATS = ("ndjson", "ndjson.gz", "zip")
+
+
 class CertConfigReq(BaseModel):
     pfx_b64: str
     password: str
@@ -32,6 +55,20 @@ class DownloadReq(BaseModel):
     tipo: str  # NFE / CTE
 
 
+class BatchDownloadReq(BaseModel):
+    chaves: list[str]
+    tipo: str  # NFE / CTE
+    concurrency: int = 4
+    batch_id: str = ""  # reenviar o mesmo id retoma o lote (chaves concluídas não baixam de novo)
+    format: str = "ndjson"  # ndjson / ndjson.gz / zip
+    include_xml: bool = True  # False: NDJSON só com o progresso (o XML vem depois, pelo /archive)
+
+
+class NsuConfigReq(BaseModel):
+    interval_min: int = 0  # 0 = sem agendamento (mínimo efetivo: 60)
+    cuf_autor: str = ""
+
+
 def so_digitos(s: str) -> str:
     return "".join(c for c in (s or "") if c.isdigit())
 
@@ -46,27 +83,84 @@ def save_cfg(cfg: dict) -> None:
     CFG_PATH.write_text(json.dumps(cfg, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
-def verify_pfx_bytes(pfx_bytes: bytes, password: str) -> tuple[bool, str]:
+def _make_cache() -> XmlCache:
+    cfg = load_cfg()
+    return XmlCache(
+        BASE_DIR / "cache",
+        max_bytes=int(cfg.get("cache_max_mb", 512)) * 1024 * 1024,
+        res_ttl=int(cfg.get("cache_res_ttl_h", 6)) * 3600,
+    )
+
+
+xml_cache = _make_cache()
+nsu_sync = NsuSync(BASE_DIR, xml_cache=xml_cache)
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> asyncio.Task:
+    # guarda referência para a task não ser coletada antes de terminar
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+job_store = JobStore(BASE_DIR / "jobs.sqlite")
+
+
+async def _job_process(chave: str, tipo: str) -> tuple[bool, bytes | None, str]:
+    # bytes originais do docZip/cache: o lote guarda e entrega o XML sem recodificar
+    ok, data, msg = await download_cached(chave, tipo, sefaz_args(load_cfg()), raw=True)
+    return ok, data if ok and data else None, msg
+
+
+def _job_retry(attempts: int, msg: str) -> float | None:
     """
-    Verifica se o PFX abre com a senha e se existe chave privada.
+    Atraso até a próxima tentativa (exponencial com jitter, ou o fim do bloqueio 656),
+    ou None para encerrar a chave com erro.
     """
-    try:
-        key, cert, _ = load_key_and_certificates(pfx_bytes, password.encode("utf-8"))
-        if key is None or cert is None:
-            return False, "PFX não contém chave privada/certificado (ou senha errada)."
-        subj = cert.subject.rfc4514_string()
-        return True, f"OK: certificado lido. Subject={subj}"
-    except Exception as e:
-        return False, f"Falha ao ler PFX (senha errada ou arquivo inválido): {e}"
+    if attempts >= MAX_ATTEMPTS or not is_transient_failure(msg):
+        return None
+    cnpj = so_digitos(load_cfg().get("cnpj", ""))
+    delay = max(retry_delay(attempts), sefaz_limiter.blocked_for(cnpj, NFE_DIST_URL))
+    return None if delay > MAX_RETRY_WAIT else delay
+
+
+job_runner = JobRunner(job_store, _job_process, _job_retry, MAX_BATCH_CONCURRENCY)
+
+
+@app.on_event("startup")
+async def startup():
+    cfg = load_cfg()
+    sefaz_limiter.configure(cfg.get("sefaz_rate_per_min"), cfg.get("sefaz_burst"))
+
+    # aquecimento opcional: abre a conexão mTLS com a SEFAZ em segundo plano
+    if cfg.get("warmup", True):
+        _spawn(warmup_nfe_dist_async(cfg.get("pfx_path"), cfg.get("pfx_password")))
+
+    # sincronização NSU agendada (só roda se nsu_sync_interval_min > 0)
+    _spawn(nsu_sync.scheduler(load_cfg, sefaz_args))
+
+    # fila de lotes: retoma o que ficou pendente quando o conector foi fechado
+    job_store.purge(JOBS_KEEP_DAYS)
+    _spawn(job_runner.run())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_async_soap_clients()
+    close_soap_sessions()
 
 
 @app.get("/ping")
-def ping():
+async def ping():
     return {"ok": True, "msg": "Conector local rodando"}
 
 
 @app.get("/status")
-def status():
+async def status():
     cfg = load_cfg()
     return {
         "ok": True,
@@ -74,23 +168,30 @@ def status():
         "has_password": bool(cfg.get("pfx_password")),
         "has_cnpj": bool(cfg.get("cnpj")),
         "tp_amb": cfg.get("tp_amb", 1),
+        "nsu_sync_interval_min": cfg.get("nsu_sync_interval_min", 0),
+        "cache": xml_cache.stats(),
+        "limiter": sefaz_limiter.snapshot(),
     }
 
 
 @app.get("/cert/verify")
-def cert_verify():
+async def cert_verify():
     cfg = load_cfg()
     if not CERT_PATH.exists():
         return {"ok": False, "msg": "Ainda não há cert.pfx salvo no conector."}
     if not cfg.get("pfx_password"):
         return {"ok": False, "msg": "Não há senha salva no conector."}
 
-    ok, msg = verify_pfx_bytes(CERT_PATH.read_bytes(), cfg["pfx_password"])
-    return {"ok": ok, "msg": msg}
+    # usa o mesmo cache do download (não decifra o PFX de novo a cada verificação)
+    try:
+        bundle = load_cert_bundle(str(CERT_PATH), cfg["pfx_password"])
+    except Exception as e:
+        return {"ok": False, "msg": f"Falha ao ler PFX (senha errada ou arquivo inválido): {e}"}
+    return {"ok": True, "msg": f"OK: certificado lido. Subject={bundle.subject}", "valid_until": bundle.not_after}
 
 
 @app.post("/config/cert")
-def config_cert(req: CertConfigReq):
+async def config_cert(req: CertConfigReq):
     if not req.password:
         return {"ok": False, "msg": "Senha do certificado é obrigatória."}
 
@@ -110,27 +211,202 @@ def config_cert(req: CertConfigReq):
     cfg["tp_amb"] = int(req.tp_amb or 1)
     save_cfg(cfg)
 
+    # certificado novo: descarta o cache e as conexões abertas com o certificado antigo
+    invalidate_cert_cache()
+    await close_async_soap_clients()
+    close_soap_sessions()
+
     return {"ok": True, "msg": "Certificado salvo e validado no conector local."}
 
 
+def sefaz_args(cfg: dict) -> dict:
+    """
+    Parâmetros de certificado/ambiente para as chamadas à SEFAZ.
+    """
+    return {
+        "pfx_path": cfg.get("pfx_path") or (str(CERT_PATH) if CERT_PATH.exists() else ""),
+        "pfx_password": cfg.get("pfx_password", ""),
+        "cnpj": cfg.get("cnpj", ""),
+        "tp_amb": int(cfg.get("tp_amb", 1)),
+    }
+
+
+async def download_cached(
+    chave: str, tipo: str, args: dict, raw: bool = False
+) -> tuple[bool, str | bytes | None, str]:
+    """
+    download_xml_by_key_async passando antes pelo cache local.
+    Evita repetir na SEFAZ chaves já baixadas (conta para o limite de consumo indevido).
+    Com raw=True devolve os bytes originais do XML em vez de texto.
+    """
+    ch = so_digitos(chave)
+    hit = xml_cache.get(ch, raw=raw)
+    if hit:
+        xml_text, schema = hit
+        return True, xml_text, f"OK (cache local) | schema={schema}"
+
+    ok, xml_text, msg = await download_xml_by_key_async(chave=chave, tipo=tipo, raw=raw, **args)
+    if ok and xml_text:
+        xml_cache.put(ch, xml_text)
+    return ok, xml_text, msg
+
+
 @app.post("/download")
-def download(req: DownloadReq):
-    cfg = load_cfg()
-    pfx_path = cfg.get("pfx_path") or (str(CERT_PATH) if CERT_PATH.exists() else "")
-    pfx_password = cfg.get("pfx_password", "")
-    cnpj = cfg.get("cnpj", "")
-    tp_amb = int(cfg.get("tp_amb", 1))
-
-    ok, xml_text, msg = download_xml_by_key(
-        chave=req.chave,
-        tipo=req.tipo,
-        pfx_path=pfx_path,
-        pfx_password=pfx_password,
-        cnpj=cnpj,
-        tp_amb=tp_amb,
-    )
+async def download(req: DownloadReq):
+    ok, xml_text, msg = await download_cached(req.chave, req.tipo, sefaz_args(load_cfg()))
 
     if not ok or not xml_text:
         return {"ok": False, "msg": msg}
 
-    return {"ok": True, "msg": msg, "xml": xml_text}
\ No newline at end of file
+    return {"ok": True, "msg": msg, "xml": xml_text}
+
+
+def _job_item(row: tuple, tipo: str, include_xml: bool = True) -> dict:
+    seq, idx, chave, state, attempts, msg, result = row
+    item = {
+        "index": idx,
+        "chave": chave,
+        "tipo": tipo,
+        "ok": state == "done",
+        "msg": msg,
+        "attempts": attempts,
+    }
+    if item["ok"] and include_xml:
+        item["xml"] = result.decode("utf-8", errors="replace")
+    return item
+
+
+async def _batch_rows(batch_id: str, after_seq: int = 0, follow: bool = True):
+    """
+    Chaves do lote conforme terminam, em rajadas (o que ficou pronto desde a última leitura).
+    Com follow, acompanha o lote até a última chave; se o cliente desconectar,
+    o lote continua rodando na fila e pode ser retomado pelo batch_id.
+    """
+    seq = after_seq
+    while True:
+        rows = job_store.results(batch_id, seq)
+        if rows:
+            seq = rows[-1][0]
+            yield rows
+            continue
+        summ = job_store.summary(batch_id)
+        if not follow or not summ or summ["finished"]:
+            break
+        await job_runner.wait_change(2)
+
+
+async def _ndjson_chunks(batch_id: str, tipo: str, include_xml: bool, **kw):
+    async for rows in _batch_rows(batch_id, **kw):
+        yield "".join(
+            json.dumps(_job_item(row, tipo, include_xml), ensure_ascii=False) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+async def _zip_entries(batch_id: str, tipo: str, **kw):
+    # um arquivo por XML baixado (mesmo nome que a extensão usa) + resultado.ndjson no fim
+    manifest = []
+    async for rows in _batch_rows(batch_id, **kw):
+        files = []
+        for row in rows:
+            item = _job_item(row, tipo, include_xml=False)
+            manifest.append(json.dumps(item, ensure_ascii=False) + "\n")
+            if item["ok"]:
+                files.append((f"{tipo}_{item['chave']}.xml", row[6]))
+        yield files
+    yield [("resultado.ndjson", "".join(manifest).encode("utf-8"))]
+
+
+def _batch_response(batch_id: str, tipo: str, fmt: str, include_xml: bool = True, **kw):
+    headers = {"X-Batch-Id": batch_id}
+    if fmt == "zip":
+        headers["Content-Disposition"] = f'attachment; filename="{tipo}_lote_{batch_id}.zip"'
+        return StreamingResponse(
+            zip_stream(_zip_entries(batch_id, tipo, **kw)), media_type="application/zip", headers=headers
+        )
+
+    chunks = _ndjson_chunks(batch_id, tipo, include_xml, **kw)
+    if fmt == "ndjson.gz":
+        # Content-Encoding: o fetch do navegador descompacta sozinho, linha a linha
+        headers["Content-Encoding"] = "gzip"
+        chunks = gzip_stream(chunks)
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
+
+
+@app.post("/download/batch")
+async def download_batch(req: BatchDownloadReq):
+    tipo = (req.tipo or "").upper()
+    concurrency = max(1, min(int(req.concurrency or 1), MAX_BATCH_CONCURRENCY))
+    fmt = (req.format or "ndjson").lower()
+    if fmt not in BATCH_FORMATS:
+        return {"ok": False, "msg": f"Formato inválido (use {', '.join(BATCH_FORMATS)})."}
+
+    # remove duplicadas mantendo a ordem
+    chaves = list(dict.fromkeys(so_digitos(c) for c in req.chaves if so_digitos(c)))
+    if not chaves:
+        return {"ok": False, "msg": "Nenhuma chave válida no lote."}
+
+    batch_id = job_store.create_batch(tipo, chaves, concurrency, batch_id=req.batch_id.strip())
+    job_runner.notify()
+
+    return _batch_response(batch_id, tipo, fmt, include_xml=req.include_xml)
+
+
+@app.get("/jobs")
+async def jobs_list():
+    return {"ok": True, "batches": job_store.list_batches()}
+
+
+@app.get("/jobs/{batch_id}")
+async def jobs_status(batch_id: str):
+    summ = job_store.summary(batch_id)
+    if not summ:
+        return {"ok": False, "msg": "Lote não encontrado."}
+    return {"ok": True, **summ}
+
+
+@app.get("/jobs/{batch_id}/results")
+async def jobs_results(batch_id: str, after_seq: int = 0, follow: bool = False, format: str = "ndjson"):
+    summ = job_store.summary(batch_id)
+    if not summ:
+        return {"ok": False, "msg": "Lote não encontrado."}
+    if format not in BATCH_FORMATS:
+        return {"ok": False, "msg": f"Formato inválido (use {', '.join(BATCH_FORMATS)})."}
+    return _batch_response(batch_id, summ["tipo"], format, after_seq=after_seq, follow=follow)
+
+
+@app.get("/jobs/{batch_id}/archive")
+async def jobs_archive(batch_id: str):
+    """
+    .zip com todos os XMLs do lote (espera o lote terminar). A extensão baixa direto daqui.
+    """
+    summ = job_store.summary(batch_id)
+    if not summ:
+        return {"ok": False, "msg": "Lote não encontrado."}
+    return _batch_response(batch_id, summ["tipo"], "zip")
+
+
+@app.get("/sync/nsu")
+async def sync_nsu_status():
+    cfg = load_cfg()
+    cnpj = so_digitos(cfg.get("cnpj", ""))
+    return {
+        "ok": True,
+        "running": nsu_sync.running,
+        "interval_min": cfg.get("nsu_sync_interval_min", 0),
+        "state": nsu_sync.load_state().get(cnpj, {}),
+    }
+
+
+@app.post("/sync/nsu")
+async def sync_nsu_run():
+    cfg = load_cfg()
+    return await nsu_sync.run(sefaz_args(cfg), cuf_autor=cfg.get("cuf_autor", ""))
+
+
+@app.post("/config/nsu")
+async def config_nsu(req: NsuConfigReq):
+    cfg = load_cfg()
+    cfg["nsu_sync_interval_min"] = max(0, int(req.interval_min or 0))
+    cfg["cuf_autor"] = so_digitos(req.cuf_autor)
+    save_cfg(cfg)
+    return {"ok": True, "msg": "Agendamento NSU salvo no conector local."}
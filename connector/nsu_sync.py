@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from services.sefaz_nfe import sync_nfe_dist_nsu_async
+from services.xml_utils import extract_key_and_type
+
+log = logging.getLogger(__name__)
+
+# SEFAZ: depois de cStat=137 (nada novo) ou de chegar ao maxNSU só pode consultar de novo
+# em 1 hora (antes disso responde 656, consumo indevido)
+MIN_INTERVAL_MIN = 60
+
+
+class NsuSync:
+    """
+    Sincronização incremental por NSU (distNSU) para o CNPJ configurado.
+
+    Os documentos vão para <base_dir>/nsu/<cnpj>/<NSU>_<schema>.xml e o cursor
+    (ultNSU) fica em <base_dir>/nsu_state.json, por CNPJ. Se houver xml_cache,
+    cada procNFe (nota completa) também entra no cache de /download.
+    """
+
+    def __init__(self, base_dir: Path, xml_cache=None):
+        self.docs_dir = base_dir / "nsu"
+        self.state_path = base_dir / "nsu_state.json"
+        self.xml_cache = xml_cache
+        self._lock = asyncio.Lock()
+
+    def load_state(self) -> dict:
+        if self.state_path.exists():
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        return {}
+
+    def _save_state(self, state: dict) -> None:
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(self.state_path)
+
+    def _update_state(self, cnpj: str, **fields) -> dict:
+        state = self.load_state()
+        st = state.setdefault(cnpj, {"ult_nsu": "0"})
+        st.update(fields)
+        self._save_state(state)
+        return st
+
+    def store_doc(self, cnpj: str, doc: dict) -> Path:
+        # "procNFe_v4.00.xsd" -> "procNFe"
+        schema = re.sub(r"[^A-Za-z0-9]", "", (doc.get("schema") or "doc").split("_")[0]) or "doc"
+        nsu = "".join(c for c in (doc.get("nsu") or "") if c.isdigit()) or "0"
+
+        folder = self.docs_dir / cnpj
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"{int(nsu):015d}_{schema}.xml"
+        # grava os bytes originais do docZip (sem decodificar para texto)
+        data = doc.get("xml_bytes") or doc.get("xml", "").encode("utf-8")
+        path.write_bytes(data)
+
+        # só a nota completa vai para o cache de /download: resumo e eventos trazem a mesma
+        # chave (chNFe) e, gravados depois, trocariam a nota pelo evento
+        if self.xml_cache is not None and schema == "procNFe":
+            chave, _ = extract_key_and_type(doc.get("xml", ""))
+            if chave:
+                self.xml_cache.put(chave, data)
+        return path
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, args: dict, cuf_autor: str = "") -> dict:
+        """
+        Uma execução completa (até alcançar o maxNSU). Não roda duas ao mesmo tempo.
+        """
+        cnpj = "".join(c for c in (args.get("cnpj") or "") if c.isdigit())
+        if len(cnpj) != 14:
+            return {"ok": False, "msg": "Falta informar CNPJ (14 dígitos) do certificado no conector."}
+
+        if self._lock.locked():
+            return {"ok": False, "msg": "Sincronização NSU já está em andamento."}
+
+        async with self._lock:
+            st = self.load_state().get(cnpj, {})
+            # vale para o agendamento e para o POST /sync/nsu manual
+            next_allowed = st.get("next_allowed", "")
+            if next_allowed and datetime.now() < datetime.fromisoformat(next_allowed):
+                return {
+                    "ok": False,
+                    "msg": f"SEFAZ só permite nova consulta NSU a partir de {next_allowed[11:16]} "
+                           "(1 hora depois de não haver documentos novos).",
+                }
+
+            started = datetime.now()
+            try:
+                result = await sync_nfe_dist_nsu_async(
+                    ult_nsu=st.get("ult_nsu", "0"),
+                    on_doc=lambda doc: self.store_doc(cnpj, doc),
+                    on_cursor=lambda ult, mx: self._update_state(cnpj, ult_nsu=ult, max_nsu=mx),
+                    cuf_autor=cuf_autor,
+                    **args,
+                )
+            except Exception as e:
+                log.exception("Falha na sincronização NSU do CNPJ %s", cnpj)
+                result = {"ok": False, "cStat": "", "msg": f"Erro inesperado: {e}", "docs": 0}
+
+            # 656 (consumo indevido) também bloqueia por 1 hora
+            wait = result.get("cStat") in ("137", "656") or (
+                result.get("ok") and result.get("max_nsu") and int(result["ult_nsu"]) >= int(result["max_nsu"])
+            )
+            self._update_state(
+                cnpj,
+                last_run=started.isoformat(timespec="seconds"),
+                last_cstat=result.get("cStat", ""),
+                last_msg=result.get("msg", ""),
+                last_docs=result.get("docs", 0),
+                next_allowed=(datetime.now() + timedelta(minutes=MIN_INTERVAL_MIN)).isoformat(timespec="seconds")
+                if wait else "",
+            )
+            return result
+
+    async def scheduler(self, get_cfg, get_args) -> None:
+        """
+        Loop do agendamento: roda a cada cfg['nsu_sync_interval_min'] minutos (0 = desligado).
+        A config é relida a cada volta, então ligar/desligar não precisa reiniciar o conector.
+        """
+        while True:
+            cfg = get_cfg()
+            interval = int(cfg.get("nsu_sync_interval_min") or 0)
+            if interval > 0:
+                try:
+                    result = await self.run(get_args(cfg), cuf_autor=cfg.get("cuf_autor", ""))
+                    if not result.get("ok"):
+                        log.warning("Sincronização NSU agendada: %s", result.get("msg"))
+                except Exception:
+                    log.exception("Falha na sincronização NSU agendada")
+                await asyncio.sleep(max(interval, MIN_INTERVAL_MIN) * 60)
+            else:
+                await asyncio.sleep(60)
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# tag raiz -> schema guardado no cache
+_ROOT_RE = re.compile(r"<(?:[\w.-]+:)?(nfeProc|NFe|resNFe|procEventoNFe|resEvento|cteProc|CTe)[\s>/]")
+_SCHEMAS = {
+    "nfeProc": "procNFe",
+    "NFe": "NFe",
+    "resNFe": "resNFe",
+    "procEventoNFe": "procEventoNFe",
+    "resEvento": "resEvento",
+    "cteProc": "procCTe",
+    "CTe": "CTe",
+}
+
+# encoding da declaração <?xml ... encoding="..."?>
+_ENCODING_RE = re.compile(rb"""^\s*<\?xml[^>]*\bencoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+
+# ordem de preferência ao servir uma chave (documento completo primeiro)
+_FULL_SCHEMAS = ("procNFe", "procCTe", "NFe", "CTe")
+
+
+def detect_schema(xml: str | bytes) -> str:
+    head = xml[:4096]
+    if isinstance(head, bytes):
+        head = head.decode("latin-1")
+    m = _ROOT_RE.search(head or "")
+    return _SCHEMAS.get(m.group(1), "") if m else ""
+
+
+def _decode(data: bytes) -> str:
+    # respeita o encoding declarado (há NF-e em ISO-8859-1); sem declaração, UTF-8 como o DistDoc
+    m = _ENCODING_RE.match(data[:200])
+    encoding = m.group(1).decode("ascii") if m else "utf-8"
+    try:
+        return data.decode(encoding, errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
+
+
+class XmlCache:
+    """
+    Cache local de XMLs por (chave, schema), com conteúdo endereçado por sha256.
+
+    - procNFe/procCTe não expiram (o documento autorizado não muda);
+    - resNFe (resumo) expira em res_ttl segundos, porque depois vira procNFe;
+    - quando passa de max_bytes, remove os menos usados (LRU).
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 512 * 1024 * 1024, res_ttl: int = 6 * 3600):
+        self.objects_dir = cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.res_ttl = res_ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(cache_dir / "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                chave TEXT NOT NULL,
+                schema TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (chave, schema)
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_entries_last_access ON entries(last_access)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_entries_sha256 ON entries(sha256)")
+        self._db.commit()
+
+        # tamanho real em disco: objetos iguais contam uma vez só
+        self._bytes = int(self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT sha256, MAX(size) AS size FROM entries GROUP BY sha256)"
+        ).fetchone()[0])
+
+    def _object_path(self, sha: str) -> Path:
+        return self.objects_dir / sha[:2] / f"{sha}.xml"
+
+    def get(self, chave: str, raw: bool = False) -> tuple[str | bytes, str] | None:
+        """
+        Devolve (xml_text, schema) do melhor documento da chave, ou None.
+        Com raw=True devolve os bytes guardados, sem decodificar.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT schema, sha256, created_at FROM entries WHERE chave = ?", (chave,)
+            ).fetchall()
+            by_schema = {r[0]: r for r in rows}
+
+            pick = next((by_schema[s] for s in _FULL_SCHEMAS if s in by_schema), None)
+            if pick is None and "resNFe" in by_schema and now - by_schema["resNFe"][2] < self.res_ttl:
+                pick = by_schema["resNFe"]
+
+            path = self._object_path(pick[1]) if pick else None
+            if path is None or not path.exists():
+                self.misses += 1
+                return None
+
+            self._db.execute(
+                "UPDATE entries SET last_access = ? WHERE chave = ? AND schema = ?", (now, chave, pick[0])
+            )
+            self._db.commit()
+
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return (data if raw else _decode(data)), pick[0]
+
+    def put(self, chave: str, xml: str | bytes, schema: str = "") -> str:
+        """
+        Guarda o XML da chave (texto ou os bytes originais do docZip).
+        Retorna o schema detectado ("" = não cacheável).
+        """
+        schema = schema or detect_schema(xml or "")
+        if not chave or not schema:
+            return ""
+
+        data = xml if isinstance(xml, bytes) else xml.encode("utf-8")
+        sha = hashlib.sha256(data).hexdigest()
+        path = self._object_path(sha)
+        now = time.time()
+
+        with self._lock:
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                tmp.write_bytes(data)
+                tmp.replace(path)
+                self._bytes += len(data)
+
+            old = self._db.execute(
+                "SELECT sha256 FROM entries WHERE chave = ? AND schema = ?", (chave, schema)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (chave, schema, sha256, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chave, schema, sha, len(data), now, now),
+            )
+            if schema in _FULL_SCHEMAS:
+                # chegou o documento completo: o resumo não serve mais
+                self._delete_entry(chave, "resNFe")
+            if old and old[0] != sha:
+                self._drop_object_if_unused(old[0])
+            self._evict()
+            self._db.commit()
+
+        return schema
+
+    def _delete_entry(self, chave: str, schema: str) -> int:
+        # devolve quantos bytes saíram do disco
+        row = self._db.execute(
+            "SELECT sha256 FROM entries WHERE chave = ? AND schema = ?", (chave, schema)
+        ).fetchone()
+        if not row:
+            return 0
+        self._db.execute("DELETE FROM entries WHERE chave = ? AND schema = ?", (chave, schema))
+        return self._drop_object_if_unused(row[0])
+
+    def _drop_object_if_unused(self, sha: str) -> int:
+        used = self._db.execute("SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1", (sha,)).fetchone()
+        if used:
+            return 0
+        path = self._object_path(sha)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        self._bytes -= size
+        return size
+
+    def _evict(self) -> None:
+        if self._bytes <= self.max_bytes:
+            return
+
+        # poucas entradas por vez, pelo índice de last_access: não carrega o índice inteiro a cada put
+        while self._bytes > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT chave, schema FROM entries ORDER BY last_access ASC LIMIT 32"
+            ).fetchall()
+            if not rows:
+                break
+            for chave, schema in rows:
+                if self._bytes <= self.max_bytes:
+                    break
+                self._delete_entry(chave, schema)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            total = self._bytes
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
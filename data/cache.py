@@ -0,0 +1,113 @@
+"""
+Cache de leitura do repo, compartilhado por todas as sessões do Streamlit (um por processo).
+
+Cada gravação em xml_docs chama bump_version(), que descarta o que foi lido antes.
+Gravações de outro processo (tools/*) não avisam este: para elas vale o TTL.
+Os valores são compartilhados entre sessões: quem recebe não deve alterá-los.
+"""
+from __future__ import annotations
+
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+CACHE_TTL = float(os.getenv("XSIST_CACHE_TTL", "60"))  # segundos
+CACHE_MB = float(os.getenv("XSIST_CACHE_MB", "64"))  # teto do cache de XMLs
+
+_version = 0
+_version_lock = threading.Lock()
+
+
+def bump_version() -> None:
+    global _version
+    with _version_lock:
+        _version += 1
+
+
+def data_version() -> int:
+    return _version
+
+
+class LRUCache:
+    """
+    LRU limitado por quantidade de itens e, opcionalmente, por tamanho (weigh(valor) em bytes).
+    """
+
+    def __init__(self, maxsize: int, max_bytes: int = 0, weigh: Callable | None = None, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.weigh = weigh
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expira_em, peso, valor)
+        self._bytes = 0
+        self._version = _version
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _check_version(self) -> None:
+        # chamado com self._lock
+        if self._version != _version:
+            self._data.clear()
+            self._bytes = 0
+            self._version = _version
+
+    def get(self, key):
+        with self._lock:
+            self._check_version()
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                self.misses += 1
+                return None, False
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[2], True
+
+    def put(self, key, value, version: int) -> None:
+        weight = self.weigh(value) if self.weigh else 0
+        with self._lock:
+            self._check_version()
+            if version != self._version:
+                return  # lido antes de uma gravação: já nasce velho
+            if self.max_bytes and weight > self.max_bytes:
+                return
+            old = self._data.pop(key, None)
+            if old:
+                self._bytes -= old[1]
+            self._data[key] = (time.monotonic() + self.ttl, weight, value)
+            self._bytes += weight
+            while len(self._data) > self.maxsize or (self.max_bytes and self._bytes > self.max_bytes):
+                _, (_, w, _) = self._data.popitem(last=False)
+                self._bytes -= w
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+def cached(maxsize: int = 256, max_bytes: int = 0, weigh: Callable | None = None):
+    """
+    Decorator read-through: mesma chamada (args/kwargs) devolve o valor em memória
+    até a próxima gravação (bump_version) ou o TTL.
+    """
+    def deco(fn):
+        cache = LRUCache(maxsize, max_bytes, weigh)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            value, hit = cache.get(key)
+            if hit:
+                return value
+            version = _version
+            value = fn(*args, **kwargs)
+            cache.put(key, value, version)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return deco
@@ -1,17 +1,304 @@
 import os
+import threading
+from datetime import datetime
+
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, make_url, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# pool/conexão (variáveis de ambiente ou .env)
+DB_POOL_SIZE = int(os.getenv("XSIST_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("XSIST_DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("XSIST_DB_POOL_RECYCLE", "1800"))  # segundos
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("XSIST_DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 = sem limite
+# psycopg 3: prepara a query depois de N execuções; "off" desliga (pgbouncer em modo transaction)
+DB_PREPARE_THRESHOLD = os.getenv("XSIST_DB_PREPARE_THRESHOLD", "5").lower()
+
+
+def _engine_kwargs(url: str) -> dict:
+    u = make_url(url)
+    if u.get_backend_name() != "postgresql":
+        return {}
+
+    connect_args: dict = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    if u.get_driver_name() == "psycopg":
+        connect_args["prepare_threshold"] = (
+            None if DB_PREPARE_THRESHOLD in ("off", "none", "0") else int(DB_PREPARE_THRESHOLD)
+        )
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "connect_args": connect_args,
+    }
+
+
+engine = create_engine(DATABASE_URL, pool_pre_ping=True, **_engine_kwargs(DATABASE_URL))
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 class Base(DeclarativeBase):
     pass
 
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
 def init_db():
+    """
+    Cria/atualiza o schema uma vez por processo. As páginas chamam a cada rerun do
+    Streamlit; depois da primeira vez é só um if.
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            migrate()
+            _initialized = True
+
+
+def migrate() -> int:
+    """
+    Aplica as migrações que faltam (tabela schema_version) e retorna a versão final.
+    Banco novo: create_all já cria tudo na versão atual e as migrações só conferem.
+    """
     from data import models  # garante que as tabelas (models) foram carregadas
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # dois processos subindo juntos (site + ferramenta) não migram ao mesmo tempo
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('xsist_schema'))"))
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            " version INTEGER PRIMARY KEY,"
+            " description VARCHAR(200) NOT NULL,"
+            " applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        current = conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+        if current >= MIGRATIONS[-1][0]:
+            return current
+
+        Base.metadata.create_all(bind=conn)
+        for version, fn in MIGRATIONS:
+            if version <= current:
+                continue
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                {"v": version, "d": (fn.__doc__ or fn.__name__).strip().splitlines()[0][:200]},
+            )
+            current = version
+    return current
+
+
+def _m001_xml_docs_unique(conn) -> None:
+    """
+    UNIQUE (chave, tipo) em xml_docs.
+    Bancos antigos: apaga as duplicadas (fica a de maior id, a última gravada) e cria a constraint.
+    """
+    names = {u["name"] for u in inspect(conn).get_unique_constraints("xml_docs")}
+    if "uq_xml_docs_chave_tipo" in names:
+        return
+
+    conn.execute(text(
+        """
+        DELETE FROM xml_docs d
+        USING xml_docs n
+        WHERE d.chave = n.chave AND d.tipo = n.tipo AND d.id < n.id
+        """
+    ))
+    conn.execute(text(
+        "ALTER TABLE xml_docs ADD CONSTRAINT uq_xml_docs_chave_tipo UNIQUE (chave, tipo)"
+    ))
+
+
+def _m002_xml_docs_compressed(conn) -> None:
+    """
+    Coluna xml_data (XML compactado) e xml_text liberado para NULL.
+    """
+    cols = {c["name"]: c for c in inspect(conn).get_columns("xml_docs")}
+    if "xml_data" in cols and cols["xml_text"]["nullable"]:
+        return
+
+    conn.execute(text("ALTER TABLE xml_docs ADD COLUMN IF NOT EXISTS xml_data BYTEA"))
+    conn.execute(text("ALTER TABLE xml_docs ALTER COLUMN xml_text DROP NOT NULL"))
+
+
+def _m003_xml_docs_metadata(conn) -> None:
+    """
+    Colunas de metadados fiscais em xml_docs.
+    As linhas antigas ficam com schema NULL até rodar tools/backfill_xml_metadata.py.
+    """
+    cols = {c["name"] for c in inspect(conn).get_columns("xml_docs")}
+    if "schema" in cols:
+        return
+
+    conn.execute(text(
+        """
+        ALTER TABLE xml_docs
+            ADD COLUMN IF NOT EXISTS emit_cnpj VARCHAR(14),
+            ADD COLUMN IF NOT EXISTS emit_nome VARCHAR(200),
+            ADD COLUMN IF NOT EXISTS dest_doc VARCHAR(14),
+            ADD COLUMN IF NOT EXISTS dest_nome VARCHAR(200),
+            ADD COLUMN IF NOT EXISTS dh_emi TIMESTAMP WITH TIME ZONE,
+            ADD COLUMN IF NOT EXISTS valor NUMERIC(15, 2),
+            ADD COLUMN IF NOT EXISTS serie INTEGER,
+            ADD COLUMN IF NOT EXISTS numero INTEGER,
+            ADD COLUMN IF NOT EXISTS schema VARCHAR(20)
+        """
+    ))
+
+
+def _m004_indexes(conn) -> None:
+    """
+    Índices dos models que ainda não existem (metadados, listagem paginada).
+    """
+    _create_missing_indexes(conn)
+
+
+def _create_missing_indexes(conn) -> None:
+    # create_all só cria índice junto com a tabela nova.
+    # Os models já estão na versão final: índice de coluna que uma migração posterior
+    # ainda vai criar (ex.: search_tsv antes da 5) fica para ela.
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        have = {i["name"] for i in insp.get_indexes(table.name)}
+        cols = {c["name"] for c in insp.get_columns(table.name)}
+        for idx in table.indexes:
+            if idx.name not in have and {c.name for c in idx.columns} <= cols:
+                idx.create(bind=conn)
+
+
+def _m005_xml_docs_search(conn) -> None:
+    """
+    Busca em xml_docs: search_text, tsvector gerado (GIN) e índice trigram (pg_trgm).
+    As linhas antigas entram na busca depois do tools/backfill_xml_metadata.py.
+    """
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text("ALTER TABLE xml_docs ADD COLUMN IF NOT EXISTS search_text TEXT"))
+    conn.execute(text(
+        "ALTER TABLE xml_docs ADD COLUMN IF NOT EXISTS search_tsv tsvector"
+        " GENERATED ALWAYS AS (to_tsvector('portuguese'::regconfig, coalesce(search_text, ''))) STORED"
+    ))
+    _create_missing_indexes(conn)
+    _create_search_trgm_index(conn)
+
+
+def _create_search_trgm_index(conn) -> None:
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_xml_docs_search_trgm ON xml_docs USING gin (search_text gin_trgm_ops)"
+    ))
+
+
+def _m006_partitions(conn) -> None:
+    """
+    Partição mensal: xml_docs por mes (AAMM da chave) e downloads por created_at.
+    Bancos antigos: as tabelas são recriadas particionadas e os dados copiados
+    (uma vez só, mas demora em base grande: rode fora do horário de uso).
+    """
+    from data.models import DownloadEvent, XmlDoc
+    from data.partitions import KEY_MONTH_SQL, create_partitions, month_start, next_month
+
+    if _repartition(conn, XmlDoc.__table__, KEY_MONTH_SQL, {"mes": KEY_MONTH_SQL}):
+        _create_search_trgm_index(conn)
+    _repartition(conn, DownloadEvent.__table__, "date_trunc('month', created_at)::date", {})
+
+    this_month = month_start(datetime.utcnow())
+    create_partitions(conn, "downloads", [this_month, next_month(this_month)])
+
+
+def _repartition(conn, table, month_sql: str, new_cols: dict[str, str]) -> bool:
+    """
+    Troca uma tabela comum pela versão particionada do model, mantendo ids e sequence.
+    month_sql: mês (date) de cada linha antiga; new_cols: coluna nova -> expressão SQL.
+    Retorna False se a tabela já era particionada.
+    """
+    from data.partitions import create_partitions
+
+    name = table.name
+    old = f"{name}_unpart"
+    kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": name}).scalar()
+    if kind == "p":
+        return False
+
+    # nomes de índice/constraint/sequence são do schema todo: libera para a tabela nova
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {old}"))
+    for (cname,) in conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype IN ('p', 'u')"
+    ), {"t": old}).all():
+        conn.execute(text(f'ALTER TABLE {old} DROP CONSTRAINT "{cname}"'))
+    for (iname,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": old}).all():
+        conn.execute(text(f'DROP INDEX "{iname}"'))
+    seq = conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": old}).scalar()
+    if seq:
+        conn.execute(text(f"ALTER SEQUENCE {seq} OWNED BY NONE"))
+        conn.execute(text(f"ALTER SEQUENCE {seq} RENAME TO {name}_id_seq_unpart"))
+
+    table.create(bind=conn)
+    months = conn.execute(text(f"SELECT DISTINCT {month_sql} FROM {old}")).scalars().all()
+    create_partitions(conn, name, months)
+
+    # só as colunas que a tabela antiga tem; as das migrações seguintes (ex.: xml_sha256) ficam NULL
+    old_cols = {c["name"] for c in inspect(conn).get_columns(old)}
+    cols = [c.name for c in table.columns if c.computed is None and (c.name in old_cols or c.name in new_cols)]
+    conn.execute(text(
+        f"INSERT INTO {name} ({', '.join(cols)}) SELECT {', '.join(new_cols.get(c, c) for c in cols)} FROM {old}"
+    ))
+    conn.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE((SELECT MAX(id) FROM {name}), 0) + 1, false)"
+    ))
+    conn.execute(text(f"DROP TABLE {old}"))
+    if seq:
+        conn.execute(text(f"DROP SEQUENCE {name}_id_seq_unpart"))
+    return True
+
+
+def _m007_xml_docs_sha256(conn) -> None:
+    """
+    Coluna xml_sha256 (hash do conteúdo) em xml_docs.
+    """
+    conn.execute(text("ALTER TABLE xml_docs ADD COLUMN IF NOT EXISTS xml_sha256 BYTEA"))
+
+
+def _m008_xml_doc_items(conn) -> None:
+    """
+    Tabela xml_doc_items (itens das NF-e), particionada como xml_docs.
+    Itens dos XMLs já gravados: tools/backfill_xml_metadata.py --items.
+    """
+    from data.models import XmlDocItem
+
+    XmlDocItem.__table__.create(bind=conn, checkfirst=True)
+
+
+def _m009_summaries(conn) -> None:
+    """
+    Tabelas de totais do painel; todos os meses já gravados ficam marcados para cálculo.
+    """
+    from data.models import DocTotal, ItemTotal, SummaryDirty
+
+    for model in (DocTotal, ItemTotal, SummaryDirty):
+        model.__table__.create(bind=conn, checkfirst=True)
+    conn.execute(text(
+        "INSERT INTO summary_dirty (mes, marked_at) SELECT DISTINCT mes, clock_timestamp() FROM xml_docs"
+        " ON CONFLICT (mes) DO NOTHING"
+    ))
+
+
+# (versão, função) em ordem; migração nova entra no fim com o próximo número
+MIGRATIONS = [
+    (1, _m001_xml_docs_unique),
+    (2, _m002_xml_docs_compressed),
+    (3, _m003_xml_docs_metadata),
+    (4, _m004_indexes),
+    (5, _m005_xml_docs_search),
+    (6, _m006_partitions),
+    (7, _m007_xml_docs_sha256),
+    (8, _m008_xml_doc_items),
+    (9, _m009_summaries),
+]
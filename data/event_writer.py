@@ -0,0 +1,202 @@
+"""
+Gravação do histórico (downloads) em segundo plano.
+
+add/update só mexem em memória e devolvem na hora; uma thread grava em lote
+(a cada EVENT_FLUSH_SIZE eventos ou EVENT_FLUSH_SECONDS) e o que sobrar é gravado na saída do processo.
+Os ids saem de blocos reservados da sequence de downloads.id, então add() já devolve o id
+sem ir ao banco e um update() do mesmo evento ainda pendente só altera a linha em memória.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, text, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+from data.db import SessionLocal
+from data.models import DownloadEvent
+from data.partitions import ensure_partitions, month_start
+
+log = logging.getLogger(__name__)
+
+EVENT_FLUSH_SIZE = int(os.getenv("XSIST_EVENT_FLUSH_SIZE", "200"))
+EVENT_FLUSH_SECONDS = float(os.getenv("XSIST_EVENT_FLUSH_SECONDS", "1.0"))
+ID_BLOCK = 500  # ids reservados por ida ao banco
+MAX_BACKOFF_SECONDS = 60.0  # espera máxima entre tentativas com o banco falhando
+
+# update por id (a PK da tabela inclui created_at, que o update() não tem): UPDATE do Core em executemany
+_UPDATE = update(DownloadEvent.__table__).where(DownloadEvent.__table__.c.id == bindparam("event_id"))
+
+
+def _reserve_ids(n: int) -> list[int]:
+    db = SessionLocal()
+    try:
+        return list(db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('downloads', 'id')) FROM generate_series(1, :n)"),
+            {"n": n},
+        ).scalars())
+    finally:
+        db.close()
+
+
+class EventWriter:
+    def __init__(self, flush_size: int = EVENT_FLUSH_SIZE, flush_seconds: float = EVENT_FLUSH_SECONDS):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # um flush por vez: updates saem depois dos inserts anteriores
+        self._inserts: dict[int, dict] = {}
+        self._updates: dict[int, dict] = {}
+        self._ids: list[int] = []
+        self._ids_lock = threading.Lock()  # uma reserva de ids por vez
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self._failures = 0  # flushes seguidos que falharam (backoff)
+
+    def _next_id(self) -> int:
+        with self._cond:
+            if self._ids:
+                return self._ids.pop()
+        # a ida ao banco fica fora do _cond: add/update dos outros não esperam por ela
+        with self._ids_lock:
+            with self._cond:
+                if self._ids:
+                    return self._ids.pop()
+            ids = _reserve_ids(ID_BLOCK)
+            ids.reverse()
+            with self._cond:
+                self._ids = ids
+                return self._ids.pop()
+
+    def _delay(self) -> float:
+        # chamado com self._cond
+        if not self._failures:
+            return self.flush_seconds
+        return min(self.flush_seconds * 2 ** self._failures, MAX_BACKOFF_SECONDS)
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="event-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def add(self, chave: str, tipo: str, status: str, mensagem: str = "") -> int:
+        event_id = self._next_id()
+        with self._cond:
+            self._inserts[event_id] = {
+                "id": event_id,
+                "chave": chave,
+                "tipo": tipo,
+                "status": status,
+                "mensagem": mensagem,
+                "created_at": datetime.utcnow(),
+            }
+            self._start()
+            if len(self._inserts) >= self.flush_size and not self._failures:
+                self._cond.notify()
+        return event_id
+
+    def update(self, event_id: int, status: str, mensagem: str = "") -> None:
+        with self._cond:
+            row = self._inserts.get(event_id)
+            if row is not None:
+                row.update(status=status, mensagem=mensagem)
+            else:
+                self._updates[event_id] = {"event_id": event_id, "status": status, "mensagem": mensagem}
+            self._start()
+            if len(self._updates) >= self.flush_size and not self._failures:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._inserts) + len(self._updates)
+
+    def flush(self) -> int:
+        """
+        Grava o que está pendente (1 transação). Retorna quantas linhas foram gravadas.
+        Linha que o banco recusa (DataError/IntegrityError, ex.: chave maior que a coluna) vai
+        para o log e é descartada, sem segurar as outras. Se o banco falhar, os eventos voltam
+        para a fila e o próximo flush espera mais (backoff até MAX_BACKOFF_SECONDS).
+        """
+        with self._flush_lock:
+            with self._cond:
+                inserts, self._inserts = self._inserts, {}
+                updates, self._updates = self._updates, {}
+            if not inserts and not updates:
+                return 0
+
+            db = SessionLocal()
+            try:
+                if inserts:
+                    ensure_partitions("downloads", {month_start(r["created_at"]) for r in inserts.values()})
+                try:
+                    if inserts:
+                        db.execute(insert(DownloadEvent), list(inserts.values()))
+                    if updates:
+                        db.execute(_UPDATE, list(updates.values()))
+                    dropped = 0
+                except (DataError, IntegrityError):
+                    db.rollback()
+                    dropped = self._write_rows(db, inserts, updates)
+                db.commit()
+            except Exception:
+                db.rollback()
+                with self._cond:
+                    self._failures += 1
+                    # o que chegou durante o flush é mais novo e prevalece
+                    inserts.update(self._inserts)
+                    self._inserts = inserts
+                    for event_id, upd in updates.items():
+                        self._updates.setdefault(event_id, upd)
+                    delay = self._delay()
+                log.exception("Falha ao gravar %d eventos do histórico; nova tentativa em %.0f s.",
+                              len(inserts) + len(updates), delay)
+                return 0
+            finally:
+                db.close()
+            with self._cond:
+                self._failures = 0
+            return len(inserts) + len(updates) - dropped
+
+    @staticmethod
+    def _write_rows(db, inserts: dict, updates: dict) -> int:
+        """
+        Grava linha a linha (savepoint por linha) e descarta as que o banco recusa.
+        Retorna quantas foram descartadas.
+        """
+        dropped = 0
+        for stmt, rows in ((insert(DownloadEvent), inserts.values()), (_UPDATE, updates.values())):
+            for row in rows:
+                try:
+                    with db.begin_nested():
+                        db.execute(stmt, [row])
+                except (DataError, IntegrityError) as e:
+                    dropped += 1
+                    log.error("Evento do histórico descartado (%s): %r", e.orig, row)
+        return dropped
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                full = len(self._inserts) >= self.flush_size or len(self._updates) >= self.flush_size
+                # fila cheia grava na hora, a não ser que o banco esteja falhando (aí espera o backoff)
+                if not self._closed and (not full or self._failures):
+                    self._cond.wait(self._delay())
+                if self._closed:
+                    return
+            self.flush()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+
+event_writer = EventWriter()
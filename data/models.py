@@ -1,23 +1,174 @@
-from datetime import datetime
+from datetime import date, datetime
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, DateTime, Text
+from decimal import Decimal
+from sqlalchemy import Boolean, Computed, Date, DateTime, Index, Integer, LargeBinary, Numeric, String, Text, UniqueConstraint
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from data.db import Base
 
 class DownloadEvent(Base):
     __tablename__ = "downloads"
+    __table_args__ = (
+        # listagem paginada por (created_at, id); BRIN para varrer faixas de data (quase não ocupa espaço)
+        Index("ix_downloads_created_id", "created_at", "id"),
+        Index("ix_downloads_created_brin", "created_at", postgresql_using="brin"),
+        # partição por mês de created_at (data/partitions.py)
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    # a PK da tabela inclui a coluna de partição; para o ORM a identidade continua sendo o id
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     chave: Mapped[str] = mapped_column(String(44), index=True)
     tipo: Mapped[str] = mapped_column(String(10))
     status: Mapped[str] = mapped_column(String(20))
     mensagem: Mapped[str] = mapped_column(Text, default="")
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=datetime.utcnow)
+
+    __mapper_args__ = {"primary_key": [id]}
 
 class XmlDoc(Base):
     __tablename__ = "xml_docs"
+    # um documento por chave/tipo: base do upsert (INSERT ... ON CONFLICT) em data/repo.py.
+    # mes sai da chave, então (chave, tipo, mes) é tão único quanto (chave, tipo)
+    __table_args__ = (
+        UniqueConstraint("chave", "tipo", "mes", name="uq_xml_docs_chave_tipo"),
+        Index("ix_xml_docs_emit_dh", "emit_cnpj", "dh_emi"),
+        Index("ix_xml_docs_dest_dh", "dest_doc", "dh_emi"),
+        # listagem paginada por (created_at, id), com e sem filtro de tipo
+        Index("ix_xml_docs_created_id", "created_at", "id"),
+        Index("ix_xml_docs_tipo_created_id", "tipo", "created_at", "id"),
+        Index("ix_xml_docs_created_brin", "created_at", postgresql_using="brin"),
+        # filtro por prefixo da chave (LIKE 'xxx%') independente da collation
+        Index("ix_xml_docs_chave_prefix", "chave", postgresql_ops={"chave": "varchar_pattern_ops"}),
+        # busca por palavras; a busca por trecho (pg_trgm em search_text) é criada na migração 5,
+        # junto com a extensão
+        Index("ix_xml_docs_search_tsv", "search_tsv", postgresql_using="gin"),
+        # partição por mês de emissão (AAMM da chave, data/partitions.py)
+        {"postgresql_partition_by": "RANGE (mes)"},
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    # a PK da tabela inclui a coluna de partição; para o ORM a identidade continua sendo o id
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     chave: Mapped[str] = mapped_column(String(60), index=True)
     tipo: Mapped[str] = mapped_column(String(10))  # NFE / CTE
-    xml_text: Mapped[str] = mapped_column(Text)
+    mes: Mapped[date] = mapped_column(Date, primary_key=True)  # data.partitions.key_month(chave)
+    # XML compactado (zstd/gzip, ver data/xml_codec.py); xml_text fica NULL.
+    # Linhas antigas (ou XSIST_XML_CODEC=text) continuam só com xml_text.
+    xml_text: Mapped[str | None] = mapped_column(Text, nullable=True)
+    xml_data: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    # SHA-256 do XML (texto em UTF-8): regravar o mesmo conteúdo não mexe na linha.
+    # NULL = linha antiga ainda sem hash (tools/backfill_xml_metadata.py)
+    xml_sha256: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    # metadados fiscais extraídos na gravação (services.xml_utils.extract_doc).
+    # schema NULL = linha antiga ainda sem backfill (tools/backfill_xml_metadata.py)
+    emit_cnpj: Mapped[str | None] = mapped_column(String(14), nullable=True)
+    emit_nome: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    dest_doc: Mapped[str | None] = mapped_column(String(14), nullable=True)  # CNPJ ou CPF
+    dest_nome: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    dh_emi: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, index=True)
+    valor: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)  # vNF / vTPrest
+    serie: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    numero: Mapped[int | None] = mapped_column(Integer, nullable=True)  # nNF / nCT
+    schema: Mapped[str | None] = mapped_column(String(20), nullable=True)
+
+    # busca (data.repo.search_xml_docs): chave, participantes e produtos, sem acento e em maiúsculas.
+    # O tsvector é coluna gerada, então acompanha qualquer INSERT/UPDATE de search_text.
+    search_text: Mapped[str | None] = mapped_column(Text, nullable=True)
+    search_tsv: Mapped[str | None] = mapped_column(
+        TSVECTOR,
+        Computed("to_tsvector('portuguese'::regconfig, coalesce(search_text, ''))", persisted=True),
+        nullable=True,
+    )
+
+    __mapper_args__ = {"primary_key": [id]}
+
+
+class XmlDocItem(Base):
+    """
+    Itens (det) das NF-e de xml_docs, gravados junto com o documento
+    (services.xml_utils.extract_doc). Relatórios por produto/CFOP saem daqui
+    ou do export em Parquet (tools/export_parquet.py), sem reler os XMLs.
+    """
+    __tablename__ = "xml_doc_items"
+    __table_args__ = (
+        Index("ix_xml_doc_items_cfop", "cfop", "mes"),
+        # mesma partição do documento (AAMM da chave)
+        {"postgresql_partition_by": "RANGE (mes)"},
+    )
+
+    chave: Mapped[str] = mapped_column(String(60), primary_key=True)  # xml_docs.chave (tipo NFE)
+    mes: Mapped[date] = mapped_column(Date, primary_key=True)
+    n_item: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    c_prod: Mapped[str | None] = mapped_column(String(60), nullable=True)
+    x_prod: Mapped[str | None] = mapped_column(String(120), nullable=True)
+    ncm: Mapped[str | None] = mapped_column(String(8), nullable=True)
+    cfop: Mapped[str | None] = mapped_column(String(4), nullable=True)
+    u_com: Mapped[str | None] = mapped_column(String(6), nullable=True)
+    q_com: Mapped[Decimal | None] = mapped_column(Numeric(15, 4), nullable=True)
+    v_un_com: Mapped[Decimal | None] = mapped_column(Numeric(21, 10), nullable=True)
+    v_prod: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)
+    v_desc: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)
+    cst: Mapped[str | None] = mapped_column(String(3), nullable=True)  # CST ou CSOSN do ICMS
+    v_icms: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)
+    v_icms_st: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)
+    v_ipi: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)
+    v_pis: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)
+    v_cofins: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)
+
+
+class DocTotal(Base):
+    """
+    Totais de xml_docs por mês de emissão, tipo, emitente e destinatário (data/summary.py).
+    CNPJ ausente vira "" (faz parte da PK).
+    """
+    __tablename__ = "xml_doc_totals"
+
+    mes: Mapped[date] = mapped_column(Date, primary_key=True)
+    tipo: Mapped[str] = mapped_column(String(10), primary_key=True)
+    emit_cnpj: Mapped[str] = mapped_column(String(14), primary_key=True)
+    dest_doc: Mapped[str] = mapped_column(String(14), primary_key=True)
+    emit_nome: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    dest_nome: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    qtd: Mapped[int] = mapped_column(Integer)
+    valor: Mapped[Decimal] = mapped_column(Numeric(18, 2))
+
+
+class ItemTotal(Base):
+    """
+    Totais de xml_doc_items por mês e CFOP (data/summary.py).
+    """
+    __tablename__ = "xml_item_totals"
+
+    mes: Mapped[date] = mapped_column(Date, primary_key=True)
+    cfop: Mapped[str] = mapped_column(String(4), primary_key=True)
+    qtd_itens: Mapped[int] = mapped_column(Integer)
+    v_prod: Mapped[Decimal] = mapped_column(Numeric(18, 2))
+    v_icms: Mapped[Decimal] = mapped_column(Numeric(18, 2))
+    v_icms_st: Mapped[Decimal] = mapped_column(Numeric(18, 2))
+    v_ipi: Mapped[Decimal] = mapped_column(Numeric(18, 2))
+    v_pis: Mapped[Decimal] = mapped_column(Numeric(18, 2))
+    v_cofins: Mapped[Decimal] = mapped_column(Numeric(18, 2))
+
+
+class SummaryDirty(Base):
+    """
+    Meses com gravação depois do último cálculo dos totais.
+    """
+    __tablename__ = "summary_dirty"
+
+    mes: Mapped[date] = mapped_column(Date, primary_key=True)
+    marked_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
+class XmlDict(Base):
+    """
+    Dicionário zstd treinado com os nossos XMLs (tools/compress_xml_docs.py train).
+    O id é o dict_id gravado em cada frame zstd, então dicionários antigos continuam lendo.
+    """
+    __tablename__ = "xml_dicts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    dict_data: Mapped[bytes] = mapped_column(LargeBinary)
+    active: Mapped[bool] = mapped_column(Boolean, default=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
\ No newline at end of file
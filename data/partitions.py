@@ -0,0 +1,122 @@
+"""
+Partições mensais (RANGE) de xml_docs e downloads.
+
+    xml_docs      -> coluna mes: AAMM da chave de acesso (mês de emissão), ver key_month
+    xml_doc_items -> mes (o mesmo do documento)
+    downloads     -> created_at
+
+Cada partição chama <tabela>_AAAAMM e cobre [1º dia do mês, 1º dia do mês seguinte).
+Não há partição DEFAULT: quem grava chama ensure_partitions antes (data/repo.py,
+data/event_writer.py); tools/archive_partitions.py desanexa/exporta as antigas.
+"""
+from __future__ import annotations
+
+import threading
+from datetime import date, datetime
+from typing import Iterable
+
+from sqlalchemy import text
+
+from data.db import engine
+
+# coluna de particionamento de cada tabela
+PARTITION_COLUMN = {"xml_docs": "mes", "xml_doc_items": "mes", "downloads": "created_at"}
+
+# chave fora do padrão (sem AAMM válido) vai para este mês
+KEY_MONTH_FALLBACK = date(2000, 1, 1)
+
+_known: set[tuple[str, date]] = set()
+_lock = threading.Lock()
+
+
+def month_start(d: date | datetime) -> date:
+    return date(d.year, d.month, 1)
+
+
+def next_month(m: date) -> date:
+    return date(m.year + m.month // 12, m.month % 12 + 1, 1)
+
+
+def key_month(chave: str) -> date:
+    """
+    Mês de emissão pela chave de acesso (posições 3-6, AAMM). Mesma regra do KEY_MONTH_SQL:
+    os 6 primeiros caracteres são dígitos ASCII (cUF + AAMM) e o mês vai de 01 a 12.
+    Regras diferentes dariam outro mes para a mesma chave e o ON CONFLICT (chave, tipo, mes) duplicaria a linha.
+    """
+    head = chave[:6]
+    if len(head) == 6 and head.isascii() and head.isdigit() and 1 <= int(head[4:]) <= 12:
+        return date(2000 + int(head[2:4]), int(head[4:]), 1)
+    return KEY_MONTH_FALLBACK
+
+
+# key_month em SQL (migração das linhas antigas)
+KEY_MONTH_SQL = (
+    "CASE WHEN chave ~ '^[0-9]{6}' AND substring(chave, 5, 2) BETWEEN '01' AND '12'"
+    " THEN make_date(2000 + substring(chave, 3, 2)::int, substring(chave, 5, 2)::int, 1)"
+    " ELSE DATE '2000-01-01' END"
+)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y%m}"
+
+
+def list_partitions(conn, table: str) -> list[str]:
+    return list(conn.execute(text(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :t
+        ORDER BY c.relname
+        """
+    ), {"t": table}).scalars())
+
+
+def create_partitions(conn, table: str, months: Iterable[date]) -> list[str]:
+    """
+    Cria as partições que faltam (na transação de conn). Retorna os nomes criados.
+
+    Tabela avulsa + ATTACH em vez de CREATE TABLE ... PARTITION OF: o ATTACH só pede
+    SHARE UPDATE EXCLUSIVE na tabela mãe, então não espera (nem trava) quem está gravando nela.
+    """
+    # dois processos criando a mesma partição ao mesmo tempo: um espera o outro
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k))"), {"k": f"xsist_part_{table}"})
+    have = set(list_partitions(conn, table))
+    created = []
+    for m in sorted(set(months)):
+        name = partition_name(table, m)
+        if name in have:
+            continue
+        conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED)"))
+        conn.execute(text(
+            f"ALTER TABLE {table} ATTACH PARTITION {name}"
+            f" FOR VALUES FROM ('{m.isoformat()}') TO ('{next_month(m).isoformat()}')"
+        ))
+        created.append(name)
+    return created
+
+
+def ensure_partitions(table: str, months: Iterable[date]) -> None:
+    """
+    Garante as partições dos meses (1º dia do mês) antes de gravar. Só vai ao banco
+    para mês que este processo ainda não viu. Usa uma transação própria e curta:
+    a partição fica criada mesmo se a gravação de quem chamou der rollback.
+    """
+    missing = {m for m in months if (table, m) not in _known}
+    if not missing:
+        return
+    with _lock:
+        missing = {m for m in missing if (table, m) not in _known}
+        if not missing:
+            return
+        with engine.begin() as conn:
+            create_partitions(conn, table, missing)
+        _known.update((table, m) for m in missing)
+
+
+def forget_partitions(table: str, months: Iterable[date]) -> None:
+    # depois de desanexar/apagar partições (tools/archive_partitions.py)
+    with _lock:
+        _known.difference_update((table, m) for m in months)
@@ -1,83 +1,474 @@
-from sqlalchemy import select
+import hashlib
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Iterable
+
+from sqlalchemy import Float, and_, cast, delete, func, insert, literal, or_, select, text, tuple_
+from sqlalchemy.dialects.postgresql import REGCONFIG, insert as pg_insert
+from data.cache import CACHE_MB, bump_version, cached
 from data.db import SessionLocal
+from data.event_writer import event_writer
 from data.models import DownloadEvent
+from data.partitions import ensure_partitions, key_month
+from data.summary import mark_dirty
+from data.xml_codec import compress_xml, xml_body
+from services.xml_utils import SCHEMA_RANK, extract_doc, normalize_search_text
+
+# documentos por INSERT ... ON CONFLICT no caminho sem COPY (cada lote = 1 ida ao banco)
+BULK_BATCH_SIZE = 1000
+
+# colunas gravadas a partir do XML (corpo + metadados) e o tipo delas na tabela temporária do COPY
+_STORED_COLS = {
+    "xml_text": "text",
+    "xml_data": "bytea",
+    "emit_cnpj": "varchar(14)",
+    "emit_nome": "varchar(200)",
+    "dest_doc": "varchar(14)",
+    "dest_nome": "varchar(200)",
+    "dh_emi": "timestamptz",
+    "valor": "numeric(15,2)",
+    "serie": "integer",
+    "numero": "integer",
+    "schema": "varchar(20)",
+    "search_text": "text",
+    "xml_sha256": "bytea",
+}
+
+
+def _schema_rank_sql(col: str) -> str:
+    # nível do schema (SCHEMA_RANK) em SQL; NULL = linha antiga ainda sem backfill, vale como NF-e/CT-e
+    whens = " ".join(f"WHEN '{s}' THEN {r}" for s, r in SCHEMA_RANK.items())
+    return f"CASE WHEN {col} IS NULL THEN {SCHEMA_RANK['NFe']} ELSE CASE {col} {whens} ELSE 0 END END"
+
+
+# upsert só troca a linha por XML de nível igual ou maior (evento/resumo não sobrescreve a nota)
+_NO_DOWNGRADE_SQL = f"{_schema_rank_sql('EXCLUDED.schema')} >= {_schema_rank_sql('xml_docs.schema')}"
+
+# configuração do tsvector de xml_docs.search_tsv (tem que ser a mesma da coluna gerada)
+SEARCH_TS_CONFIG = "portuguese"
 
 def add_event(chave, tipo, status, mensagem="") -> int:
+    # gravação em lote em segundo plano (data/event_writer.py); o id já vem reservado
+    return event_writer.add(chave, tipo, status, mensagem)
+
+def _created_between(stmt, model, date_from: date | None, date_to: date | None):
+    if date_from:
+        stmt = stmt.where(model.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        stmt = stmt.where(model.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return stmt
+
+
+def _keyset(stmt, model, cursor, limit: int, date_from: date | None, date_to: date | None):
+    """
+    Paginação por cursor em (created_at, id), mais recentes primeiro: a página N custa
+    o mesmo que a primeira (sem OFFSET). cursor = (created_at, id) da última linha vista.
+    """
+    stmt = _created_between(stmt, model, date_from, date_to)
+    if cursor:
+        stmt = stmt.where(tuple_(model.created_at, model.id) < tuple_(*cursor))
+    # uma linha a mais só para saber se existe próxima página
+    return stmt.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+
+def _page(rows: list, limit: int) -> tuple[list, tuple | None]:
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1].created_at, rows[-1].id)
+
+
+def page_events(
+    limit: int = 100,
+    cursor: tuple | None = None,
+    *,
+    tipo: str | None = None,
+    status: str | None = None,
+    chave_prefix: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+) -> tuple[list[dict], tuple | None]:
+    """
+    Uma página do histórico, filtrada no banco. Retorna (linhas, cursor da próxima página ou None).
+    """
+    event_writer.flush()  # o que este processo registrou aparece já na listagem
     db = SessionLocal()
     try:
-        ev = DownloadEvent(chave=chave, tipo=tipo, status=status, mensagem=mensagem)
-        db.add(ev)
-        db.commit()
-        db.refresh(ev)  # garante que o ev.id vem preenchido
-        return ev.id
+        stmt = select(
+            DownloadEvent.id,
+            DownloadEvent.chave,
+            DownloadEvent.tipo,
+            DownloadEvent.status,
+            DownloadEvent.mensagem,
+            DownloadEvent.created_at,
+        )
+        if tipo:
+            stmt = stmt.where(DownloadEvent.tipo == tipo)
+        if status:
+            stmt = stmt.where(DownloadEvent.status == status)
+        if chave_prefix:
+            stmt = stmt.where(DownloadEvent.chave.startswith(chave_prefix, autoescape=True))
+        stmt = _keyset(stmt, DownloadEvent, cursor, limit, date_from, date_to)
+
+        rows, next_cursor = _page(db.execute(stmt).all(), limit)
+        return [r._asdict() for r in rows], next_cursor
     finally:
         db.close()
 
+
 def list_events(limit=200):
-    db = SessionLocal()
-    try:
-        stmt = select(DownloadEvent).order_by(DownloadEvent.id.desc()).limit(limit)
-        rows = db.execute(stmt).scalars().all()
-        return [{
-            "id": r.id,
-            "chave": r.chave,
-            "tipo": r.tipo,
-            "status": r.status,
-            "mensagem": r.mensagem,
-            "created_at": r.created_at,
-        } for r in rows]
-    finally:
-        db.close()
+    return page_events(limit)[0]
+
+from data.models import XmlDoc, XmlDocItem  # (se já tiver DownloadEvent importado, mantém os dois)
 
-from data.models import XmlDoc  # (se já tiver DownloadEvent importado, mantém os dois)
+# colunas de xml_doc_items que vêm do XML (chave/mes vêm do documento)
+_ITEM_COLS = [c.name for c in XmlDocItem.__table__.columns if c.name not in ("chave", "mes")]
 
 def save_xml_doc(chave: str, tipo: str, xml_text: str) -> None:
+    # upsert atômico: dois uploads da mesma chave ao mesmo tempo não duplicam a linha
+    save_xml_docs_bulk([(chave, tipo, xml_text)], use_copy=False)
+
+
+def _doc_rows(docs: Iterable) -> Iterable[tuple[str, str, str]]:
+    for d in docs:
+        if isinstance(d, dict):
+            yield d["chave"], d["tipo"], d["xml_text"]
+        else:
+            chave, tipo, xml_text = d
+            yield chave, tipo, xml_text
+
+
+def xml_sha256(xml_text: str) -> bytes:
+    return hashlib.sha256(xml_text.encode("utf-8")).digest()
+
+
+def _stored(xml_text: str, sha: bytes) -> tuple[dict, list[dict]]:
+    """
+    Colunas de _STORED_COLS para um XML: corpo (compactado em xml_data, ou texto puro),
+    hash do conteúdo e os metadados fiscais, extraídos uma vez aqui em vez de a cada leitura.
+    Junto, os itens da NF-e para xml_doc_items.
+    """
+    data = compress_xml(xml_text)
+    meta, items = extract_doc(xml_text)
+    return {
+        "xml_text": None if data is not None else xml_text,
+        "xml_data": data,
+        "xml_sha256": sha,
+        **meta,
+    }, items
+
+
+def replace_xml_doc_items(db, docs: list[tuple[str, date]], items: list[dict]) -> None:
+    """
+    Troca os itens das NF-e docs [(chave, mes)] por items (dicts com chave, mes e _ITEM_COLS).
+    """
+    if not docs:
+        return
+    db.execute(delete(XmlDocItem).where(
+        XmlDocItem.mes.in_({mes for _, mes in docs}),
+        tuple_(XmlDocItem.chave, XmlDocItem.mes).in_(docs),
+    ))
+    # nItem repetido no mesmo XML (fora do leiaute) violaria a PK: fica o último
+    uniq = {(it["chave"], it["n_item"]): it for it in items}
+    if uniq:
+        db.execute(insert(XmlDocItem), list(uniq.values()))
+
+
+def _changed(db, batch: list[tuple[str, str, str]], queued: set | None = None) -> list[tuple]:
+    """
+    (chave, tipo, xml_text, sha256) do lote que precisam ser gravados: a mesma chave duas vezes
+    fica com a última, e XML idêntico ao do banco (mesmo hash) sai antes de compactar/extrair.
+    queued: chaves já enviadas nesta gravação e ainda não aplicadas (sempre gravam de novo).
+    """
+    uniq = {(chave, tipo): xml_text for chave, tipo, xml_text in batch}
+    stored = dict(
+        ((chave, tipo), sha)
+        for chave, tipo, sha in db.execute(
+            select(XmlDoc.chave, XmlDoc.tipo, XmlDoc.xml_sha256).where(
+                XmlDoc.mes.in_({key_month(chave) for chave, _ in uniq}),  # só as partições do lote
+                tuple_(XmlDoc.chave, XmlDoc.tipo).in_(list(uniq)),
+            )
+        )
+    )
+    out = []
+    for key, xml_text in uniq.items():
+        sha = xml_sha256(xml_text)
+        if stored.get(key) != sha or (queued and key in queued):
+            out.append((*key, xml_text, sha))
+    return out
+
+
+def _upsert_batch(db, batch: list[tuple[str, str, str]]) -> int:
+    changed = _changed(db, batch)
+    if not changed:
+        return 0
+    now = datetime.utcnow()
+    values, items = [], []
+    for chave, tipo, xml_text, sha in changed:
+        cols, doc_items = _stored(xml_text, sha)
+        mes = key_month(chave)
+        values.append({"chave": chave, "tipo": tipo, "mes": mes, "created_at": now, **cols})
+        if tipo == "NFE":
+            items.extend({"chave": chave, "mes": mes, **it} for it in doc_items)
+    months = {v["mes"] for v in values}
+    ensure_partitions("xml_docs", months)
+    ensure_partitions("xml_doc_items", months)
+
+    stmt = pg_insert(XmlDoc).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[XmlDoc.chave, XmlDoc.tipo, XmlDoc.mes],
+        set_={c: stmt.excluded[c] for c in _STORED_COLS},
+        # outro processo pode ter gravado o mesmo XML entre a consulta do hash e aqui
+        where=and_(XmlDoc.xml_sha256.is_distinct_from(stmt.excluded.xml_sha256), text(_NO_DOWNGRADE_SQL)),
+    )
+    # RETURNING só traz as linhas inseridas/atualizadas: itens só dessas NF-e
+    written = db.execute(stmt.returning(XmlDoc.chave, XmlDoc.tipo, XmlDoc.mes)).all()
+    docs = {(chave, mes) for chave, tipo, mes in written if tipo == "NFE"}
+    replace_xml_doc_items(db, list(docs), [it for it in items if (it["chave"], it["mes"]) in docs])
+    mark_dirty(db, months)
+    return len(written)
+
+
+def _copy_upsert(db, rows: Iterable[tuple[str, str, str]], batch_size: int) -> int:
+    """
+    Caminho rápido (psycopg 3): COPY para uma tabela temporária e um único
+    INSERT ... SELECT ... ON CONFLICT para xml_docs. Os hashes são conferidos
+    a cada batch_size documentos, então o que não mudou nem entra no COPY.
+    """
+    raw = db.connection().connection.driver_connection
+    dialect = db.get_bind().dialect
+    cols = ", ".join(_STORED_COLS)
+    item_cols = ", ".join(_ITEM_COLS)
+    with raw.cursor() as cur:
+        cur.execute(
+            "CREATE TEMP TABLE _xml_docs_in (n bigint, chave varchar(60), tipo varchar(10), mes date, "
+            + ", ".join(f"{c} {t}" for c, t in _STORED_COLS.items())
+            + ") ON COMMIT DROP"
+        )
+        cur.execute(
+            "CREATE TEMP TABLE _xml_doc_items_in (n bigint, "
+            + ", ".join(f"{c} {XmlDocItem.__table__.c[c].type.compile(dialect=dialect)}" for c in _ITEM_COLS)
+            + ") ON COMMIT DROP"
+        )
+        months = set()
+        queued: set[tuple[str, str]] = set()
+        n = 0
+        while batch := list(islice(rows, batch_size)):
+            changed = _changed(db, batch, queued)
+            if not changed:
+                continue
+            items = []
+            with cur.copy(f"COPY _xml_docs_in (n, chave, tipo, mes, {cols}) FROM STDIN") as copy:
+                for chave, tipo, xml_text, sha in changed:
+                    stored, doc_items = _stored(xml_text, sha)
+                    mes = key_month(chave)
+                    months.add(mes)
+                    queued.add((chave, tipo))
+                    copy.write_row((n, chave, tipo, mes, *(stored[c] for c in _STORED_COLS)))
+                    if tipo == "NFE":
+                        items.extend((n, *(it[c] for c in _ITEM_COLS)) for it in doc_items)
+                    n += 1
+            if items:
+                with cur.copy(f"COPY _xml_doc_items_in (n, {item_cols}) FROM STDIN") as copy:
+                    for row in items:
+                        copy.write_row(row)
+        if not queued:
+            return 0
+        ensure_partitions("xml_docs", months)
+        ensure_partitions("xml_doc_items", months)
+
+        # DISTINCT ON + n DESC: chave repetida na entrada fica com a última versão
+        cur.execute(
+            f"""
+            INSERT INTO xml_docs AS d (chave, tipo, mes, {cols}, created_at)
+            SELECT DISTINCT ON (chave, tipo) chave, tipo, mes, {cols}, %s
+            FROM _xml_docs_in
+            ORDER BY chave, tipo, n DESC
+            ON CONFLICT (chave, tipo, mes) DO UPDATE SET
+            """
+            + ", ".join(f"{c} = EXCLUDED.{c}" for c in _STORED_COLS)
+            + " WHERE d.xml_sha256 IS DISTINCT FROM EXCLUDED.xml_sha256 AND "
+            + _NO_DOWNGRADE_SQL.replace("xml_docs.", "d."),
+            (datetime.utcnow(),),
+        )
+        written = cur.rowcount
+
+        # itens das NF-e gravadas: só os da versão que ficou (maior n) de cada chave,
+        # e só se foi ela que ficou no banco (o upsert não rebaixa nota para evento/resumo)
+        cur.execute(
+            """
+            CREATE TEMP TABLE _xml_docs_won ON COMMIT DROP AS
+            SELECT w.n, w.chave, w.mes
+            FROM (
+                SELECT DISTINCT ON (chave, tipo) n, chave, tipo, mes, xml_sha256
+                FROM _xml_docs_in
+                WHERE tipo = 'NFE'
+                ORDER BY chave, tipo, n DESC
+            ) w
+            JOIN xml_docs d ON d.mes = w.mes AND d.chave = w.chave AND d.tipo = w.tipo
+                AND d.xml_sha256 = w.xml_sha256
+            """
+        )
+        cur.execute(
+            "DELETE FROM xml_doc_items i USING _xml_docs_won w WHERE i.mes = w.mes AND i.chave = w.chave"
+        )
+        cur.execute(
+            f"""
+            INSERT INTO xml_doc_items (chave, mes, {item_cols})
+            SELECT DISTINCT ON (w.chave, i.n_item) w.chave, w.mes, {", ".join("i." + c for c in _ITEM_COLS)}
+            FROM _xml_doc_items_in i
+            JOIN _xml_docs_won w ON w.n = i.n
+            ORDER BY w.chave, i.n_item
+            """
+        )
+        mark_dirty(db, months)
+        return written
+
+
+def save_xml_docs_bulk(docs: Iterable, batch_size: int = BULK_BATCH_SIZE, use_copy: bool | None = None) -> int:
+    """
+    Grava muitos XMLs de uma vez: insere ou atualiza por (chave, tipo), tudo numa transação.
+    XML idêntico ao que já está no banco (mesmo SHA-256) não é regravado, e XML de nível menor
+    (SCHEMA_RANK: resumo, evento) não substitui a nota completa já gravada na mesma chave.
+
+    docs: dicts {chave, tipo, xml_text} ou tuplas (chave, tipo, xml_text); pode ser um gerador.
+    use_copy: None = usa COPY quando o driver é psycopg 3; False = INSERT em lotes de batch_size.
+    Retorna quantos documentos foram gravados (novos ou alterados).
+    """
+    rows = _doc_rows(docs)
     db = SessionLocal()
     try:
-        stmt = select(XmlDoc).where(XmlDoc.chave == chave, XmlDoc.tipo == tipo)
-        existing = db.execute(stmt).scalar_one_or_none()
+        if use_copy is None:
+            use_copy = db.get_bind().dialect.driver == "psycopg"
 
-        if existing:
-            existing.xml_text = xml_text
+        if use_copy:
+            total = _copy_upsert(db, rows, batch_size)
         else:
-            db.add(XmlDoc(chave=chave, tipo=tipo, xml_text=xml_text))
+            total = 0
+            while batch := list(islice(rows, batch_size)):
+                total += _upsert_batch(db, batch)
 
         db.commit()
+        if total:
+            bump_version()
+        return total
+    finally:
+        db.close()
+
+
+def _xml_doc_list_cols() -> tuple:
+    # colunas da listagem (nunca o corpo do XML)
+    return (
+        XmlDoc.id,
+        XmlDoc.chave,
+        XmlDoc.tipo,
+        XmlDoc.emit_nome.label("emitente"),
+        XmlDoc.dh_emi,
+        XmlDoc.valor,
+        XmlDoc.created_at,
+    )
+
+
+def _xml_doc_filters(stmt, tipo: str | None, chave_prefix: str | None, cnpj: str | None):
+    if tipo:
+        stmt = stmt.where(XmlDoc.tipo == tipo)
+    if chave_prefix:
+        stmt = stmt.where(XmlDoc.chave.startswith(chave_prefix, autoescape=True))
+    if cnpj:
+        stmt = stmt.where(or_(XmlDoc.emit_cnpj == cnpj, XmlDoc.dest_doc == cnpj))
+    return stmt
+
+
+@cached(maxsize=256)
+def page_xml_docs(
+    limit: int = 100,
+    cursor: tuple | None = None,
+    *,
+    tipo: str | None = None,
+    chave_prefix: str | None = None,
+    cnpj: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+) -> tuple[list[dict], tuple | None]:
+    """
+    Uma página de xml_docs, filtrada no banco e sem trazer o corpo do XML
+    (só as colunas da listagem). Retorna (linhas, cursor da próxima página ou None).
+    cnpj filtra emitente ou destinatário; as datas são de created_at.
+    """
+    db = SessionLocal()
+    try:
+        stmt = _xml_doc_filters(select(*_xml_doc_list_cols()), tipo, chave_prefix, cnpj)
+        stmt = _keyset(stmt, XmlDoc, cursor, limit, date_from, date_to)
+
+        rows, next_cursor = _page(db.execute(stmt).all(), limit)
+        return [r._asdict() for r in rows], next_cursor
     finally:
         db.close()
 
 
 def list_xml_docs(limit: int = 200) -> list[dict]:
+    return page_xml_docs(limit)[0]
+
+
+@cached(maxsize=256)
+def search_xml_docs(
+    query: str,
+    limit: int = 50,
+    cursor: tuple | None = None,
+    *,
+    tipo: str | None = None,
+    chave_prefix: str | None = None,
+    cnpj: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+) -> tuple[list[dict], tuple | None]:
+    """
+    Busca em xml_docs por produto, nome, CNPJ/CPF ou parte da chave (coluna search_text).
+    Casa por palavras (tsvector, aceita "aspas" e -exclusão) ou por trecho (pg_trgm),
+    mais relevantes primeiro. Mesmas colunas e filtros de page_xml_docs;
+    cursor = (relevância, id) da última linha vista.
+    """
+    q = normalize_search_text(query)
+    if not q:
+        return [], None
+
+    tsq = func.websearch_to_tsquery(cast(literal(SEARCH_TS_CONFIG), REGCONFIG), q)
+    match = XmlDoc.search_tsv.op("@@")(tsq)
+    if len(q) >= 3:  # trigram só ajuda a partir de 3 caracteres
+        pattern = "%" + q.replace("/", "//").replace("%", "/%").replace("_", "/_") + "%"
+        match = or_(match, XmlDoc.search_text.like(pattern, escape="/"))
+    rank = cast(func.ts_rank_cd(XmlDoc.search_tsv, tsq) + func.word_similarity(q, XmlDoc.search_text), Float)
+
     db = SessionLocal()
     try:
-        stmt = select(XmlDoc).order_by(XmlDoc.id.desc()).limit(limit)
-        rows = db.execute(stmt).scalars().all()
-        return [
-            {"id": r.id, "chave": r.chave, "tipo": r.tipo, "created_at": r.created_at}
-            for r in rows
-        ]
+        inner = select(*_xml_doc_list_cols(), rank.label("rank")).where(match)
+        inner = _xml_doc_filters(inner, tipo, chave_prefix, cnpj)
+        ranked = _created_between(inner, XmlDoc, date_from, date_to).subquery()
+
+        stmt = select(ranked)
+        if cursor:
+            stmt = stmt.where(tuple_(ranked.c.rank, ranked.c.id) < tuple_(*cursor))
+        stmt = stmt.order_by(ranked.c.rank.desc(), ranked.c.id.desc()).limit(limit + 1)
+
+        rows = db.execute(stmt).all()
+        next_cursor = (rows[limit - 1].rank, rows[limit - 1].id) if len(rows) > limit else None
+        return [{k: v for k, v in r._asdict().items() if k != "rank"} for r in rows[:limit]], next_cursor
     finally:
         db.close()
 
 
+@cached(maxsize=1024, max_bytes=int(CACHE_MB * 1024 * 1024), weigh=lambda d: len(d["xml_text"]) if d else 0)
 def get_xml_doc(doc_id: int) -> dict | None:
     db = SessionLocal()
     try:
-        doc = db.get(XmlDoc, doc_id)
-        if not doc:
+        row = db.execute(
+            select(XmlDoc.id, XmlDoc.chave, XmlDoc.tipo, XmlDoc.xml_text, XmlDoc.xml_data).where(XmlDoc.id == doc_id)
+        ).first()
+        if not row:
             return None
-        return {"id": doc.id, "chave": doc.chave, "tipo": doc.tipo, "xml_text": doc.xml_text}
+        return {"id": row.id, "chave": row.chave, "tipo": row.tipo, "xml_text": xml_body(row.xml_text, row.xml_data)}
     finally:
         db.close()
 
 def update_event(event_id: int, status: str, mensagem: str = "") -> None:
-    db = SessionLocal()
-    try:
-        ev = db.get(DownloadEvent, event_id)
-        if not ev:
-            return
-        ev.status = status
-        ev.mensagem = mensagem
-        db.commit()
-    finally:
-        db.close()
\ No newline at end of file
+    event_writer.update(event_id, status, mensagem)
\ No newline at end of file
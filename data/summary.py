@@ -0,0 +1,162 @@
+"""
+Totais fiscais para o painel (pages/8_Painel.py), calculados no Postgres.
+
+    xml_doc_totals  -> por mês de emissão, tipo, emitente e destinatário: quantidade e valor
+    xml_item_totals -> por mês e CFOP: itens, valor dos produtos e impostos
+
+Quem grava em xml_docs marca o mês em summary_dirty (mark_dirty, na mesma transação);
+refresh_summaries() recalcula só os meses marcados, cada um lendo apenas a sua partição.
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Iterable
+
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from data.cache import bump_version, cached
+from data.db import SessionLocal
+from data.models import DocTotal, ItemTotal, SummaryDirty
+
+# eventos não são documentos: ficam fora dos totais
+_EVENT_SCHEMAS = ("procEventoNFe", "resEvento", "procEventoCTe")
+
+
+def mark_dirty(db, months: Iterable[date]) -> None:
+    """
+    Marca meses para recálculo. clock_timestamp(): quem já está recalculando o mês
+    percebe a marca nova e não a apaga (ver _refresh_month).
+    """
+    months = sorted(set(months))
+    if not months:
+        return
+    stmt = pg_insert(SummaryDirty).values([{"mes": m, "marked_at": func.clock_timestamp()} for m in months])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[SummaryDirty.mes],
+        set_={"marked_at": func.clock_timestamp()},
+    ))
+
+
+def _refresh_month(db, mes: date, marked_at) -> None:
+    # dois recálculos ao mesmo tempo (duas abas do painel) não duplicam linhas
+    db.execute(text("SELECT pg_advisory_xact_lock(hashtext('xsist_summary'))"))
+    db.execute(text("DELETE FROM xml_doc_totals WHERE mes = :m"), {"m": mes})
+    db.execute(text(
+        """
+        INSERT INTO xml_doc_totals (mes, tipo, emit_cnpj, dest_doc, emit_nome, dest_nome, qtd, valor)
+        SELECT mes, tipo, COALESCE(emit_cnpj, ''), COALESCE(dest_doc, ''),
+               MAX(emit_nome), MAX(dest_nome), COUNT(*), COALESCE(SUM(valor), 0)
+        FROM xml_docs
+        WHERE mes = :m AND COALESCE(schema, '') NOT IN :events
+        GROUP BY mes, tipo, COALESCE(emit_cnpj, ''), COALESCE(dest_doc, '')
+        """
+    ).bindparams(bindparam("events", value=_EVENT_SCHEMAS, expanding=True)), {"m": mes})
+
+    db.execute(text("DELETE FROM xml_item_totals WHERE mes = :m"), {"m": mes})
+    db.execute(text(
+        """
+        INSERT INTO xml_item_totals (mes, cfop, qtd_itens, v_prod, v_icms, v_icms_st, v_ipi, v_pis, v_cofins)
+        SELECT mes, COALESCE(cfop, ''), COUNT(*),
+               COALESCE(SUM(v_prod), 0), COALESCE(SUM(v_icms), 0), COALESCE(SUM(v_icms_st), 0),
+               COALESCE(SUM(v_ipi), 0), COALESCE(SUM(v_pis), 0), COALESCE(SUM(v_cofins), 0)
+        FROM xml_doc_items
+        WHERE mes = :m
+        GROUP BY mes, COALESCE(cfop, '')
+        """
+    ), {"m": mes})
+
+    # se alguém gravou no mês enquanto isso, marked_at mudou e o mês continua marcado
+    db.execute(text("DELETE FROM summary_dirty WHERE mes = :m AND marked_at = :t"), {"m": mes, "t": marked_at})
+
+
+def refresh_summaries(limit: int | None = None) -> int:
+    """
+    Recalcula os meses marcados (um commit por mês). Retorna quantos meses foram refeitos.
+    Sem nada marcado custa uma consulta.
+    """
+    db = SessionLocal()
+    try:
+        stmt = select(SummaryDirty.mes, SummaryDirty.marked_at).order_by(SummaryDirty.mes.desc())
+        dirty = db.execute(stmt.limit(limit) if limit else stmt).all()
+        db.rollback()
+        for mes, marked_at in dirty:
+            _refresh_month(db, mes, marked_at)
+            db.commit()
+    finally:
+        db.close()
+    if dirty:
+        bump_version()
+    return len(dirty)
+
+
+def _months_filter(stmt, model, date_from: date | None, date_to: date | None):
+    if date_from:
+        stmt = stmt.where(model.mes >= date_from)
+    if date_to:
+        stmt = stmt.where(model.mes <= date_to)
+    return stmt
+
+
+@cached(maxsize=128)
+def totals_by_month(date_from: date | None = None, date_to: date | None = None) -> list[dict]:
+    db = SessionLocal()
+    try:
+        stmt = select(
+            DocTotal.mes,
+            DocTotal.tipo,
+            func.sum(DocTotal.qtd).label("qtd"),
+            func.sum(DocTotal.valor).label("valor"),
+        ).group_by(DocTotal.mes, DocTotal.tipo).order_by(DocTotal.mes, DocTotal.tipo)
+        return [r._asdict() for r in db.execute(_months_filter(stmt, DocTotal, date_from, date_to))]
+    finally:
+        db.close()
+
+
+@cached(maxsize=128)
+def totals_by_party(
+    party: str = "emit",
+    date_from: date | None = None,
+    date_to: date | None = None,
+    tipo: str | None = None,
+    limit: int = 50,
+) -> list[dict]:
+    """
+    Maiores emitentes (party="emit") ou destinatários ("dest") por valor no período.
+    """
+    doc, nome = (DocTotal.emit_cnpj, DocTotal.emit_nome) if party == "emit" else (DocTotal.dest_doc, DocTotal.dest_nome)
+    db = SessionLocal()
+    try:
+        stmt = select(
+            doc.label("cnpj"),
+            func.max(nome).label("nome"),
+            func.sum(DocTotal.qtd).label("qtd"),
+            func.sum(DocTotal.valor).label("valor"),
+        ).group_by(doc)
+        if tipo:
+            stmt = stmt.where(DocTotal.tipo == tipo)
+        stmt = _months_filter(stmt, DocTotal, date_from, date_to)
+        stmt = stmt.order_by(func.sum(DocTotal.valor).desc()).limit(limit)
+        return [r._asdict() for r in db.execute(stmt)]
+    finally:
+        db.close()
+
+
+@cached(maxsize=128)
+def totals_by_cfop(date_from: date | None = None, date_to: date | None = None) -> list[dict]:
+    db = SessionLocal()
+    try:
+        stmt = select(
+            ItemTotal.cfop,
+            func.sum(ItemTotal.qtd_itens).label("itens"),
+            func.sum(ItemTotal.v_prod).label("v_prod"),
+            func.sum(ItemTotal.v_icms).label("v_icms"),
+            func.sum(ItemTotal.v_icms_st).label("v_icms_st"),
+            func.sum(ItemTotal.v_ipi).label("v_ipi"),
+            func.sum(ItemTotal.v_pis).label("v_pis"),
+            func.sum(ItemTotal.v_cofins).label("v_cofins"),
+        ).group_by(ItemTotal.cfop)
+        stmt = _months_filter(stmt, ItemTotal, date_from, date_to).order_by(func.sum(ItemTotal.v_prod).desc())
+        return [r._asdict() for r in db.execute(stmt)]
+    finally:
+        db.close()
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import gzip
+import os
+import threading
+
+try:
+    import zstandard as zstd
+except ImportError:  # sem zstandard: grava em gzip (e ainda lê o que já estiver em gzip/texto)
+    zstd = None
+
+from sqlalchemy import select
+
+from data.db import SessionLocal
+
+# XSIST_XML_CODEC: zstd (padrão quando disponível), gzip ou text (sem compressão)
+XML_CODEC = os.getenv("XSIST_XML_CODEC", "zstd" if zstd else "gzip").lower()
+ZSTD_LEVEL = 9
+GZIP_LEVEL = 6
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_GZIP_MAGIC = b"\x1f\x8b"
+
+# dicionários zstd treinados (tabela xml_dicts), por dict_id
+_dicts: dict[int, object] = {}
+_active_dict_id = 0
+_dicts_loaded = False
+_dicts_gen = 0  # muda a cada recarga: cada thread refaz seu compressor
+_dicts_lock = threading.Lock()
+_local = threading.local()  # compressor/decompressor zstd não são thread-safe
+
+
+def _load_dicts(force: bool = False) -> None:
+    global _active_dict_id, _dicts_loaded, _dicts_gen
+    if zstd is None or (_dicts_loaded and not force):
+        return
+    from data.models import XmlDict
+
+    with _dicts_lock:
+        db = SessionLocal()
+        try:
+            rows = db.execute(select(XmlDict.id, XmlDict.dict_data, XmlDict.active)).all()
+        finally:
+            db.close()
+        _dicts.clear()
+        _active_dict_id = 0
+        for dict_id, data, active in rows:
+            _dicts[dict_id] = zstd.ZstdCompressionDict(data)
+            if active:
+                _active_dict_id = dict_id
+        _dicts_loaded = True
+        _dicts_gen += 1
+
+
+def reload_dicts() -> None:
+    # depois de treinar um dicionário novo (tools/compress_xml_docs.py)
+    _load_dicts(force=True)
+
+
+def _thread_cache() -> dict:
+    if getattr(_local, "gen", None) != _dicts_gen:
+        _local.gen = _dicts_gen
+        _local.cache = {}
+    return _local.cache
+
+
+def _compressor():
+    cache = _thread_cache()
+    c = cache.get("compressor")
+    if c is None:
+        d = _dicts.get(_active_dict_id)
+        c = zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=d) if d else zstd.ZstdCompressor(level=ZSTD_LEVEL)
+        cache["compressor"] = c
+    return c
+
+
+def _decompressor(dict_id: int):
+    if dict_id and dict_id not in _dicts:
+        _load_dicts(force=True)  # dicionário treinado por outro processo
+        if dict_id not in _dicts:
+            raise ValueError(f"Dicionário zstd {dict_id} não encontrado em xml_dicts.")
+    cache = _thread_cache()
+    d = cache.get(dict_id)
+    if d is None:
+        d = zstd.ZstdDecompressor(dict_data=_dicts[dict_id]) if dict_id else zstd.ZstdDecompressor()
+        cache[dict_id] = d
+    return d
+
+
+def compress_xml(xml: str | bytes, codec: str | None = None) -> bytes | None:
+    """
+    Compacta o XML para a coluna xml_data. None = guardar como texto (codec "text").
+    """
+    codec = codec or XML_CODEC
+    data = xml.encode("utf-8") if isinstance(xml, str) else xml
+
+    if codec == "zstd" and zstd is not None:
+        _load_dicts()
+        return _compressor().compress(data)
+    if codec in ("zstd", "gzip"):
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return None
+
+
+def decompress_xml(data: bytes) -> str:
+    data = bytes(data)
+    if data[:4] == _ZSTD_MAGIC:
+        if zstd is None:
+            raise RuntimeError("XML gravado em zstd: instale o pacote zstandard.")
+        _load_dicts()
+        dict_id = zstd.get_frame_parameters(data).dict_id
+        return _decompressor(dict_id).decompress(data).decode("utf-8")
+    if data[:2] == _GZIP_MAGIC:
+        return gzip.decompress(data).decode("utf-8")
+    return data.decode("utf-8")
+
+
+def xml_body(xml_text: str | None, xml_data: bytes | None) -> str:
+    """
+    Conteúdo do XML de uma linha de xml_docs, esteja ela compactada ou não.
+    """
+    if xml_data is not None:
+        return decompress_xml(xml_data)
+    return xml_text or ""
+
+
+def train_dict(samples: list[bytes], dict_size: int = 112 * 1024) -> object:
+    if zstd is None:
+        raise RuntimeError("Treinar dicionário exige o pacote zstandard.")
+    return zstd.train_dictionary(dict_size, samples)
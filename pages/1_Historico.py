@@ -1,11 +1,44 @@
 import streamlit as st
 import pandas as pd
 from data.db import init_db
-from data.repo import list_events
+from data.repo import page_events
+
+PAGE_SIZE = 100
 
 st.set_page_config(page_title="Histórico", layout="wide")
 init_db()
 
 st.title("Histórico")
-df = pd.DataFrame(list_events(300))
-st.dataframe(df, use_container_width=True, hide_index=True)
\ No newline at end of file
+
+c1, c2, c3, c4, c5 = st.columns(5)
+tipo = c1.selectbox("Tipo", ["Todos", "NFE", "CTE"])
+status = c2.selectbox("Status", ["Todos", "OK", "ERRO"])
+chave_prefix = c3.text_input("Chave começa com")
+date_from = c4.date_input("De", value=None, format="DD/MM/YYYY")
+date_to = c5.date_input("Até", value=None, format="DD/MM/YYYY")
+
+filters = {
+    "tipo": None if tipo == "Todos" else tipo,
+    "status": None if status == "Todos" else status,
+    "chave_prefix": "".join(c for c in chave_prefix if c.isdigit()) or None,
+    "date_from": date_from,
+    "date_to": date_to,
+}
+
+# pilha de cursores (keyset): volta uma página sem OFFSET; filtro novo recomeça do início
+if st.session_state.get("hist_filters") != filters:
+    st.session_state["hist_filters"] = filters
+    st.session_state["hist_cursors"] = [None]
+cursors = st.session_state["hist_cursors"]
+
+rows, next_cursor = page_events(PAGE_SIZE, cursors[-1], **filters)
+st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+b1, b2, b3 = st.columns([1, 1, 6])
+if b1.button("◀ Anterior", disabled=len(cursors) == 1):
+    cursors.pop()
+    st.rerun()
+if b2.button("Próxima ▶", disabled=next_cursor is None):
+    cursors.append(next_cursor)
+    st.rerun()
+b3.caption(f"Página {len(cursors)}")
\ No newline at end of file
@@ -2,12 +2,14 @@ import streamlit as st
 import pandas as pd
 
 from data.db import init_db
-from data.repo import save_xml_doc, list_xml_docs, get_xml_doc
+from data.repo import save_xml_doc, page_xml_docs, search_xml_docs, get_xml_doc
 from services.xml_utils import extract_key_and_type
 
 st.set_page_config(page_title="XMLs", layout="wide")
 init_db()
 
+PAGE_SIZE = 100
+
 st.title("XMLs (Upload / Lista / Download)")
 
 # 1) Inicializa "memória" dos campos (pra não dar erro)
@@ -66,12 +68,52 @@ if xml_text:
 
 st.divider()
 
-# 5) Lista e download
-st.subheader("Últimos XMLs salvos")
-docs = list_xml_docs(200)
+# 5) Lista (filtrada e paginada no banco, sem carregar os XMLs) e download
+st.subheader("XMLs salvos")
+
+busca = st.text_input(
+    "Buscar",
+    placeholder="produto, razão social, CNPJ/CPF ou parte da chave (use \"aspas\" para frase exata)",
+).strip()
+
+f1, f2, f3, f4, f5 = st.columns(5)
+f_tipo = f1.selectbox("Filtrar tipo", ["Todos", "NFE", "CTE"])
+f_chave = f2.text_input("Chave começa com")
+f_cnpj = f3.text_input("CNPJ emitente/destinatário")
+f_de = f4.date_input("Salvo de", value=None, format="DD/MM/YYYY")
+f_ate = f5.date_input("Salvo até", value=None, format="DD/MM/YYYY")
+
+filters = {
+    "tipo": None if f_tipo == "Todos" else f_tipo,
+    "chave_prefix": so_digitos(f_chave) or None,
+    "cnpj": so_digitos(f_cnpj) or None,
+    "date_from": f_de,
+    "date_to": f_ate,
+}
+
+# pilha de cursores (keyset): volta uma página sem OFFSET; filtro/busca nova recomeça do início
+if st.session_state.get("xml_filters") != (busca, filters):
+    st.session_state["xml_filters"] = (busca, filters)
+    st.session_state["xml_cursors"] = [None]
+cursors = st.session_state["xml_cursors"]
+
+if busca:
+    # mais relevantes primeiro
+    docs, next_cursor = search_xml_docs(busca, PAGE_SIZE, cursors[-1], **filters)
+else:
+    docs, next_cursor = page_xml_docs(PAGE_SIZE, cursors[-1], **filters)
 df = pd.DataFrame(docs)
 st.dataframe(df, use_container_width=True, hide_index=True)
 
+b1, b2, b3 = st.columns([1, 1, 6])
+if b1.button("◀ Anterior", disabled=len(cursors) == 1):
+    cursors.pop()
+    st.rerun()
+if b2.button("Próxima ▶", disabled=next_cursor is None):
+    cursors.append(next_cursor)
+    st.rerun()
+b3.caption(f"Página {len(cursors)}")
+
 if docs:
     doc_id = st.selectbox("Escolha um ID para baixar", [d["id"] for d in docs])
     doc = get_xml_doc(int(doc_id))
@@ -0,0 +1,61 @@
+from datetime import date
+
+import pandas as pd
+import streamlit as st
+
+from data.db import init_db
+from data.summary import refresh_summaries, totals_by_cfop, totals_by_month, totals_by_party
+
+st.set_page_config(page_title="Painel", layout="wide")
+init_db()
+
+st.title("Painel fiscal")
+st.caption("Totais por mês de emissão (AAMM da chave), calculados no banco. Eventos não entram.")
+
+# meses com gravação nova desde a última abertura (normalmente nenhum ou o mês corrente)
+refresh_summaries()
+
+
+def _mes(d: date | None) -> date | None:
+    return date(d.year, d.month, 1) if d else None
+
+
+today = date.today()
+c1, c2, c3 = st.columns(3)
+date_from = c1.date_input("Emitidos de", value=date(today.year - 1, today.month, 1), format="DD/MM/YYYY")
+date_to = c2.date_input("Até", value=today, format="DD/MM/YYYY")
+tipo = c3.selectbox("Tipo", ["Todos", "NFE", "CTE"])
+mes_from, mes_to = _mes(date_from), _mes(date_to)
+tipo = None if tipo == "Todos" else tipo
+
+# 1) Por mês
+months = pd.DataFrame(totals_by_month(mes_from, mes_to))
+if tipo and not months.empty:
+    months = months[months["tipo"] == tipo]
+
+if months.empty:
+    st.info("Nenhum documento no período.")
+    st.stop()
+
+m1, m2 = st.columns(2)
+m1.metric("Documentos", f"{int(months['qtd'].sum()):,}".replace(",", "."))
+m2.metric("Valor total", f"R$ {float(months['valor'].sum()):,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+
+months["valor"] = months["valor"].astype(float)
+months["mes"] = pd.to_datetime(months["mes"]).dt.strftime("%Y-%m")
+st.subheader("Por mês")
+st.bar_chart(months.pivot_table(index="mes", columns="tipo", values="valor", aggfunc="sum"))
+st.dataframe(months, use_container_width=True, hide_index=True)
+
+# 2) Por emitente / destinatário
+st.subheader("Maiores emitentes e destinatários")
+t1, t2 = st.tabs(["Emitentes", "Destinatários"])
+with t1:
+    st.dataframe(pd.DataFrame(totals_by_party("emit", mes_from, mes_to, tipo)), use_container_width=True, hide_index=True)
+with t2:
+    st.dataframe(pd.DataFrame(totals_by_party("dest", mes_from, mes_to, tipo)), use_container_width=True, hide_index=True)
+
+# 3) Por CFOP (itens de NF-e)
+if tipo != "CTE":
+    st.subheader("Itens de NF-e por CFOP")
+    st.dataframe(pd.DataFrame(totals_by_cfop(mes_from, mes_to)), use_container_width=True, hide_index=True)
@@ -1,24 +1,130 @@
 from __future__ import annotations
 
-from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
-from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
+import hashlib
+import os
+import secrets
+import ssl
 import tempfile
+import threading
+from dataclasses import dataclass
 from pathlib import Path
 
+from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, Encoding, PrivateFormat
+from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
+
+
+@dataclass(frozen=True)
+class CertBundle:
+    """
+    Certificado A1 já decifrado: SSLContext pronto para mTLS + dados para exibição.
+    cert_id muda quando o conteúdo do PFX muda (serve de chave para pools de conexão).
+    """
+    cert_id: str
+    subject: str
+    not_after: str
+    ssl_context: ssl.SSLContext
+
+
+# CA extra para validar o servidor (ex.: SEFAZ de teste local, tools/mock_sefaz.py)
+SEFAZ_CA_FILE = os.environ.get("XSIST_SEFAZ_CA_FILE", "")
 
-def pfx_to_pem_files(pfx_path: str, pfx_password: str) -> tuple[str, str]:
-    pfx_bytes = Path(pfx_path).read_bytes()
-    key, cert, _ = load_key_and_certificates(pfx_bytes, pfx_password.encode("utf-8"))
+_cache: dict[tuple[str, str], tuple[int, str, CertBundle]] = {}
+_cache_lock = threading.Lock()
+
+
+def _load_pfx(pfx_bytes: bytes, pfx_password: str):
+    key, cert, extra = load_key_and_certificates(pfx_bytes, pfx_password.encode("utf-8"))
 
     if key is None or cert is None:
         raise RuntimeError("PFX inválido ou senha incorreta (não encontrei chave/cert).")
 
-    cert_pem = cert.public_bytes(Encoding.PEM)
-    key_pem = key.private_bytes(Encoding.PEM, PrivateFormat.TraditionalOpenSSL, NoEncryption())
+    return key, cert, extra or []
+
+
+def build_ssl_context(pfx_bytes: bytes, pfx_password: str) -> tuple[ssl.SSLContext, object]:
+    """
+    Monta um SSLContext cliente a partir do PFX.
+
+    O módulo ssl só carrega chave a partir de arquivo, então a chave vai para um
+    temporário cifrado com senha aleatória e o arquivo é apagado logo após o load.
+    """
+    key, cert, extra = _load_pfx(pfx_bytes, pfx_password)
+
+    tmp_pass = secrets.token_bytes(32)
+    chain_pem = cert.public_bytes(Encoding.PEM) + b"".join(c.public_bytes(Encoding.PEM) for c in extra)
+    key_pem = key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, BestAvailableEncryption(tmp_pass))
+
+    ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    if SEFAZ_CA_FILE:
+        ctx.load_verify_locations(cafile=SEFAZ_CA_FILE)
+    fd, path = tempfile.mkstemp(suffix=".pem")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(key_pem + chain_pem)
+        ctx.load_cert_chain(certfile=path, password=tmp_pass)
+    finally:
+        os.unlink(path)
+
+    return ctx, cert
+
+
+def load_cert_bundle(pfx_path: str, pfx_password: str) -> CertBundle:
+    """
+    Devolve o certificado do cache (decifra o PFX só na 1ª vez).
+    O cache é invalidado quando o arquivo muda (mtime) ou o conteúdo muda (hash).
+    """
+    path = str(Path(pfx_path).resolve())
+    mtime = os.stat(path).st_mtime_ns
+    key = (path, pfx_password)
+
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and hit[0] == mtime:
+            return hit[2]
+
+    pfx_bytes = Path(path).read_bytes()
+    digest = hashlib.sha256(pfx_bytes).hexdigest()
+
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and hit[1] == digest:
+            # só o mtime mudou (arquivo regravado igual): reaproveita
+            _cache[key] = (mtime, digest, hit[2])
+            return hit[2]
+
+    ctx, cert = build_ssl_context(pfx_bytes, pfx_password)
+    bundle = CertBundle(
+        cert_id=digest,
+        subject=cert.subject.rfc4514_string(),
+        not_after=cert.not_valid_after_utc.isoformat(),
+        ssl_context=ctx,
+    )
+
+    with _cache_lock:
+        _cache[key] = (mtime, digest, bundle)
+    return bundle
+
+
+def invalidate_cert_cache(pfx_path: str | None = None) -> None:
+    with _cache_lock:
+        if pfx_path is None:
+            _cache.clear()
+            return
+        path = str(Path(pfx_path).resolve())
+        for k in [k for k in _cache if k[0] == path]:
+            del _cache[k]
+
 
-    cert_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pem")
-    key_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pem")
-    cert_file.write(cert_pem); cert_file.close()
-    key_file.write(key_pem); key_file.close()
+def verify_pfx_bytes(pfx_bytes: bytes, password: str) -> tuple[bool, str]:
+    """
+    Verifica se o PFX abre com a senha e se existe chave privada.
+    """
+    try:
+        _, cert, _ = _load_pfx(pfx_bytes, password)
+        subj = cert.subject.rfc4514_string()
+        return True, f"OK: certificado lido. Subject={subj}"
+    except RuntimeError:
+        return False, "PFX não contém chave privada/certificado (ou senha errada)."
+    except Exception as e:
+        return False, f"Falha ao ler PFX (senha errada ou arquivo inválido): {e}"
 
-    return cert_file.name, key_file.name
\ No newline at end of file
@@ -7,26 +7,21 @@ import qrcode
 from fpdf import FPDF
 from lxml import etree
 
+from services.xml_extract import CTE_SPEC
+
 
 def _s(x: Any) -> str:
     return (str(x) if x is not None else "").strip()
 
 
-def _xpath_str(node, expr: str) -> str:
-    try:
-        return _s(node.xpath(f"string({expr})"))
-    except Exception:
-        return ""
-
-
-def _detect_chave_cte(root, xml_text: str) -> str:
+def _detect_chave_cte(f: dict, xml_text: str) -> str:
     # 1) Id="CTe<44>"
-    id_attr = _xpath_str(root, "//*[local-name()='infCte' or local-name()='infCTe']/@Id")
+    id_attr = f["cte_id"]
     if id_attr.startswith("CTe") and len(id_attr) >= 47:
         return id_attr[3:47]
 
     # 2) chCTe
-    chcte = _xpath_str(root, "//*[local-name()='chCTe']")
+    chcte = f["chCTe"]
     if len(chcte) == 44 and chcte.isdigit():
         return chcte
 
@@ -42,83 +37,32 @@ def _detect_chave_cte(root, xml_text: str) -> str:
 
 def extract_cte_for_dacte(xml_text: str) -> dict:
     root = etree.fromstring(xml_text.encode("utf-8", errors="ignore"))
+    f = CTE_SPEC.extract(root)
 
-    chave = _detect_chave_cte(root, xml_text)
-
-    # ide
-    nCT = _xpath_str(root, "//*[local-name()='ide']/*[local-name()='nCT']")
-    serie = _xpath_str(root, "//*[local-name()='ide']/*[local-name()='serie']")
-    dhEmi = (
-        _xpath_str(root, "//*[local-name()='ide']/*[local-name()='dhEmi']")
-        or _xpath_str(root, "//*[local-name()='ide']/*[local-name()='dEmi']")
-    )
-    natOp = _xpath_str(root, "//*[local-name()='ide']/*[local-name()='natOp']")
-    mod = _xpath_str(root, "//*[local-name()='ide']/*[local-name()='mod']")
-    tpCTe = _xpath_str(root, "//*[local-name()='ide']/*[local-name()='tpCTe']")
-
-    # participantes
-    emit_nome = _xpath_str(root, "//*[local-name()='emit']/*[local-name()='xNome']")
-    emit_cnpj = _xpath_str(root, "//*[local-name()='emit']/*[local-name()='CNPJ']")
-
-    rem_nome = _xpath_str(root, "//*[local-name()='rem']/*[local-name()='xNome']")
-    rem_doc = (
-        _xpath_str(root, "//*[local-name()='rem']/*[local-name()='CNPJ']")
-        or _xpath_str(root, "//*[local-name()='rem']/*[local-name()='CPF']")
-    )
-
-    dest_nome = _xpath_str(root, "//*[local-name()='dest']/*[local-name()='xNome']")
-    dest_doc = (
-        _xpath_str(root, "//*[local-name()='dest']/*[local-name()='CNPJ']")
-        or _xpath_str(root, "//*[local-name()='dest']/*[local-name()='CPF']")
-    )
-
-    # valores
-    vTPrest = _xpath_str(root, "//*[local-name()='vPrest']/*[local-name()='vTPrest']")
-    vRec = _xpath_str(root, "//*[local-name()='vPrest']/*[local-name()='vRec']")
-
-    # carga (quando existir)
-    vCarga = _xpath_str(root, "//*[local-name()='infCarga']/*[local-name()='vCarga']")
-    proPred = _xpath_str(root, "//*[local-name()='infCarga']/*[local-name()='proPred']")
-    xOutCat = _xpath_str(root, "//*[local-name()='infCarga']/*[local-name()='xOutCat']")
-
-    # componentes do valor (Comp)
-    comps = []
-    comp_nodes = root.xpath("//*[local-name()='vPrest']/*[local-name()='Comp']")
-    for c in comp_nodes:
-        xNome = _xpath_str(c, ".//*[local-name()='xNome']")
-        vComp = _xpath_str(c, ".//*[local-name()='vComp']")
-        comps.append({"xNome": xNome, "vComp": vComp})
-
-    # QRCode (CT-e)
-    qr = (
-        _xpath_str(root, "//*[local-name()='qrCodCTe']")
-        or _xpath_str(root, "//*[local-name()='qrCode']")
-        or chave
-    )
-    if not qr:
-        qr = chave
+    chave = _detect_chave_cte(f, xml_text)
 
     return {
         "chave": chave,
-        "nCT": nCT,
-        "serie": serie,
-        "dhEmi": dhEmi,
-        "natOp": natOp,
-        "mod": mod,
-        "tpCTe": tpCTe,
-        "emit_nome": emit_nome,
-        "emit_cnpj": emit_cnpj,
-        "rem_nome": rem_nome,
-        "rem_doc": rem_doc,
-        "dest_nome": dest_nome,
-        "dest_doc": dest_doc,
-        "vTPrest": vTPrest,
-        "vRec": vRec,
-        "vCarga": vCarga,
-        "proPred": proPred,
-        "xOutCat": xOutCat,
-        "qr": qr,
-        "comps": comps,
+        "nCT": f["nCT"],
+        "serie": f["serie"],
+        "dhEmi": f["dhEmi"],
+        "natOp": f["natOp"],
+        "mod": f["mod"],
+        "tpCTe": f["tpCTe"],
+        "emit_nome": f["emit_nome"],
+        "emit_cnpj": f["emit_cnpj"],
+        "rem_nome": f["rem_nome"],
+        "rem_doc": f["rem_doc"],
+        "dest_nome": f["dest_nome"],
+        "dest_doc": f["dest_doc"],
+        "vTPrest": f["vTPrest"],
+        "vRec": f["vRec"],
+        "vCarga": f["vCarga"],
+        "proPred": f["proPred"],
+        "xOutCat": f["xOutCat"],
+        # QRCode (CT-e); sem ele, a chave
+        "qr": f["qrCode"] or chave,
+        "comps": f["comps"],
     }
 
 
@@ -7,99 +7,38 @@ import qrcode
 from fpdf import FPDF
 from lxml import etree
 
+from services.xml_extract import NFE_SPEC
+
 
 def _s(x: Any) -> str:
     """string segura"""
     return (str(x) if x is not None else "").strip()
 
 
-def _xpath(root, expr: str) -> str:
-    try:
-        return _s(root.xpath(expr))
-    except Exception:
-        return ""
-
-
-def _xpath_str(root, expr: str) -> str:
-    try:
-        return _s(root.xpath(f"string({expr})"))
-    except Exception:
-        return ""
-
-
 def extract_nfe_for_danfe(xml_text: str) -> dict:
     root = etree.fromstring(xml_text.encode("utf-8", errors="ignore"))
+    f = NFE_SPEC.extract(root)
 
-    # chave
-    id_attr = _xpath_str(root, "//*[local-name()='infNFe']/@Id")
+    id_attr = f["nfe_id"]
     chave = id_attr[3:47] if id_attr.startswith("NFe") else ""
 
-    # emitente/destinatário
-    emit_nome = _xpath_str(root, "//*[local-name()='emit']/*[local-name()='xNome']")
-    emit_cnpj = _xpath_str(root, "//*[local-name()='emit']/*[local-name()='CNPJ']")
-    dest_nome = _xpath_str(root, "//*[local-name()='dest']/*[local-name()='xNome']")
-    dest_doc = (
-        _xpath_str(root, "//*[local-name()='dest']/*[local-name()='CNPJ']")
-        or _xpath_str(root, "//*[local-name()='dest']/*[local-name()='CPF']")
-    )
-
-    # ide
-    nNF = _xpath_str(root, "//*[local-name()='ide']/*[local-name()='nNF']")
-    serie = _xpath_str(root, "//*[local-name()='ide']/*[local-name()='serie']")
-    dhEmi = (
-        _xpath_str(root, "//*[local-name()='ide']/*[local-name()='dhEmi']")
-        or _xpath_str(root, "//*[local-name()='ide']/*[local-name()='dEmi']")
-    )
-
-    # totais
-    vNF = _xpath_str(root, "//*[local-name()='ICMSTot']/*[local-name()='vNF']")
-    vProd = _xpath_str(root, "//*[local-name()='ICMSTot']/*[local-name()='vProd']")
-    vICMS = _xpath_str(root, "//*[local-name()='ICMSTot']/*[local-name()='vICMS']")
-
-    # QR (às vezes existe no XML)
-    qr = _xpath_str(root, "//*[local-name()='qrCode']")
-    if not qr:
-        # fallback: pelo menos usa a chave como texto do QR
-        qr = chave
-
-    # itens
-    itens = []
-    det_nodes = root.xpath("//*[local-name()='det']")
-    for det in det_nodes:
-        nItem = det.get("nItem", "")
-        cProd = _xpath_str(det, ".//*[local-name()='prod']/*[local-name()='cProd']")
-        xProd = _xpath_str(det, ".//*[local-name()='prod']/*[local-name()='xProd']")
-        qCom = _xpath_str(det, ".//*[local-name()='prod']/*[local-name()='qCom']")
-        uCom = _xpath_str(det, ".//*[local-name()='prod']/*[local-name()='uCom']")
-        vUnCom = _xpath_str(det, ".//*[local-name()='prod']/*[local-name()='vUnCom']")
-        vProdItem = _xpath_str(det, ".//*[local-name()='prod']/*[local-name()='vProd']")
-
-        itens.append(
-            {
-                "nItem": nItem,
-                "cProd": cProd,
-                "xProd": xProd,
-                "qCom": qCom,
-                "uCom": uCom,
-                "vUnCom": vUnCom,
-                "vProd": vProdItem,
-            }
-        )
+    # QR (às vezes existe no XML); fallback: pelo menos usa a chave como texto do QR
+    qr = f["qrCode"] or chave
 
     return {
         "chave": chave,
-        "emit_nome": emit_nome,
-        "emit_cnpj": emit_cnpj,
-        "dest_nome": dest_nome,
-        "dest_doc": dest_doc,
-        "nNF": nNF,
-        "serie": serie,
-        "dhEmi": dhEmi,
-        "vNF": vNF,
-        "vProd": vProd,
-        "vICMS": vICMS,
+        "emit_nome": f["emit_nome"],
+        "emit_cnpj": f["emit_cnpj"],
+        "dest_nome": f["dest_nome"],
+        "dest_doc": f["dest_doc"],
+        "nNF": f["nNF"],
+        "serie": f["serie"],
+        "dhEmi": f["dhEmi"],
+        "vNF": f["vNF"],
+        "vProd": f["vProd"],
+        "vICMS": f["vICMS"],
         "qr": qr,
-        "itens": itens,
+        "itens": f["itens"],
     }
 
 
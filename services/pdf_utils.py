@@ -3,12 +3,7 @@ from __future__ import annotations
 from fpdf import FPDF
 from lxml import etree
 
-
-def _xpath_str(root, expr: str) -> str:
-    try:
-        return (root.xpath(expr) or "").strip()
-    except Exception:
-        return ""
+from services.xml_extract import BASIC_SPEC
 
 
 def _sanitize(text: str) -> str:
@@ -38,42 +33,35 @@ def extract_basic_fields(xml_text: str) -> dict:
     elif "infcte" in xml_lower:
         tipo = "CTE"
 
-    chave = _xpath_str(root, "string(//*[local-name()='infNFe']/@Id)")
+    f = BASIC_SPEC.extract(root)
+
+    chave = f["nfe_id"]
     if chave.startswith("NFe") and len(chave) >= 47:
         chave = chave[3:47]
     else:
-        chave2 = _xpath_str(root, "string(//*[local-name()='infCte' or local-name()='infCTe']/@Id)")
+        chave2 = f["cte_id"]
         if chave2.startswith("CTe") and len(chave2) >= 47:
             chave = chave2[3:47]
         else:
-            chnfe = _xpath_str(root, "string(//*[local-name()='chNFe'])")
+            chnfe = f["chNFe"]
             if len(chnfe) == 44 and chnfe.isdigit():
                 chave = chnfe
-            chcte = _xpath_str(root, "string(//*[local-name()='chCTe'])")
+            chcte = f["chCTe"]
             if len(chcte) == 44 and chcte.isdigit():
                 chave = chcte
 
-    emit = _xpath_str(root, "string(//*[local-name()='emit']/*[local-name()='xNome'])")
-    dest = _xpath_str(root, "string(//*[local-name()='dest']/*[local-name()='xNome'])")
-
-    dh = (
-        _xpath_str(root, "string(//*[local-name()='ide']/*[local-name()='dhEmi'])")
-        or _xpath_str(root, "string(//*[local-name()='ide']/*[local-name()='dEmi'])")
-        or _xpath_str(root, "string(//*[local-name()='ide']/*[local-name()='dhCont'])")
-    )
-
     valor = ""
     if tipo == "NFE":
-        valor = _xpath_str(root, "string(//*[local-name()='ICMSTot']/*[local-name()='vNF'])")
+        valor = f["vNF"]
     elif tipo == "CTE":
-        valor = _xpath_str(root, "string(//*[local-name()='vPrest']/*[local-name()='vTPrest'])")
+        valor = f["vTPrest"]
 
     return {
         "tipo": tipo,
         "chave": chave,
-        "emitente": emit,
-        "destinatario": dest,
-        "data": dh,
+        "emitente": f["emit_nome"],
+        "destinatario": f["dest_nome"],
+        "data": f["data"],
         "valor": valor,
     }
 
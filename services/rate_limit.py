@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+
+# cStat=656 (consumo indevido): a SEFAZ bloqueia o CNPJ por 1 hora
+BLOCK_656_SECONDS = 3600
+
+
+class TokenBucket:
+    """
+    Token bucket simples: `rate` fichas por segundo, no máximo `capacity` acumuladas.
+    reserve() já desconta a ficha e diz quanto esperar, então quem chega primeiro sai primeiro.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class SefazLimiter:
+    """
+    Limite de chamadas à SEFAZ por (CNPJ, endpoint).
+
+    Fora o ritmo normal (token bucket), um cStat=656 bloqueia o par por
+    BLOCK_656_SECONDS: enquanto isso nenhuma chamada sai, para não renovar o bloqueio.
+    """
+
+    def __init__(self, rate_per_min: float = 20, burst: int = 5):
+        self.rate_per_min = rate_per_min
+        self.burst = burst
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._blocked_until: dict[tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, rate_per_min: float | None = None, burst: int | None = None) -> None:
+        with self._lock:
+            if rate_per_min:
+                self.rate_per_min = float(rate_per_min)
+            if burst:
+                self.burst = int(burst)
+            self._buckets.clear()
+
+    def _bucket(self, key: tuple[str, str]) -> TokenBucket:
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = TokenBucket(self.rate_per_min / 60.0, self.burst)
+                self._buckets[key] = b
+            return b
+
+    def blocked_for(self, cnpj: str, endpoint: str) -> float:
+        until = self._blocked_until.get((cnpj, endpoint), 0.0)
+        return max(0.0, until - time.monotonic())
+
+    def penalize(self, cnpj: str, endpoint: str, seconds: float = BLOCK_656_SECONDS) -> None:
+        with self._lock:
+            self._blocked_until[(cnpj, endpoint)] = time.monotonic() + seconds
+
+    def acquire(self, cnpj: str, endpoint: str) -> float:
+        """
+        Espera a vez (bloqueando a thread). Retorna 0 se pode chamar,
+        ou os segundos restantes de bloqueio (656) sem esperar.
+        """
+        blocked = self.blocked_for(cnpj, endpoint)
+        if blocked:
+            return blocked
+        wait = self._bucket((cnpj, endpoint)).reserve()
+        if wait:
+            time.sleep(wait)
+        return self.blocked_for(cnpj, endpoint)
+
+    async def acquire_async(self, cnpj: str, endpoint: str) -> float:
+        blocked = self.blocked_for(cnpj, endpoint)
+        if blocked:
+            return blocked
+        wait = self._bucket((cnpj, endpoint)).reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return self.blocked_for(cnpj, endpoint)
+
+    def snapshot(self) -> dict:
+        return {
+            "rate_per_min": self.rate_per_min,
+            "burst": self.burst,
+            "blocked": {
+                f"{cnpj}|{endpoint}": round(self.blocked_for(cnpj, endpoint))
+                for (cnpj, endpoint) in list(self._blocked_until)
+                if self.blocked_for(cnpj, endpoint)
+            },
+        }
+
+
+def retry_delay(attempt: int, base: float = 2.0, cap: float = 300.0) -> float:
+    """
+    Espera antes da tentativa `attempt` (1, 2, 3...): exponencial com jitter,
+    para as chaves que falharam não voltarem todas juntas.
+    """
+    d = min(cap, base * (2 ** attempt))
+    return d / 2 + random.uniform(0, d / 2)
+
+
+sefaz_limiter = SefazLimiter()
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from services.sefaz_nfe import download_nfe_xml_by_key_official
+from services.sefaz_nfe import download_nfe_xml_by_key_official, download_nfe_xml_by_key_official_async
 
 
 def download_xml_by_key(
@@ -26,4 +26,32 @@ def download_xml_by_key(
     if tipo == "CTE":
         return False, None, "CT-e oficial ainda não implementado nesta fase."
 
-    return False, None, "Tipo inválido (use NFE ou CTE)."
\ No newline at end of file
+    return False, None, "Tipo inválido (use NFE ou CTE)."
+
+
+async def download_xml_by_key_async(
+    chave: str,
+    tipo: str,
+    *,
+    pfx_path: str | None = None,
+    pfx_password: str | None = None,
+    cnpj: str | None = None,
+    tp_amb: int = 1,
+    raw: bool = False,
+) -> tuple[bool, str | bytes | None, str]:
+    tipo = (tipo or "").upper()
+
+    if tipo == "NFE":
+        return await download_nfe_xml_by_key_official_async(
+            chave=chave,
+            pfx_path=pfx_path,
+            pfx_password=pfx_password,
+            cnpj=cnpj,
+            tp_amb=tp_amb,
+            raw=raw,
+        )
+
+    if tipo == "CTE":
+        return False, None, "CT-e oficial ainda não implementado nesta fase."
+
+    return False, None, "Tipo inválido (use NFE ou CTE)."
@@ -1,86 +1,218 @@
 from __future__ import annotations
 
-from services.cert_utils import pfx_to_pem_files
-from services.sefaz_payloads import build_distdfeint_cons_chave
-from services.soap_client import wrap_soap, post_soap
-from services.sefaz_parse import extract_ret_xml_from_soap, parse_ret_distdfeint
+import os
+
+from services.cert_utils import load_cert_bundle
+from services.rate_limit import sefaz_limiter
+from services.sefaz_payloads import build_distdfeint_cons_chave, build_distdfeint_dist_nsu
+from services.soap_client import (
+    get_async_soap_client,
+    get_soap_session,
+    post_soap,
+    stream_soap_async,
+    warmup_async_client,
+    warmup_session,
+    wrap_soap,
+)
+from services.sefaz_parse import PARSE_ERRORS, DistDFeIntPullParser, collect_distdfeint, iter_distdfeint
 
 
 # Endpoint do serviço (produção). Pode mudar com o tempo; ajustamos se necessário.
-NFE_DIST_URL = "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx"
+# XSIST_NFE_DIST_URL aponta para outro servidor (ex.: SEFAZ de teste local, tools/mock_sefaz.py).
+NFE_DIST_URL = os.environ.get(
+    "XSIST_NFE_DIST_URL",
+    "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx",
+)
 
 # SOAPAction típico
 SOAP_ACTION = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe/nfeDistDFeInteresse"
 
+# cStat que valem nova tentativa mais tarde (656 = consumo indevido, 108/109 = serviço paralisado)
+TRANSIENT_CSTATS = ("656", "108", "109")
+
+# resposta lida em pedaços (o parse acontece enquanto os bytes chegam)
+STREAM_CHUNK = 64 * 1024
+
+# distNSU: limite de páginas por execução (cada página traz até 50 docs)
+NSU_MAX_PAGES = 100
+
 
 def _only_digits(s: str) -> str:
     return "".join(c for c in (s or "") if c.isdigit())
 
 
-def download_nfe_xml_by_key_official(
-    *,
+def get_nfe_dist_session(pfx_path: str, pfx_password: str):
+    """
+    Sessão keep-alive (mTLS) do NFeDistribuicaoDFe para este certificado.
+    O PFX vem do cache de certificados (decifrado uma vez só).
+    """
+    bundle = load_cert_bundle(pfx_path, pfx_password)
+    return get_soap_session(NFE_DIST_URL, bundle.cert_id, bundle.ssl_context)
+
+
+def warmup_nfe_dist(pfx_path: str | None, pfx_password: str | None) -> bool:
+    """
+    Abre a conexão TLS com a SEFAZ antes do primeiro download (usado no startup do conector).
+    """
+    if not pfx_path or not pfx_password or not os.path.exists(pfx_path):
+        return False
+    try:
+        session = get_nfe_dist_session(pfx_path, pfx_password)
+    except Exception:
+        return False
+    return warmup_session(session, NFE_DIST_URL)
+
+
+def get_nfe_dist_async_client(pfx_path: str, pfx_password: str):
+    bundle = load_cert_bundle(pfx_path, pfx_password)
+    return get_async_soap_client(NFE_DIST_URL, bundle.cert_id, bundle.ssl_context)
+
+
+async def warmup_nfe_dist_async(pfx_path: str | None, pfx_password: str | None) -> bool:
+    if not pfx_path or not pfx_password or not os.path.exists(pfx_path):
+        return False
+    try:
+        client = get_nfe_dist_async_client(pfx_path, pfx_password)
+    except Exception:
+        return False
+    return await warmup_async_client(client, NFE_DIST_URL)
+
+
+def _blocked_msg(seconds: float) -> str:
+    return f"Bloqueado: SEFAZ cStat=656 (consumo indevido). Nova tentativa em {int(seconds // 60) + 1} min."
+
+
+def _note_cstat(cnpj: str, cstat: str) -> None:
+    # 656: a SEFAZ bloqueou o CNPJ; segura todas as chamadas até o bloqueio passar
+    if cstat == "656":
+        sefaz_limiter.penalize(cnpj, NFE_DIST_URL)
+
+
+def is_transient_failure(msg: str) -> bool:
+    """
+    Falha que pode dar certo numa nova tentativa (rede, HTTP 5xx, bloqueio 656, serviço paralisado).
+    """
+    msg = msg or ""
+    if msg.startswith(("Falha HTTP/Conexão", "HTTP 5", "Bloqueado:")):
+        return True
+    return any(f"cStat={c}" in msg for c in TRANSIENT_CSTATS)
+
+
+def _wrap_dist_request(dist_xml: str) -> str:
+    # corpo SOAP (operação nfeDistDFeInteresse)
+    body = f"""
+<nfeDistDFeInteresse xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe">
+  <nfeDadosMsg><![CDATA[{dist_xml}]]></nfeDadosMsg>
+</nfeDistDFeInteresse>
+""".strip()
+
+    return wrap_soap(body)
+
+
+def _build_cons_chave_envelope(
     chave: str,
     pfx_path: str | None,
     pfx_password: str | None,
-    cnpj: str | None,
-    tp_amb: int = 1,
-) -> tuple[bool, str | None, str]:
+    cnpj: str,
+    tp_amb: int,
+) -> tuple[str | None, str]:
     """
-    NF-e Distribuição DF-e (consulta por chave).
-    Retorna (ok, xml_text, msg).
+    Valida os parâmetros e monta o envelope SOAP da consulta por chave.
+    Retorna (envelope, msg_erro). Usado pelas versões sync e async.
     """
-    chave = _only_digits(chave)
-    cnpj = _only_digits(cnpj or "")
-
     if len(chave) != 44:
-        return False, None, "Chave inválida (precisa 44 dígitos)."
+        return None, "Chave inválida (precisa 44 dígitos)."
 
     if not pfx_path or not pfx_password:
-        return False, None, "Falta configurar certificado A1 no conector (pfx_path/senha)."
+        return None, "Falta configurar certificado A1 no conector (pfx_path/senha)."
 
     if len(cnpj) != 14:
-        return False, None, "Falta informar CNPJ (14 dígitos) do certificado no conector."
+        return None, "Falta informar CNPJ (14 dígitos) do certificado no conector."
 
     # 1) monta XML do pedido distDFeInt
     dist_xml = build_distdfeint_cons_chave(chave=chave, cnpj=cnpj, tp_amb=int(tp_amb))
 
-    # 2) corpo SOAP (operação nfeDistDFeInteresse)
-    body = f"""
-<nfeDistDFeInteresse xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe">
-  <nfeDadosMsg><![CDATA[{dist_xml}]]></nfeDadosMsg>
-</nfeDistDFeInteresse>
-""".strip()
+    return _wrap_dist_request(dist_xml), ""
+
+
+class _OnDocError(Exception):
+    """Falha do callback on_doc (gravação local), que não pode passar por erro de rede."""
+
+
+def _guard_on_doc(on_doc):
+    if on_doc is None:
+        return None
+
+    def call(doc):
+        try:
+            on_doc(doc)
+        except Exception as e:
+            raise _OnDocError(e) from e
 
-    envelope = wrap_soap(body)
+    return call
 
-    # 3) certificado mTLS: PFX -> PEM temporário
-    cert_pem, key_pem = pfx_to_pem_files(pfx_path, pfx_password)
 
-    # 4) POST SOAP
+def _post_and_parse(session, envelope: str, on_doc=None) -> tuple[dict | None, str]:
+    """
+    POST SOAP + parse em streaming da resposta. Retorna (parsed, msg_erro).
+    """
+    on_doc = _guard_on_doc(on_doc)
     try:
         resp = post_soap(
             url=NFE_DIST_URL,
             soap_action=SOAP_ACTION,
             envelope_xml=envelope,
-            cert=(cert_pem, key_pem),
+            session=session,
+            stream=True,
         )
     except Exception as e:
-        return False, None, f"Falha HTTP/Conexão com SEFAZ: {e}"
+        return None, f"Falha HTTP/Conexão com SEFAZ: {e}"
+
+    with resp:
+        if resp.status_code != 200:
+            # corta texto para não explodir
+            return None, f"HTTP {resp.status_code}: {resp.text[:400]}"
 
-    if resp.status_code != 200:
-        # corta texto para não explodir
-        return False, None, f"HTTP {resp.status_code}: {resp.text[:400]}"
+        # parse SOAP -> retDistDFeInt -> docZip -> xml, sem montar a árvore inteira
+        try:
+            return collect_distdfeint(iter_distdfeint(resp.iter_content(STREAM_CHUNK)), on_doc), ""
+        except _OnDocError as e:
+            return None, f"Falha ao gravar documento: {e.__cause__}"
+        except PARSE_ERRORS as e:
+            return None, f"HTTP 200 mas falhou ao parsear retorno: {e}"
+        except Exception as e:
+            return None, f"Falha HTTP/Conexão com SEFAZ: {e}"
 
-    # 5) parse SOAP -> retDistDFeInt -> docZip -> xml
+
+async def _post_and_parse_async(client, envelope: str, on_doc=None) -> tuple[dict | None, str]:
+    on_doc = _guard_on_doc(on_doc)
     try:
-        ret_xml = extract_ret_xml_from_soap(resp.text)
-        parsed = parse_ret_distdfeint(ret_xml)
+        async with stream_soap_async(client, NFE_DIST_URL, SOAP_ACTION, envelope) as resp:
+            if resp.status_code != 200:
+                text = (await resp.aread()).decode("utf-8", errors="replace")
+                return None, f"HTTP {resp.status_code}: {text[:400]}"
+
+            parser = DistDFeIntPullParser()
+            parsed = collect_distdfeint([], on_doc)
+            try:
+                async for chunk in resp.aiter_bytes(STREAM_CHUNK):
+                    collect_distdfeint(parser.feed(chunk), on_doc, into=parsed)
+                collect_distdfeint(parser.close(), on_doc, into=parsed)
+            except PARSE_ERRORS as e:
+                return None, f"HTTP 200 mas falhou ao parsear retorno: {e}"
+            return parsed, ""
+    except _OnDocError as e:
+        # erro ao guardar o documento (disco, cache): não é falha da SEFAZ e não adianta repetir
+        return None, f"Falha ao gravar documento: {e.__cause__}"
     except Exception as e:
-        return False, None, f"HTTP 200 mas falhou ao parsear retorno: {e}"
+        return None, f"Falha HTTP/Conexão com SEFAZ: {e}"
 
+
+def _cons_chave_result(cnpj: str, parsed: dict, raw: bool = False) -> tuple[bool, str | bytes | None, str]:
     cstat = parsed.get("cStat", "")
     xmotivo = parsed.get("xMotivo", "")
     docs = parsed.get("docs", [])
+    _note_cstat(cnpj, cstat)
 
     # 138 = Documentos localizados
     # 137 = Nenhum documento localizado
@@ -91,9 +223,197 @@ def download_nfe_xml_by_key_official(
         return False, None, "SEFAZ cStat=138, mas não veio docZip."
 
     first = docs[0]
-    xml_text = first.get("xml", "")
+    # raw: bytes originais do docZip (sem decodificar/recodificar o texto)
+    xml_text = first["xml_bytes"] if raw else first.get("xml", "")
     schema = first.get("schema", "")
     nsu = first.get("nsu", "")
 
     # Pode vir 'resNFe' (resumo) dependendo da permissão/autXML
-    return True, xml_text, f"OK cStat=138 | schema={schema} | NSU={nsu}"
\ No newline at end of file
+    return True, xml_text, f"OK cStat=138 | schema={schema} | NSU={nsu}"
+
+
+def download_nfe_xml_by_key_official(
+    *,
+    chave: str,
+    pfx_path: str | None,
+    pfx_password: str | None,
+    cnpj: str | None,
+    tp_amb: int = 1,
+) -> tuple[bool, str | None, str]:
+    """
+    NF-e Distribuição DF-e (consulta por chave).
+    Retorna (ok, xml_text, msg).
+    """
+    chave = _only_digits(chave)
+    cnpj = _only_digits(cnpj or "")
+
+    envelope, err = _build_cons_chave_envelope(chave, pfx_path, pfx_password, cnpj, tp_amb)
+    if envelope is None:
+        return False, None, err
+
+    # limite por CNPJ/endpoint (e bloqueio de 656)
+    blocked = sefaz_limiter.acquire(cnpj, NFE_DIST_URL)
+    if blocked:
+        return False, None, _blocked_msg(blocked)
+
+    # certificado mTLS: sessão keep-alive reaproveitada entre chaves
+    try:
+        session = get_nfe_dist_session(pfx_path, pfx_password)
+    except Exception as e:
+        return False, None, f"Falha ao carregar certificado A1: {e}"
+
+    parsed, err = _post_and_parse(session, envelope)
+    if parsed is None:
+        return False, None, err
+
+    return _cons_chave_result(cnpj, parsed)
+
+
+async def download_nfe_xml_by_key_official_async(
+    *,
+    chave: str,
+    pfx_path: str | None,
+    pfx_password: str | None,
+    cnpj: str | None,
+    tp_amb: int = 1,
+    raw: bool = False,
+) -> tuple[bool, str | bytes | None, str]:
+    """
+    Igual a download_nfe_xml_by_key_official, mas sem bloquear o event loop
+    enquanto espera a SEFAZ. Com raw=True o XML volta em bytes, exatamente como veio no docZip.
+    """
+    chave = _only_digits(chave)
+    cnpj = _only_digits(cnpj or "")
+
+    envelope, err = _build_cons_chave_envelope(chave, pfx_path, pfx_password, cnpj, tp_amb)
+    if envelope is None:
+        return False, None, err
+
+    blocked = await sefaz_limiter.acquire_async(cnpj, NFE_DIST_URL)
+    if blocked:
+        return False, None, _blocked_msg(blocked)
+
+    try:
+        client = get_nfe_dist_async_client(pfx_path, pfx_password)
+    except Exception as e:
+        return False, None, f"Falha ao carregar certificado A1: {e}"
+
+    parsed, err = await _post_and_parse_async(client, envelope)
+    if parsed is None:
+        return False, None, err
+
+    return _cons_chave_result(cnpj, parsed, raw=raw)
+
+
+def _dist_nsu_result(cnpj: str, parsed: dict) -> tuple[bool, dict, str]:
+    cstat = parsed.get("cStat", "")
+    _note_cstat(cnpj, cstat)
+    # 137 = nenhum documento novo (ok, cursor não anda); 138 = documentos localizados
+    if cstat not in ("137", "138"):
+        return False, parsed, f"SEFAZ cStat={cstat} | {parsed.get('xMotivo', '')}"
+
+    return True, parsed, f"OK cStat={cstat} | ultNSU={parsed.get('ultNSU')} | maxNSU={parsed.get('maxNSU')}"
+
+
+async def fetch_nfe_dist_nsu_page_async(
+    *,
+    ult_nsu: str | int,
+    pfx_path: str | None,
+    pfx_password: str | None,
+    cnpj: str | None,
+    tp_amb: int = 1,
+    cuf_autor: str = "",
+    on_doc=None,
+) -> tuple[bool, dict | None, str]:
+    """
+    Uma página do distNSU (até 50 docs depois de ult_nsu).
+    Retorna (ok, parsed, msg); parsed tem cStat, xMotivo, ultNSU, maxNSU e docs.
+    Com on_doc, cada documento vai para o callback assim que é lido (e não fica em docs).
+    """
+    cnpj = _only_digits(cnpj or "")
+
+    if not pfx_path or not pfx_password:
+        return False, None, "Falta configurar certificado A1 no conector (pfx_path/senha)."
+
+    if len(cnpj) != 14:
+        return False, None, "Falta informar CNPJ (14 dígitos) do certificado no conector."
+
+    dist_xml = build_distdfeint_dist_nsu(cnpj=cnpj, ult_nsu=ult_nsu, tp_amb=int(tp_amb), cuf_autor=cuf_autor)
+    envelope = _wrap_dist_request(dist_xml)
+
+    blocked = await sefaz_limiter.acquire_async(cnpj, NFE_DIST_URL)
+    if blocked:
+        return False, None, _blocked_msg(blocked)
+
+    try:
+        client = get_nfe_dist_async_client(pfx_path, pfx_password)
+    except Exception as e:
+        return False, None, f"Falha ao carregar certificado A1: {e}"
+
+    parsed, err = await _post_and_parse_async(client, envelope, on_doc=on_doc)
+    if parsed is None:
+        return False, None, err
+
+    return _dist_nsu_result(cnpj, parsed)
+
+
+async def sync_nfe_dist_nsu_async(
+    *,
+    ult_nsu: str | int,
+    on_doc,
+    on_cursor=None,
+    pfx_path: str | None,
+    pfx_password: str | None,
+    cnpj: str | None,
+    tp_amb: int = 1,
+    cuf_autor: str = "",
+    max_pages: int = NSU_MAX_PAGES,
+) -> dict:
+    """
+    Puxa tudo desde ult_nsu até o maxNSU, página por página.
+
+    on_doc(doc) é chamado para cada documento (dict com nsu, schema, xml) e
+    on_cursor(ult_nsu, max_nsu) depois que a página inteira foi entregue,
+    para quem chama persistir o cursor só com os docs já guardados.
+    """
+    cursor = _only_digits(str(ult_nsu)) or "0"
+    total = 0
+    pages = 0
+    result = {"ok": True, "ult_nsu": cursor, "max_nsu": "", "docs": 0, "pages": 0, "cStat": "", "msg": ""}
+
+    def deliver(doc: dict) -> None:
+        nonlocal total
+        on_doc(doc)
+        total += 1
+
+    while pages < max_pages:
+        ok, parsed, msg = await fetch_nfe_dist_nsu_page_async(
+            ult_nsu=cursor,
+            pfx_path=pfx_path,
+            pfx_password=pfx_password,
+            cnpj=cnpj,
+            tp_amb=tp_amb,
+            cuf_autor=cuf_autor,
+            on_doc=deliver,
+        )
+        pages += 1
+        result["msg"] = msg
+        result["cStat"] = (parsed or {}).get("cStat", "")
+
+        if not ok:
+            result["ok"] = False
+            break
+
+        new_cursor = _only_digits(parsed.get("ultNSU", "")) or cursor
+        max_nsu = _only_digits(parsed.get("maxNSU", "")) or new_cursor
+        cursor = new_cursor
+        result["max_nsu"] = max_nsu
+        if on_cursor is not None:
+            on_cursor(cursor, max_nsu)
+
+        # 137 = nada novo; ultNSU == maxNSU = chegou ao fim da fila
+        if parsed.get("cStat") == "137" or int(cursor) >= int(max_nsu):
+            break
+
+    result.update({"ult_nsu": cursor, "docs": total, "pages": pages})
+    return result
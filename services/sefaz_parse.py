@@ -3,8 +3,30 @@ from __future__ import annotations
 import base64
 import gzip
 import html
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
 from lxml import etree
 
+# campos simples do retDistDFeInt entregues pelo parser em streaming
+_RET_FIELDS = ("cStat", "xMotivo", "ultNSU", "maxNSU")
+
+# erros de conteúdo (XML/base64/gzip quebrado), para separar de erro de rede
+PARSE_ERRORS = (etree.Error, ValueError, EOFError, gzip.BadGzipFile, zlib.error)
+
+# abaixo disso não compensa mandar para o pool (overhead maior que o ganho)
+PARALLEL_MIN_DOCS = 4
+PARALLEL_MIN_BYTES = 256 * 1024
+
+# quantos docZip ainda em base64 ficam guardados antes de decodificar o lote
+DECODE_BATCH = 16
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
 
 def _safe_parse(xml_text: str):
     s = (xml_text or "").strip()
@@ -36,26 +58,173 @@ def extract_ret_xml_from_soap(soap_xml: str) -> str:
     raise RuntimeError("Não encontrei Result/retDistDFeInt dentro do SOAP.")
 
 
-def _decode_doczip(doczip_text: str) -> str:
-    data = base64.b64decode(doczip_text)
-    xml_bytes = gzip.decompress(data)
-    return xml_bytes.decode("utf-8", errors="replace")
+class DistDoc(dict):
+    """
+    Documento vindo de um docZip: nsu, schema e xml_bytes (bytes originais, sem recodificar).
+    A chave "xml" (texto) só é gerada na primeira vez que alguém pede.
+    """
+
+    def __missing__(self, key):
+        if key != "xml":
+            raise KeyError(key)
+        text = self["xml_bytes"].decode("utf-8", errors="replace")
+        self["xml"] = text
+        return text
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def decode_doczip(doczip_text: str | bytes) -> bytes:
+    # base64 -> gzip -> bytes do XML (zlib solta o GIL, então roda bem em threads)
+    return gzip.decompress(base64.b64decode(doczip_text))
+
+
+def _decode_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="xsist-doczip")
+        return _pool
+
+
+def decode_doczips(doczip_texts: list[str | bytes]) -> list[bytes]:
+    """
+    Decodifica vários docZip de uma vez, em paralelo quando o lote é grande.
+    Devolve os bytes na mesma ordem da entrada.
+    """
+    if len(doczip_texts) < PARALLEL_MIN_DOCS or sum(len(t) for t in doczip_texts) < PARALLEL_MIN_BYTES:
+        return [decode_doczip(t) for t in doczip_texts]
+    return list(_decode_pool().map(decode_doczip, doczip_texts))
+
+
+def _decode_docs(raw_docs: list[dict]) -> list[DistDoc]:
+    payloads = decode_doczips([d["doczip"] for d in raw_docs])
+    return [
+        DistDoc(nsu=d["nsu"], schema=d["schema"], xml_bytes=data)
+        for d, data in zip(raw_docs, payloads)
+    ]
 
 
 def parse_ret_distdfeint(ret_xml: str) -> dict:
     """
-    Lê o retDistDFeInt e devolve cStat, xMotivo e docs (docZip decodificado).
+    Lê o retDistDFeInt e devolve cStat, xMotivo, ultNSU/maxNSU e docs (docZip decodificado).
     """
     ret_root = _safe_parse(ret_xml)
 
     cstat = ret_root.xpath("string(//*[local-name()='cStat'])").strip()
     xmotivo = ret_root.xpath("string(//*[local-name()='xMotivo'])").strip()
+    ult_nsu = ret_root.xpath("string(//*[local-name()='ultNSU'])").strip()
+    max_nsu = ret_root.xpath("string(//*[local-name()='maxNSU'])").strip()
+
+    raw_docs = [
+        {"nsu": dz.get("NSU", "") or dz.get("nsu", ""), "schema": dz.get("schema", ""), "doczip": dz.text or ""}
+        for dz in ret_root.xpath("//*[local-name()='docZip']")
+    ]
+    docs = _decode_docs(raw_docs)
+
+    return {"cStat": cstat, "xMotivo": xmotivo, "ultNSU": ult_nsu, "maxNSU": max_nsu, "docs": docs}
 
-    docs = []
-    for dz in ret_root.xpath("//*[local-name()='docZip']"):
-        schema = dz.get("schema", "")
-        nsu = dz.get("NSU", "") or dz.get("nsu", "")
-        xml = _decode_doczip(dz.text or "")
-        docs.append({"nsu": nsu, "schema": schema, "xml": xml})
 
-    return {"cStat": cstat, "xMotivo": xmotivo, "docs": docs}
\ No newline at end of file
+def _local(tag) -> str:
+    if not isinstance(tag, str):
+        return ""
+    return tag.rsplit("}", 1)[-1]
+
+
+class DistDFeIntPullParser:
+    """
+    Parser incremental da resposta SOAP do nfeDistDFeInteresse.
+
+    Recebe a resposta em pedaços (feed) e devolve eventos conforme lê:
+    ("cStat", str), ("xMotivo", str), ("ultNSU", str), ("maxNSU", str) e
+    ("doc", {"nsu", "schema", "doczip"}). O docZip sai ainda em base64 (quem
+    decodifica é collect_distdfeint, em lote) e o elemento é descartado em seguida,
+    então a memória não cresce com a resposta toda.
+    """
+
+    def __init__(self):
+        self._parser = etree.XMLPullParser(events=("end",), huge_tree=True)
+        self._inner: DistDFeIntPullParser | None = None
+
+    def feed(self, chunk: bytes) -> list[tuple[str, object]]:
+        self._parser.feed(chunk)
+        return self._drain()
+
+    def close(self) -> list[tuple[str, object]]:
+        self._parser.close()
+        return self._drain()
+
+    def _drain(self) -> list[tuple[str, object]]:
+        out = []
+        for _, el in self._parser.read_events():
+            name = _local(el.tag)
+
+            if name == "docZip":
+                out.append(("doc", {
+                    "nsu": el.get("NSU", "") or el.get("nsu", ""),
+                    "schema": el.get("schema", ""),
+                    "doczip": el.text or "",
+                }))
+            elif name in _RET_FIELDS:
+                out.append((name, (el.text or "").strip()))
+            elif "Result" in name and len(el) == 0 and (el.text or "").strip():
+                # retDistDFeInt veio como texto escapado dentro do ...Result
+                inner = DistDFeIntPullParser()
+                text = html.unescape(el.text.strip()) if "&lt;" in el.text else el.text.strip()
+                out.extend(inner.feed(text.encode("utf-8")))
+                out.extend(inner.close())
+            else:
+                continue
+
+            # libera o que já foi lido (elemento atual e irmãos anteriores)
+            el.clear()
+            parent = el.getparent()
+            while el.getprevious() is not None and parent is not None:
+                del parent[0]
+        return out
+
+
+def iter_distdfeint(chunks: Iterable[bytes]) -> Iterator[tuple[str, object]]:
+    """
+    Versão gerador do DistDFeIntPullParser (para respostas lidas em pedaços).
+    """
+    p = DistDFeIntPullParser()
+    for chunk in chunks:
+        if chunk:
+            yield from p.feed(chunk)
+    yield from p.close()
+
+
+def collect_distdfeint(events: Iterable[tuple[str, object]], on_doc=None, into: dict | None = None) -> dict:
+    """
+    Junta os eventos no mesmo formato de parse_ret_distdfeint.
+    Os docZip são decodificados em lote (decode_doczips) ao fim de cada chamada.
+    Com on_doc, os documentos vão direto para o callback e não ficam na lista.
+    `into` permite ir acumulando pedaço por pedaço (leitura assíncrona).
+    """
+    out = into if into is not None else {"cStat": "", "xMotivo": "", "ultNSU": "", "maxNSU": "", "docs": []}
+    pending = []
+
+    def flush():
+        for doc in _decode_docs(pending):
+            if on_doc is not None:
+                on_doc(doc)
+            else:
+                out["docs"].append(doc)
+        pending.clear()
+
+    for kind, value in events:
+        if kind == "doc":
+            pending.append(value)
+            if len(pending) >= DECODE_BATCH:
+                flush()
+        elif not out[kind]:
+            # cStat/xMotivo do retDistDFeInt vêm antes de qualquer campo interno dos docs
+            out[kind] = value
+
+    flush()
+    return out
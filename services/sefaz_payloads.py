@@ -26,4 +26,28 @@ def build_distdfeint_cons_chave(chave: str, cnpj: str, tp_amb: int = 1) -> str:
   <consChNFe>
     <chNFe>{ch}</chNFe>
   </consChNFe>
-</distDFeInt>"""
\ No newline at end of file
+</distDFeInt>"""
+
+
+def build_distdfeint_dist_nsu(cnpj: str, ult_nsu: str | int = 0, tp_amb: int = 1, cuf_autor: str = "") -> str:
+    """
+    Monta o XML oficial do pedido: distDFeInt (distNSU).
+    Pede tudo que chegou para o CNPJ depois de ult_nsu (a SEFAZ devolve até 50 docs por vez).
+    """
+    cnpj = only_digits(cnpj)
+    nsu = only_digits(str(ult_nsu)) or "0"
+    cuf_autor = only_digits(cuf_autor)
+
+    if len(cnpj) != 14:
+        raise ValueError("CNPJ deve ter 14 dígitos.")
+
+    cuf_tag = f"\n  <cUFAutor>{cuf_autor}</cUFAutor>" if cuf_autor else ""
+
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<distDFeInt xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">
+  <tpAmb>{tp_amb}</tpAmb>{cuf_tag}
+  <CNPJ>{cnpj}</CNPJ>
+  <distNSU>
+    <ultNSU>{int(nsu):015d}</ultNSU>
+  </distNSU>
+</distDFeInt>"""
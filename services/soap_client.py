@@ -1,9 +1,24 @@
 from __future__ import annotations
 
+import ssl
+import threading
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
 SOAP_ENV_NS = "http://schemas.xmlsoap.org/soap/envelope/"
 
+# Pool de conexões keep-alive (por certificado + endpoint)
+POOL_MAXSIZE = 10
+SOAP_TIMEOUT = 30
+
+_sessions: dict[tuple[str, str], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+# clientes assíncronos (um por certificado + endpoint, no event loop do conector)
+_async_clients: dict[tuple[str, str], httpx.AsyncClient] = {}
+
 
 def wrap_soap(body_xml: str) -> str:
     return f"""<?xml version="1.0" encoding="utf-8"?>
@@ -14,10 +29,158 @@ def wrap_soap(body_xml: str) -> str:
 </soap:Envelope>"""
 
 
-def post_soap(url: str, soap_action: str, envelope_xml: str, cert: tuple[str, str] | None = None) -> requests.Response:
-    headers = {
+def _soap_headers(soap_action: str) -> dict:
+    return {
         "Content-Type": "text/xml; charset=utf-8",
         "SOAPAction": soap_action,
         "User-Agent": "XSist/1.0",
     }
-    return requests.post(url, data=envelope_xml.encode("utf-8"), headers=headers, cert=cert, timeout=30)
\ No newline at end of file
+
+
+class SSLContextAdapter(HTTPAdapter):
+    """
+    HTTPAdapter que usa um SSLContext pronto (certificado cliente já carregado em memória).
+    """
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs["ssl_context"] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+def get_soap_session(
+    url: str,
+    cert_id: str,
+    ssl_context: ssl.SSLContext,
+    pool_maxsize: int = POOL_MAXSIZE,
+) -> requests.Session:
+    """
+    Devolve uma requests.Session reaproveitável para (cert_id, url).
+
+    A sessão mantém as conexões TLS abertas (keep-alive), então o handshake
+    com certificado cliente acontece uma vez por conexão do pool, e não a cada chave.
+    """
+    key = (cert_id, url)
+    with _sessions_lock:
+        s = _sessions.get(key)
+        if s is not None:
+            return s
+
+        s = requests.Session()
+        adapter = SSLContextAdapter(
+            ssl_context, pool_connections=1, pool_maxsize=pool_maxsize, pool_block=True
+        )
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        _sessions[key] = s
+        return s
+
+
+def warmup_session(session: requests.Session, url: str) -> bool:
+    """
+    Faz um GET leve (?wsdl) só para abrir a conexão e pagar o handshake TLS antes do 1º download.
+    """
+    try:
+        r = session.get(f"{url}?wsdl", headers={"User-Agent": "XSist/1.0"}, timeout=SOAP_TIMEOUT)
+        r.close()
+        return True
+    except Exception:
+        return False
+
+
+def close_soap_sessions() -> None:
+    with _sessions_lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
+
+
+def post_soap(
+    url: str,
+    soap_action: str,
+    envelope_xml: str,
+    cert: tuple[str, str] | None = None,
+    session: requests.Session | None = None,
+    stream: bool = False,
+) -> requests.Response:
+    """
+    stream=True: o corpo não é baixado de uma vez (ler com iter_content e fechar a resposta).
+    """
+    headers = _soap_headers(soap_action)
+    data = envelope_xml.encode("utf-8")
+
+    if session is not None:
+        return session.post(url, data=data, headers=headers, timeout=SOAP_TIMEOUT, stream=stream)
+
+    return requests.post(url, data=data, headers=headers, cert=cert, timeout=SOAP_TIMEOUT, stream=stream)
+
+
+def get_async_soap_client(
+    url: str,
+    cert_id: str,
+    ssl_context: ssl.SSLContext,
+    pool_maxsize: int = POOL_MAXSIZE,
+) -> httpx.AsyncClient:
+    """
+    Versão asyncio de get_soap_session: várias chamadas em andamento
+    dividem o mesmo event loop e o mesmo pool keep-alive, sem uma thread por chamada.
+    """
+    key = (cert_id, url)
+    client = _async_clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            verify=ssl_context,
+            timeout=SOAP_TIMEOUT,
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+        )
+        _async_clients[key] = client
+    return client
+
+
+async def warmup_async_client(client: httpx.AsyncClient, url: str) -> bool:
+    try:
+        r = await client.get(f"{url}?wsdl", headers={"User-Agent": "XSist/1.0"})
+        await r.aclose()
+        return True
+    except Exception:
+        return False
+
+
+async def close_async_soap_clients() -> None:
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for c in clients:
+        await c.aclose()
+
+
+async def post_soap_async(
+    url: str,
+    soap_action: str,
+    envelope_xml: str,
+    client: httpx.AsyncClient | None = None,
+) -> httpx.Response:
+    headers = _soap_headers(soap_action)
+    data = envelope_xml.encode("utf-8")
+
+    if client is not None:
+        return await client.post(url, content=data, headers=headers)
+
+    async with httpx.AsyncClient(timeout=SOAP_TIMEOUT) as c:
+        return await c.post(url, content=data, headers=headers)
+
+
+def stream_soap_async(client: httpx.AsyncClient, url: str, soap_action: str, envelope_xml: str):
+    """
+    POST SOAP assíncrono com a resposta em streaming:
+
+        async with stream_soap_async(client, url, action, env) as resp:
+            async for chunk in resp.aiter_bytes(): ...
+    """
+    return client.stream("POST", url, content=envelope_xml.encode("utf-8"), headers=_soap_headers(soap_action))
@@ -0,0 +1,190 @@
+"""
+Extração de campos dos XMLs (NF-e/CT-e) numa única passada pela árvore.
+
+Os campos são declarados por caminhos curtos com o nome local das tags (ignora namespace):
+    "xNome"        primeiro xNome em qualquer lugar      (string(//*[local-name()='xNome']))
+    "emit/xNome"   primeiro xNome filho direto de emit   (string(//emit/xNome))
+    "infNFe@Id"    atributo Id do primeiro infNFe que tiver Id
+    "@nItem"       atributo do próprio elemento do grupo
+Cada campo aceita caminhos alternativos em ordem (ex.: CNPJ ou CPF): vale o primeiro que vier preenchido.
+Grupos (det da NF-e, Comp do CT-e) viram listas de dicts com campos relativos ao elemento do grupo.
+
+A Spec é compilada uma vez em regras por tag; a extração usa o iter filtrado do lxml (em C)
+e só passa em Python pelos elementos que interessam, em ordem de documento. Custo O(tamanho do XML),
+em vez de um // pela árvore inteira para cada campo (e de novo para cada item).
+"""
+from __future__ import annotations
+
+
+def _local(tag) -> str:
+    return tag.rpartition("}")[2] if isinstance(tag, str) else ""
+
+
+def _text(el) -> str:
+    # mesmo valor do string() do XPath: texto do elemento e dos descendentes
+    if len(el):
+        return "".join(el.itertext()).strip()
+    return (el.text or "").strip()
+
+
+class Spec:
+    """
+    Campos de um tipo de documento, compilados por nome local de tag.
+
+    fields: campo -> caminho ou tupla de caminhos alternativos
+    groups: grupo -> (caminho do elemento que se repete, Spec dos campos dentro dele)
+    """
+
+    def __init__(self, fields: dict[str, str | tuple[str, ...]], groups: dict[str, tuple[str, Spec]] | None = None):
+        self.fields = {k: (v,) if isinstance(v, str) else tuple(v) for k, v in fields.items()}
+        self.groups = dict(groups or {})
+
+        # tag -> [(pai ou None, atributo ou None, campo, índice da alternativa, Spec do grupo ou None)]
+        self._rules: dict[str, list[tuple]] = {}
+        self._self_attrs: list[tuple[str, str, int]] = []
+        for field, paths in self.fields.items():
+            for i, path in enumerate(paths):
+                path, _, attr = path.partition("@")
+                if path:
+                    self._add_rule(path, attr or None, field, i, None)
+                else:
+                    self._self_attrs.append((attr, field, i))
+        for name, (path, sub) in self.groups.items():
+            self._add_rule(path, None, name, 0, sub)
+        self._tags = tuple("{*}" + tag for tag in self._rules)
+
+    def _add_rule(self, path: str, attr: str | None, field: str, i: int, sub: Spec | None) -> None:
+        parent, _, tag = path.rpartition("/")
+        if "/" in parent or not tag:
+            raise ValueError(f"Caminho inválido na Spec: {path!r} (use 'tag' ou 'pai/tag').")
+        self._rules.setdefault(tag, []).append((parent or None, attr, field, i, sub))
+
+    def extract(self, node) -> dict:
+        """
+        Todos os campos (e grupos) a partir do elemento `node`, numa passada.
+        Campo não encontrado vem "".
+        """
+        return _fill(self, node, is_group=False)
+
+
+def _fill(spec: Spec, node, is_group: bool) -> dict:
+    vals = {field: [None] * len(paths) for field, paths in spec.fields.items()}
+    groups: dict[str, list[dict]] = {name: [] for name in spec.groups}
+
+    for attr, field, i in spec._self_attrs:
+        v = node.get(attr)
+        vals[field][i] = v.strip() if v is not None else None
+
+    for el in node.iter(*spec._tags) if spec._tags else ():
+        if is_group and el is node:
+            continue
+        parent = None
+        for rparent, attr, field, i, sub in spec._rules[_local(el.tag)]:
+            if rparent is not None:
+                if parent is None:
+                    p = el.getparent()
+                    parent = _local(p.tag) if p is not None else ""
+                if parent != rparent:
+                    continue
+            if sub is not None:
+                groups[field].append(_fill(sub, el, is_group=True))
+            elif vals[field][i] is None:
+                if attr is None:
+                    vals[field][i] = _text(el)
+                else:
+                    v = el.get(attr)
+                    vals[field][i] = v.strip() if v is not None else None
+
+    out: dict = {field: next((v for v in slot if v), "") for field, slot in vals.items()}
+    out.update(groups)
+    return out
+
+
+# chave: Id do infNFe/infCte ou chNFe/chCTe (resumos, eventos)
+_KEY_FIELDS = {
+    "nfe_id": "infNFe@Id",
+    "cte_id": ("infCte@Id", "infCTe@Id"),
+    "chNFe": "chNFe",
+    "chCTe": "chCTe",
+}
+
+_PARTY_FIELDS = {
+    "emit_nome": "emit/xNome",
+    "emit_cnpj": "emit/CNPJ",
+    "dest_nome": "dest/xNome",
+    "dest_doc": ("dest/CNPJ", "dest/CPF"),
+    "dhEmi": ("ide/dhEmi", "ide/dEmi"),
+    "serie": "ide/serie",
+}
+
+KEY_SPEC = Spec(_KEY_FIELDS)
+
+# resumo genérico (conversão XML -> PDF): serve para NF-e e CT-e
+BASIC_SPEC = Spec({
+    **_KEY_FIELDS,
+    "emit_nome": "emit/xNome",
+    "dest_nome": "dest/xNome",
+    "data": ("ide/dhEmi", "ide/dEmi", "ide/dhCont"),
+    "vNF": "ICMSTot/vNF",
+    "vTPrest": "vPrest/vTPrest",
+})
+
+NFE_SPEC = Spec(
+    {
+        **_KEY_FIELDS,
+        **_PARTY_FIELDS,
+        "nNF": "ide/nNF",
+        "vNF": "ICMSTot/vNF",
+        "vProd": "ICMSTot/vProd",
+        "vICMS": "ICMSTot/vICMS",
+        "qrCode": "qrCode",
+    },
+    groups={
+        "itens": ("det", Spec({
+            "nItem": "@nItem",
+            "cProd": "prod/cProd",
+            "xProd": "prod/xProd",
+            "qCom": "prod/qCom",
+            "uCom": "prod/uCom",
+            "vUnCom": "prod/vUnCom",
+            "vProd": "prod/vProd",
+        })),
+    },
+)
+
+CTE_SPEC = Spec(
+    {
+        **_KEY_FIELDS,
+        **_PARTY_FIELDS,
+        "nCT": "ide/nCT",
+        "natOp": "ide/natOp",
+        "mod": "ide/mod",
+        "tpCTe": "ide/tpCTe",
+        "rem_nome": "rem/xNome",
+        "rem_doc": ("rem/CNPJ", "rem/CPF"),
+        "vTPrest": "vPrest/vTPrest",
+        "vRec": "vPrest/vRec",
+        "vCarga": "infCarga/vCarga",
+        "proPred": "infCarga/proPred",
+        "xOutCat": "infCarga/xOutCat",
+        "qrCode": ("qrCodCTe", "qrCode"),
+    },
+    groups={
+        "comps": ("vPrest/Comp", Spec({"xNome": "xNome", "vComp": "vComp"})),
+    },
+)
+
+
+def key_from_fields(f: dict) -> tuple[str | None, str | None]:
+    """
+    (chave, tipo) a partir dos campos de _KEY_FIELDS: Id do infNFe/infCte, senão chNFe/chCTe.
+    """
+    if f["nfe_id"].startswith("NFe") and len(f["nfe_id"]) >= 47:
+        return f["nfe_id"][3:47], "NFE"
+    if f["cte_id"].startswith("CTe") and len(f["cte_id"]) >= 47:
+        return f["cte_id"][3:47], "CTE"
+    if len(f["chNFe"]) == 44 and f["chNFe"].isdigit():
+        return f["chNFe"], "NFE"
+    if len(f["chCTe"]) == 44 and f["chCTe"].isdigit():
+        return f["chCTe"], "CTE"
+    return None, None
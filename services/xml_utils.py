@@ -1,7 +1,39 @@
 from __future__ import annotations
 
+import re
+import unicodedata
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
 from lxml import etree
 
+from services.xml_extract import KEY_SPEC, key_from_fields
+
+# tag raiz -> schema (mesmos nomes do docZip da SEFAZ, sem versão)
+_ROOT_SCHEMAS = {
+    "nfeProc": "procNFe",
+    "NFe": "NFe",
+    "resNFe": "resNFe",
+    "procEventoNFe": "procEventoNFe",
+    "resEvento": "resEvento",
+    "cteProc": "procCTe",
+    "CTe": "CTe",
+    "procEventoCTe": "procEventoCTe",
+}
+
+# o quanto o XML é "o documento": na mesma chave, um XML só substitui outro de nível igual ou maior
+# (resumo não troca a nota autorizada; evento e resumo de evento ficam de fora, nível 0)
+SCHEMA_RANK = {"procNFe": 3, "procCTe": 3, "NFe": 2, "CTe": 2, "resNFe": 1}
+
+# tamanho máximo do search_text (o índice GIN não precisa do XML inteiro)
+SEARCH_TEXT_MAX = 20_000
+
+# tags cujo texto entra na busca: participantes (CNPJ/CPF/nome) e produtos/carga
+_SEARCH_TAGS = {
+    "CNPJ", "CPF", "xNome", "xFant", "chNFe", "chCTe",
+    "cProd", "xProd", "proPred", "xOutCat",
+}
+
 
 def extract_key_and_type(xml_text: str) -> tuple[str | None, str | None]:
     """
@@ -11,38 +43,195 @@ def extract_key_and_type(xml_text: str) -> tuple[str | None, str | None]:
 
     Retorna (chave, tipo). Se não achar, retorna (None, None) ou (None, tipo).
     """
+    return extract_key_type_schema(xml_text)[:2]
+
+
+def extract_key_type_schema(xml_text: str) -> tuple[str | None, str | None, str]:
+    """
+    Como extract_key_and_type, mais o schema pela tag raiz (procNFe, resNFe, procEventoNFe, ...;
+    "" se não reconhecer). Evento e resumo trazem a chave da nota (chNFe), não são a nota.
+    """
     try:
         root = etree.fromstring(xml_text.encode("utf-8"))
     except Exception:
-        return None, None
-
-    # 1) Tenta pegar pela tag infNFe / infCte (Id="NFe<CHAVE>" ou Id="CTe<CHAVE>")
-    inf_nfe = root.xpath("//*[local-name()='infNFe']")
-    if inf_nfe:
-        id_attr = inf_nfe[0].get("Id", "")
-        if id_attr.startswith("NFe") and len(id_attr) >= 47:
-            return id_attr[3:47], "NFE"
-
-    inf_cte = root.xpath("//*[local-name()='infCte' or local-name()='infCTe']")
-    if inf_cte:
-        id_attr = inf_cte[0].get("Id", "")
-        if id_attr.startswith("CTe") and len(id_attr) >= 47:
-            return id_attr[3:47], "CTE"
-
-    # 2) Fallback: tenta achar chNFe / chCTe em qualquer lugar do XML
-    chnfe = root.xpath("string(//*[local-name()='chNFe'])").strip()
-    if len(chnfe) == 44 and chnfe.isdigit():
-        return chnfe, "NFE"
-
-    chcte = root.xpath("string(//*[local-name()='chCTe' or local-name()='chCTe'])").strip()
-    if len(chcte) == 44 and chcte.isdigit():
-        return chcte, "CTE"
+        return None, None, ""
+    schema = _ROOT_SCHEMAS.get(_local(root.tag), "")
+
+    # 1) Id="NFe<CHAVE>" / Id="CTe<CHAVE>" do infNFe/infCte; 2) chNFe / chCTe em qualquer lugar do XML
+    chave, tipo = key_from_fields(KEY_SPEC.extract(root))
+    if chave:
+        return chave, tipo, schema
 
     # Se não achou chave, pelo menos tenta inferir tipo pelo nome das tags
     xml_lower = xml_text.lower()
     if "infnfe" in xml_lower:
-        return None, "NFE"
+        return None, "NFE", schema
     if "infcte" in xml_lower or "infcte" in xml_lower:
-        return None, "CTE"
+        return None, "CTE", schema
+
+    return None, None, schema
+
+
+def _local(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _child_text(node, *path: str) -> str:
+    # caminho por nome local (ignora namespace), só descendo nos filhos diretos
+    for name in path:
+        if node is None:
+            return ""
+        node = next((c for c in node if _local(c.tag) == name), None)
+    return (node.text or "").strip() if node is not None else ""
+
+
+def _parse_dt(s: str) -> datetime | None:
+    try:
+        return datetime.fromisoformat(s) if s else None
+    except ValueError:
+        return None
+
+
+def _parse_dec(s: str) -> Decimal | None:
+    try:
+        return Decimal(s) if s else None
+    except InvalidOperation:
+        return None
+
+
+def _parse_int(s: str) -> int | None:
+    return int(s) if s.isdigit() else None
+
+
+def normalize_search_text(s: str) -> str:
+    """
+    Forma usada na busca (coluna search_text e termos pesquisados):
+    sem acento, maiúsculas e espaços simples.
+    """
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(c for c in s if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", s).strip().upper()
+
+
+def _search_text(root) -> str:
+    # chave + participantes + produtos, sem repetir termos (o tsvector não precisa de frequência)
+    parts: dict[str, None] = {}
+    inf = next(root.iter("{*}infNFe", "{*}infCte"), None)
+    if inf is not None and len(inf.get("Id", "")) >= 47:
+        parts[inf.get("Id")[3:47]] = None
+    for el in root.iter():
+        if _local(el.tag) in _SEARCH_TAGS and el.text and el.text.strip():
+            parts[el.text.strip()] = None
+    return normalize_search_text(" ".join(parts))[:SEARCH_TEXT_MAX]
+
+
+def _desc_text(node, name: str) -> str:
+    # primeiro descendente com o nome local (grupos que variam: ICMS00/ICMS20/..., PISAliq/PISOutr/...)
+    if node is None:
+        return ""
+    el = next(node.iter("{*}" + name), None)
+    return (el.text or "").strip() if el is not None else ""
+
+
+def _nfe_items(inf) -> list[dict]:
+    """
+    Itens (det) da NF-e para a tabela xml_doc_items: produto e valores de impostos.
+    """
+    items = []
+    for det in inf:
+        if _local(det.tag) != "det":
+            continue
+        prod = next((c for c in det if _local(c.tag) == "prod"), None)
+        imposto = next((c for c in det if _local(c.tag) == "imposto"), None)
+        groups = {_local(c.tag): c for c in imposto} if imposto is not None else {}
+        icms = groups.get("ICMS")
+        items.append({
+            "n_item": _parse_int(det.get("nItem", "")) or len(items) + 1,
+            "c_prod": _child_text(prod, "cProd")[:60] or None,
+            "x_prod": _child_text(prod, "xProd")[:120] or None,
+            "ncm": _child_text(prod, "NCM")[:8] or None,
+            "cfop": _child_text(prod, "CFOP")[:4] or None,
+            "u_com": _child_text(prod, "uCom")[:6] or None,
+            "q_com": _parse_dec(_child_text(prod, "qCom")),
+            "v_un_com": _parse_dec(_child_text(prod, "vUnCom")),
+            "v_prod": _parse_dec(_child_text(prod, "vProd")),
+            "v_desc": _parse_dec(_child_text(prod, "vDesc")),
+            "cst": (_desc_text(icms, "CST") or _desc_text(icms, "CSOSN"))[:3] or None,
+            "v_icms": _parse_dec(_desc_text(icms, "vICMS")),
+            "v_icms_st": _parse_dec(_desc_text(icms, "vICMSST")),
+            "v_ipi": _parse_dec(_desc_text(groups.get("IPI"), "vIPI")),
+            "v_pis": _parse_dec(_desc_text(groups.get("PIS"), "vPIS")),
+            "v_cofins": _parse_dec(_desc_text(groups.get("COFINS"), "vCOFINS")),
+        })
+    return items
+
+
+def extract_doc_metadata(xml_text: str) -> dict:
+    """
+    Campos fiscais para as colunas de xml_docs (ver extract_doc).
+    """
+    return extract_doc(xml_text)[0]
+
+
+def extract_doc(xml_text: str) -> tuple[dict, list[dict]]:
+    """
+    Campos fiscais para as colunas de xml_docs e itens da NF-e, lidos numa única passada pelo XML.
+
+    Metadados: emit_cnpj, emit_nome, dest_doc, dest_nome, dh_emi (datetime), valor (Decimal),
+    serie, numero, schema e search_text (texto da busca, ver normalize_search_text).
+    Campo ausente vem None ("" no schema/search_text se não reconhecer).
+    Itens: lista de dicts com as colunas de xml_doc_items (vazia para CT-e, resumo e evento).
+    """
+    meta = {
+        "emit_cnpj": None, "emit_nome": None, "dest_doc": None, "dest_nome": None,
+        "dh_emi": None, "valor": None, "serie": None, "numero": None, "schema": "",
+        "search_text": "",
+    }
+    try:
+        root = etree.fromstring(xml_text.encode("utf-8"))
+    except Exception:
+        return meta, []
+
+    meta["schema"] = _ROOT_SCHEMAS.get(_local(root.tag), "")
+    meta["search_text"] = _search_text(root)
+
+    # resNFe (resumo) traz os campos soltos na raiz
+    if meta["schema"] == "resNFe":
+        meta.update(
+            emit_cnpj=_child_text(root, "CNPJ") or _child_text(root, "CPF") or None,
+            emit_nome=_child_text(root, "xNome") or None,
+            dh_emi=_parse_dt(_child_text(root, "dhEmi")),
+            valor=_parse_dec(_child_text(root, "vNF")),
+        )
+        return _trim_names(meta), []
+
+    inf = next(root.iter("{*}infNFe", "{*}infCte"), None)
+    if inf is None:
+        return meta, []
+
+    ide = next((c for c in inf if _local(c.tag) == "ide"), None)
+    emit = next((c for c in inf if _local(c.tag) == "emit"), None)
+    dest = next((c for c in inf if _local(c.tag) == "dest"), None)
+
+    is_cte = _local(inf.tag) == "infCte"
+    meta.update(
+        emit_cnpj=_child_text(emit, "CNPJ") or _child_text(emit, "CPF") or None,
+        emit_nome=_child_text(emit, "xNome") or None,
+        dest_doc=_child_text(dest, "CNPJ") or _child_text(dest, "CPF") or None,
+        dest_nome=_child_text(dest, "xNome") or None,
+        dh_emi=_parse_dt(_child_text(ide, "dhEmi") or _child_text(ide, "dEmi")),
+        valor=_parse_dec(
+            _child_text(inf, "vPrest", "vTPrest") if is_cte else _child_text(inf, "total", "ICMSTot", "vNF")
+        ),
+        serie=_parse_int(_child_text(ide, "serie")),
+        numero=_parse_int(_child_text(ide, "nCT" if is_cte else "nNF")),
+    )
+    return _trim_names(meta), [] if is_cte else _nfe_items(inf)
+
 
-    return None, None
\ No newline at end of file
+def _trim_names(meta: dict) -> dict:
+    # xNome tem até 60 caracteres no leiaute; corta em 200 por garantia (tamanho da coluna)
+    for k in ("emit_nome", "dest_nome"):
+        if meta[k]:
+            meta[k] = meta[k][:200]
+    return meta
@@ -0,0 +1,53 @@
+import asyncio
+
+from connector.jobs import JobRunner, JobStore
+
+
+def test_batch_saturado_nao_trava_os_outros(tmp_path):
+    # lote antigo com mais chaves que o limit de pending() e concurrency 1;
+    # o lote novo (concurrency 4) tem que rodar em paralelo a ele
+    store = JobStore(tmp_path / "jobs.sqlite")
+    a = store.create_batch("NFE", [f"a{i}" for i in range(300)], concurrency=1, batch_id="A")
+    b = store.create_batch("NFE", [f"b{i}" for i in range(5)], concurrency=4, batch_id="B")
+
+    started: list[str] = []
+
+    async def process(chave, tipo):
+        started.append(chave)
+        await asyncio.sleep(0.05 if chave.startswith("a") else 0)
+        return True, b"<xml/>", "ok"
+
+    async def main():
+        runner = JobRunner(store, process, lambda attempts, msg: None, concurrency=8)
+        task = asyncio.create_task(runner.run())
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if store.summary(b)["finished"]:
+                break
+        task.cancel()
+
+    asyncio.run(main())
+
+    assert store.summary(b)["finished"]
+    assert {ch for ch in started if ch.startswith("b")} == {f"b{i}" for i in range(5)}
+    assert sum(ch.startswith("a") for ch in started) < 300
+    assert store.summary(a)["finished"] is False
+
+
+def test_pending_limita_por_concurrency_do_lote(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite")
+    store.create_batch("NFE", [f"a{i}" for i in range(300)], concurrency=1, batch_id="A")
+    store.create_batch("NFE", [f"b{i}" for i in range(5)], concurrency=4, batch_id="B")
+
+    rows = store.pending()
+    assert [r[1] for r in rows] == ["a0", "b0", "b1", "b2", "b3"]
+
+
+def test_acrescentar_chaves_continua_idx(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite")
+    store.create_batch("NFE", ["k0", "k1"], concurrency=5, batch_id="A")
+    store.create_batch("NFE", ["k1", "k2", "k3"], concurrency=5, batch_id="A")
+
+    idx = dict(store._db.execute("SELECT chave, idx FROM jobs WHERE batch_id = 'A'").fetchall())
+    assert idx["k0"] < idx["k1"] < idx["k2"] < idx["k3"]
+    assert len(set(idx.values())) == 4
@@ -0,0 +1,179 @@
+"""
+Partições mensais de xml_docs e downloads (ver data/partitions.py): criação antecipada,
+retenção e arquivamento.
+
+    python -m tools.archive_partitions list
+    python -m tools.archive_partitions ensure --ahead 2
+    python -m tools.archive_partitions archive downloads --keep-months 12 --out D:\\arquivo
+    python -m tools.archive_partitions archive xml_docs --keep-months 72 --out D:\\arquivo --dry-run
+
+O archive desanexa cada partição mais antiga que o período mantido, exporta para
+<out>/<partição>.csv.gz (COPY em CSV com cabeçalho) e só então apaga a tabela.
+Arquivar xml_docs leva junto a partição de xml_doc_items do mesmo mês, e os meses que saem
+de xml_docs/xml_doc_items ficam marcados para o painel recalcular os totais (data/summary.py).
+Para voltar um mês: crie a partição (ensure) e carregue o CSV com COPY ... FROM.
+Com --keep-detached a tabela desanexada fica no banco em vez de ser apagada.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import text
+
+from data.db import engine, init_db
+from data.partitions import (
+    PARTITION_COLUMN,
+    create_partitions,
+    forget_partitions,
+    list_partitions,
+    month_start,
+    next_month,
+    partition_name,
+)
+from data.summary import mark_dirty
+
+# partições que saem junto com as da tabela pedida (mesmo mês): os itens seguem o documento
+_ARCHIVE_WITH = {"xml_docs": ("xml_doc_items",)}
+
+# tabelas que alimentam os totais do painel
+_SUMMARY_TABLES = {"xml_docs", "xml_doc_items"}
+
+
+def _partition_month(table: str, name: str) -> date | None:
+    # <tabela>_AAAAMM (data.partitions.partition_name)
+    suffix = name[len(table) + 1:]
+    if not (name.startswith(table + "_") and len(suffix) == 6 and suffix.isdigit()):
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def _months_back(m: date, n: int) -> date:
+    total = m.year * 12 + (m.month - 1) - n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def cmd_list(args) -> None:
+    with engine.connect() as conn:
+        for table in PARTITION_COLUMN:
+            print(f"{table}:")
+            for name in list_partitions(conn, table):
+                rows, size = conn.execute(text(
+                    "SELECT c.reltuples::bigint, pg_size_pretty(pg_total_relation_size(c.oid))"
+                    " FROM pg_class c WHERE c.oid = to_regclass(:n)"
+                ), {"n": name}).one()
+                print(f"  {name:<20} ~{max(rows, 0):>12} linhas  {size:>10}")
+
+
+def cmd_ensure(args) -> None:
+    # criação antecipada (agendador): downloads grava no mês corrente, então garante os próximos
+    m = month_start(datetime.utcnow())
+    months = [m]
+    for _ in range(args.ahead):
+        months.append(next_month(months[-1]))
+    with engine.begin() as conn:
+        for table in PARTITION_COLUMN:
+            for name in create_partitions(conn, table, months):
+                print("criada:", name)
+
+
+def _export(name: str, out: Path) -> int:
+    """
+    COPY da partição para <out>/<name>.csv.gz. Sem as colunas geradas (o COPY de volta recalcula).
+    """
+    out.mkdir(parents=True, exist_ok=True)
+    with engine.connect() as conn:
+        cols = conn.execute(text(
+            "SELECT column_name FROM information_schema.columns"
+            " WHERE table_name = :n AND is_generated = 'NEVER' ORDER BY ordinal_position"
+        ), {"n": name}).scalars().all()
+
+    path = out / f"{name}.csv.gz"
+    tmp = path.with_suffix(".gz.tmp")
+    size = 0
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur, gzip.open(tmp, "wb", compresslevel=6) as f:
+            with cur.copy(f"COPY (SELECT {', '.join(cols)} FROM {name}) TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+                for data in copy:
+                    f.write(data)
+                    size += len(data)
+    finally:
+        raw.close()
+    tmp.replace(path)
+    return size
+
+
+def _archive_partition(table: str, name: str, m: date, out: Path, keep_detached: bool) -> None:
+    # desanexa primeiro: ninguém mais grava nela enquanto exporta
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    forget_partitions(table, [m])
+
+    try:
+        size = _export(name, out)
+    except Exception as e:
+        print(f"{name}: falha ao exportar ({e}); a tabela ficou desanexada no banco.")
+        raise
+
+    if not keep_detached:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {name}"))
+    print(f"{name}: {size / 1e6:.1f} MB exportados para {out / (name + '.csv.gz')}")
+
+
+def cmd_archive(args) -> None:
+    cutoff = _months_back(month_start(datetime.utcnow()), args.keep_months - 1)
+    companions = _ARCHIVE_WITH.get(args.table, ())
+    with engine.connect() as conn:
+        old = [
+            (name, m) for name in list_partitions(conn, args.table)
+            if (m := _partition_month(args.table, name)) and m < cutoff
+        ]
+        existing = {t: set(list_partitions(conn, t)) for t in companions}
+    if not old:
+        print(f"Nenhuma partição de {args.table} anterior a {cutoff:%m/%Y}.")
+        return
+
+    out = Path(args.out).expanduser()
+    for name, m in old:
+        parts = [(args.table, name)] + [
+            (t, partition_name(t, m)) for t in companions if partition_name(t, m) in existing[t]
+        ]
+        if args.dry_run:
+            for _, pname in parts:
+                print("arquivaria:", pname)
+            continue
+
+        for table, pname in parts:
+            _archive_partition(table, pname, m, out, args.keep_detached)
+        if args.table in _SUMMARY_TABLES:
+            with engine.begin() as conn:
+                mark_dirty(conn, [m])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Partições mensais: criação, retenção e arquivamento")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    sub.add_parser("list")
+
+    p = sub.add_parser("ensure")
+    p.add_argument("--ahead", type=int, default=2, help="meses à frente do atual")
+
+    p = sub.add_parser("archive")
+    p.add_argument("table", choices=sorted(PARTITION_COLUMN))
+    p.add_argument("--keep-months", type=int, required=True, help="meses mantidos no banco (contando o atual)")
+    p.add_argument("--out", required=True, help="pasta dos .csv.gz")
+    p.add_argument("--keep-detached", action="store_true", help="não apaga a tabela depois de exportar")
+    p.add_argument("--dry-run", action="store_true")
+
+    args = ap.parse_args()
+    init_db()
+    {"list": cmd_list, "ensure": cmd_ensure, "archive": cmd_archive}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Preenche, nas linhas de xml_docs gravadas antes dessas colunas existirem, os metadados fiscais
+(emitente, destinatário, dhEmi, valor, série, número, schema), o texto da busca (search_text)
+e o hash do conteúdo (xml_sha256).
+
+    python -m tools.backfill_xml_metadata --batch 500
+    python -m tools.backfill_xml_metadata --all   # refaz todas (ex.: depois de mudar a extração)
+    python -m tools.backfill_xml_metadata --items # (re)grava os itens de todas as NF-e (xml_doc_items)
+
+Anda por id em lotes com commit por lote: pode ser interrompido e rodado de novo.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+from sqlalchemy import or_, select, update
+
+from data.db import SessionLocal, init_db
+from data.models import XmlDoc
+from data.partitions import ensure_partitions
+from data.repo import replace_xml_doc_items, xml_sha256
+from data.summary import mark_dirty
+from data.xml_codec import xml_body
+from services.xml_utils import extract_doc
+
+
+def backfill(batch: int = 500, redo_all: bool = False, items: bool = False) -> int:
+    last_id = 0
+    done = 0
+    while True:
+        db = SessionLocal()
+        try:
+            stmt = select(
+                XmlDoc.id, XmlDoc.chave, XmlDoc.tipo, XmlDoc.mes, XmlDoc.xml_text, XmlDoc.xml_data
+            ).where(XmlDoc.id > last_id)
+            if items:
+                stmt = stmt.where(XmlDoc.tipo == "NFE")
+            elif not redo_all:
+                stmt = stmt.where(or_(
+                    XmlDoc.schema.is_(None), XmlDoc.search_text.is_(None), XmlDoc.xml_sha256.is_(None)
+                ))
+            rows = db.execute(stmt.order_by(XmlDoc.id).limit(batch)).all()
+            if not rows:
+                return done
+
+            changes, docs, doc_items = [], [], []
+            for doc_id, chave, tipo, mes, xml_text, xml_data in rows:
+                body = xml_body(xml_text, xml_data)
+                meta, its = extract_doc(body)
+                changes.append({"id": doc_id, "xml_sha256": xml_sha256(body), **meta})
+                if items:
+                    docs.append((chave, mes))
+                    doc_items.extend({"chave": chave, "mes": mes, **it} for it in its)
+            db.execute(update(XmlDoc), changes)
+            if items:
+                ensure_partitions("xml_doc_items", {mes for _, mes in docs})
+                replace_xml_doc_items(db, docs, doc_items)
+            mark_dirty(db, {row.mes for row in rows})  # totais do painel
+            db.commit()
+        finally:
+            db.close()
+
+        last_id = rows[-1][0]
+        done += len(rows)
+        print(f"\r{done} linhas atualizadas (id até {last_id})...", end="", flush=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Backfill dos metadados fiscais em xml_docs")
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--all", action="store_true", help="refaz também as linhas que já têm metadados")
+    ap.add_argument("--items", action="store_true", help="(re)grava os itens de todas as NF-e")
+    args = ap.parse_args()
+
+    init_db()
+    t0 = time.perf_counter()
+    done = backfill(args.batch, args.all, args.items)
+    print(f"\nFim: {done} linhas em {time.perf_counter() - t0:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()
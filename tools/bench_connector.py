@@ -0,0 +1,184 @@
+"""
+Benchmark do conector local: /download (uma chave por requisição) e /download/batch (NDJSON).
+
+Mede requisições/s e latência p50/p95/p99. Use contra o tools/mock_sefaz.py, nunca contra
+a SEFAZ de produção. No config.json do conector, suba o limite de consumo para não medir
+só o rate limit (ex.: "sefaz_rate_per_min": 100000, "sefaz_burst": 100).
+
+Uso:
+    python -m tools.bench_connector --mode single -n 500 -c 8
+    python -m tools.bench_connector --mode batch -n 500 --batch-concurrency 8
+    python -m tools.bench_connector --setup-cert   # grava o client.pfx do mock no conector
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+from pathlib import Path
+
+import httpx
+
+from tools.mock_sefaz import MOCK_CNPJ, MOCK_PFX_PASSWORD
+
+CONNECTOR_URL = "http://127.0.0.1:8765"
+
+
+def _dv(chave43: str) -> str:
+    # dígito verificador da chave (módulo 11, pesos 2..9 da direita para a esquerda)
+    total = sum(int(d) * (2 + i % 8) for i, d in enumerate(reversed(chave43)))
+    r = total % 11
+    return "0" if r < 2 else str(11 - r)
+
+
+def make_keys(n: int, seed: int | None = None) -> list[str]:
+    """
+    Chaves NF-e válidas (formato e DV) e diferentes entre si, para não cair no cache local.
+    """
+    rnd = random.Random(seed)
+    keys = []
+    for i in range(n):
+        k = f"352401{MOCK_CNPJ}55001{i + 1:09d}1{rnd.randint(0, 10**8 - 1):08d}"
+        keys.append(k + _dv(k))
+    return keys
+
+
+def percentile(values: list[float], p: float) -> float:
+    # nearest-rank
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, int(round(p / 100 * len(s) + 0.5)) - 1))
+    return s[k]
+
+
+def report(name: str, latencies: list[float], elapsed: float, ok: int, err: int) -> dict:
+    return {
+        "mode": name,
+        "n": ok + err,
+        "ok": ok,
+        "err": err,
+        "elapsed_s": round(elapsed, 3),
+        "req_per_s": round((ok + err) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+async def bench_single(url: str, keys: list[str], concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    ok = err = 0
+
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(chave: str):
+            nonlocal ok, err
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(f"{url}/download", json={"tipo": "NFE", "chave": chave})
+                    good = r.status_code == 200 and r.json().get("ok")
+                except httpx.HTTPError:
+                    good = False
+                latencies.append(time.perf_counter() - t0)
+                if good:
+                    ok += 1
+                else:
+                    err += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(k) for k in keys))
+        elapsed = time.perf_counter() - t0
+
+    return report("single", latencies, elapsed, ok, err)
+
+
+async def bench_batch(url: str, keys: list[str], concurrency: int) -> dict:
+    """
+    Um lote com todas as chaves; latência = tempo do POST até a linha da chave chegar.
+    """
+    latencies: list[float] = []
+    ok = err = 0
+    first = None
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        t0 = time.perf_counter()
+        body = {"tipo": "NFE", "chaves": keys, "concurrency": concurrency}
+        async with client.stream("POST", f"{url}/download/batch", json=body) as r:
+            async for line in r.aiter_lines():
+                if not line.strip():
+                    continue
+                now = time.perf_counter() - t0
+                first = now if first is None else first
+                latencies.append(now)
+                if json.loads(line).get("ok"):
+                    ok += 1
+                else:
+                    err += 1
+        elapsed = time.perf_counter() - t0
+
+    out = report("batch", latencies, elapsed, ok, err)
+    out["first_item_ms"] = round((first or 0) * 1000, 1)
+    return out
+
+
+def setup_cert(url: str, mock_dir: Path) -> None:
+    pfx = (mock_dir / "client.pfx").read_bytes()
+    r = httpx.post(f"{url}/config/cert", json={
+        "pfx_b64": base64.b64encode(pfx).decode("ascii"),
+        "password": MOCK_PFX_PASSWORD,
+        "cnpj": MOCK_CNPJ,
+        "tp_amb": 1,
+    }, timeout=30)
+    print(r.json().get("msg"))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark do conector XSist")
+    ap.add_argument("--url", default=CONNECTOR_URL)
+    ap.add_argument("--mode", choices=("single", "batch", "both"), default="both")
+    ap.add_argument("-n", type=int, default=200, help="quantidade de chaves")
+    ap.add_argument("-c", type=int, default=8, help="requisições simultâneas em /download")
+    ap.add_argument("--batch-concurrency", type=int, default=4)
+    ap.add_argument("--repeat", action="store_true", help="reusa as mesmas chaves (mede o cache local)")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--json", action="store_true", help="saída em JSON (para comparar execuções)")
+    ap.add_argument("--setup-cert", action="store_true", help="grava o client.pfx do mock no conector e sai")
+    ap.add_argument("--mock-dir", default=str(Path.home() / ".xsist" / "mock_sefaz"))
+    args = ap.parse_args()
+
+    if args.setup_cert:
+        setup_cert(args.url, Path(args.mock_dir))
+        return
+
+    status = httpx.get(f"{args.url}/status", timeout=10).json()
+    limiter = status.get("limiter") or {}
+    if limiter.get("rate_per_min", 0) < args.n:
+        print(f"Aviso: limite do conector = {limiter.get('rate_per_min')}/min; o resultado vai medir o rate limit.")
+
+    # sem --repeat, chaves novas a cada execução (senão o cache local responde tudo)
+    seed = args.seed if args.seed is not None else (0 if args.repeat else time.time_ns())
+    results = []
+    if args.mode in ("single", "both"):
+        results.append(asyncio.run(bench_single(args.url, make_keys(args.n, seed), args.c)))
+    if args.mode in ("batch", "both"):
+        batch_seed = seed if args.repeat else seed + 1
+        results.append(asyncio.run(bench_batch(args.url, make_keys(args.n, batch_seed), args.batch_concurrency)))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        extra = f" | 1º item {r['first_item_ms']} ms" if "first_item_ms" in r else ""
+        print(
+            f"{r['mode']:>6}: {r['n']} chaves ({r['ok']} ok, {r['err']} erro) em {r['elapsed_s']} s"
+            f" | {r['req_per_s']} req/s | p50 {r['p50_ms']} ms | p95 {r['p95_ms']} ms | p99 {r['p99_ms']} ms{extra}"
+        )
+
+
+if __name__ == "__main__":
+    main()
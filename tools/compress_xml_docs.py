@@ -0,0 +1,116 @@
+"""
+Compactação dos XMLs guardados em xml_docs (ver data/xml_codec.py).
+
+    python -m tools.compress_xml_docs stats
+    python -m tools.compress_xml_docs train --samples 2000   # dicionário zstd com os nossos XMLs
+    python -m tools.compress_xml_docs migrate                # compacta as linhas ainda em texto
+    python -m tools.compress_xml_docs migrate --recompress   # refaz tudo com o dicionário ativo
+
+O migrate anda por id em lotes (commit por lote), então pode ser interrompido e rodado de novo.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+from sqlalchemy import func, select, text, update
+
+from data.db import SessionLocal, init_db
+from data.models import XmlDict, XmlDoc
+from data.xml_codec import compress_xml, reload_dicts, train_dict, xml_body
+
+
+def cmd_stats(args) -> None:
+    db = SessionLocal()
+    try:
+        total, compressed, text_bytes, data_bytes = db.execute(select(
+            func.count(),
+            func.count(XmlDoc.xml_data),
+            func.coalesce(func.sum(func.octet_length(XmlDoc.xml_text)), 0),
+            func.coalesce(func.sum(func.octet_length(XmlDoc.xml_data)), 0),
+        )).one()
+        table_size = db.execute(text("SELECT pg_size_pretty(pg_total_relation_size('xml_docs'))")).scalar()
+        active = db.execute(select(XmlDict.id).where(XmlDict.active)).scalar()
+    finally:
+        db.close()
+
+    print(f"linhas: {total} | compactadas: {compressed} | em texto: {total - compressed}")
+    print(f"texto: {text_bytes / 1e6:.1f} MB | compactado: {data_bytes / 1e6:.1f} MB | tabela: {table_size}")
+    print(f"dicionário zstd ativo: {active or '(nenhum)'}")
+
+
+def cmd_train(args) -> None:
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(XmlDoc.xml_text, XmlDoc.xml_data).order_by(XmlDoc.id.desc()).limit(args.samples)
+        ).all()
+        samples = [xml_body(t, d).encode("utf-8") for t, d in rows]
+        if len(samples) < 10:
+            print("Poucos XMLs para treinar um dicionário (mínimo 10).")
+            return
+
+        d = train_dict(samples, args.dict_kb * 1024)
+        db.execute(update(XmlDict).values(active=False))
+        db.merge(XmlDict(id=d.dict_id(), dict_data=d.as_bytes(), active=True))
+        db.commit()
+    finally:
+        db.close()
+
+    reload_dicts()
+    print(f"Dicionário {d.dict_id()} treinado com {len(samples)} XMLs ({len(d.as_bytes()) // 1024} KB) e ativado.")
+
+
+def cmd_migrate(args) -> None:
+    last_id = 0
+    done = 0
+    t0 = time.perf_counter()
+    while True:
+        db = SessionLocal()
+        try:
+            stmt = select(XmlDoc.id, XmlDoc.xml_text, XmlDoc.xml_data).where(XmlDoc.id > last_id)
+            if not args.recompress:
+                stmt = stmt.where(XmlDoc.xml_data.is_(None))
+            rows = db.execute(stmt.order_by(XmlDoc.id).limit(args.batch)).all()
+            if not rows:
+                break
+
+            changes = []
+            for doc_id, xml_text, xml_data in rows:
+                data = compress_xml(xml_body(xml_text, xml_data))
+                if data is not None:
+                    changes.append({"id": doc_id, "xml_text": None, "xml_data": data})
+            if changes:
+                db.execute(update(XmlDoc), changes)
+            db.commit()
+        finally:
+            db.close()
+
+        last_id = rows[-1][0]
+        done += len(changes)
+        print(f"\r{done} linhas compactadas (id até {last_id})...", end="", flush=True)
+
+    print(f"\nFim: {done} linhas em {time.perf_counter() - t0:.1f} s. Rode VACUUM em xml_docs para devolver o espaço.")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compactação dos XMLs em xml_docs")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    sub.add_parser("stats")
+
+    p = sub.add_parser("train")
+    p.add_argument("--samples", type=int, default=2000)
+    p.add_argument("--dict-kb", type=int, default=112)
+
+    p = sub.add_parser("migrate")
+    p.add_argument("--batch", type=int, default=500)
+    p.add_argument("--recompress", action="store_true", help="refaz também as linhas já compactadas")
+
+    args = ap.parse_args()
+    init_db()
+    {"stats": cmd_stats, "train": cmd_train, "migrate": cmd_migrate}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    main()
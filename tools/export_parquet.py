@@ -0,0 +1,145 @@
+"""
+Exporta documentos (xml_docs, sem o XML) e itens das NF-e (xml_doc_items) para Parquet,
+particionado por mês de emissão (hive: ano_mes=AAAA-MM), para relatórios em DuckDB/pandas/Excel.
+
+    python -m tools.export_parquet --out D:\\analytics                  # últimos 12 meses
+    python -m tools.export_parquet --out D:\\analytics --from 2024-01 --to 2024-12
+
+Estrutura:
+    <out>/documentos/ano_mes=2024-01/part-0.parquet
+    <out>/itens/ano_mes=2024-01/part-0.parquet   (com emitente/destinatário/dhEmi do documento)
+
+Cada mês é reescrito inteiro: rodar de novo só atualiza os meses pedidos.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from sqlalchemy import Date, DateTime, Integer, Numeric, select
+
+from data.db import SessionLocal, init_db
+from data.models import XmlDoc, XmlDocItem
+from data.partitions import month_start, next_month
+
+ROWS_PER_BATCH = 50_000
+
+
+def _doc_query(mes: date):
+    return select(
+        XmlDoc.chave,
+        XmlDoc.tipo,
+        XmlDoc.schema,
+        XmlDoc.emit_cnpj,
+        XmlDoc.emit_nome,
+        XmlDoc.dest_doc,
+        XmlDoc.dest_nome,
+        XmlDoc.dh_emi,
+        XmlDoc.serie,
+        XmlDoc.numero,
+        XmlDoc.valor,
+        XmlDoc.created_at,
+    ).where(XmlDoc.mes == mes).order_by(XmlDoc.chave)
+
+
+def _item_query(mes: date):
+    item_cols = [c for c in XmlDocItem.__table__.columns if c.name != "mes"]
+    return (
+        select(*item_cols, XmlDoc.emit_cnpj, XmlDoc.dest_doc, XmlDoc.dh_emi)
+        .join(XmlDoc, (XmlDoc.chave == XmlDocItem.chave) & (XmlDoc.mes == XmlDocItem.mes) & (XmlDoc.tipo == "NFE"))
+        .where(XmlDocItem.mes == mes)
+        .order_by(XmlDocItem.chave, XmlDocItem.n_item)
+    )
+
+
+def _arrow_type(col):
+    # tipo do Parquet a partir da coluna do SQLAlchemy (Numeric vira decimal exato)
+    t = col.type
+    if isinstance(t, Numeric):
+        return pa.decimal128(t.precision, t.scale)
+    if isinstance(t, Integer):
+        return pa.int32()
+    if isinstance(t, DateTime):
+        return pa.timestamp("us", tz="UTC") if t.timezone else pa.timestamp("us")
+    if isinstance(t, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def _schema(stmt) -> "pa.Schema":
+    return pa.schema([pa.field(c.name, _arrow_type(c)) for c in stmt.selected_columns])
+
+
+def export_month(db, stmt, path: Path) -> int:
+    """
+    Grava o resultado de stmt em path (zstd), em lotes, sem carregar o mês inteiro na memória.
+    """
+    schema = _schema(stmt)
+    names = schema.names
+    total = 0
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=ROWS_PER_BATCH))
+    with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+        for rows in result.partitions():
+            cols = list(zip(*rows))
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(c, type=f.type) for c, f in zip(cols, schema)], names=names
+            ))
+            total += len(rows)
+    if total:
+        tmp.replace(path)
+    else:
+        tmp.unlink()
+        path.unlink(missing_ok=True)
+    return total
+
+
+def _parse_month(s: str) -> date:
+    return month_start(datetime.strptime(s, "%Y-%m"))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Exporta documentos e itens para Parquet (por mês de emissão)")
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--from", dest="date_from", help="AAAA-MM (padrão: 11 meses antes do atual)")
+    ap.add_argument("--to", dest="date_to", help="AAAA-MM (padrão: mês atual)")
+    args = ap.parse_args()
+
+    if pa is None:
+        raise SystemExit("Export em Parquet exige o pacote pyarrow (pip install pyarrow).")
+
+    last = _parse_month(args.date_to) if args.date_to else month_start(datetime.utcnow())
+    # padrão: 12 meses até o último
+    first = _parse_month(args.date_from) if args.date_from else next_month(date(last.year - 1, last.month, 1))
+
+    init_db()
+    out = Path(args.out).expanduser()
+    t0 = time.perf_counter()
+    m = first
+    while m <= last:
+        part = f"ano_mes={m:%Y-%m}"
+        db = SessionLocal()
+        try:
+            docs = export_month(db, _doc_query(m), out / "documentos" / part / "part-0.parquet")
+            items = export_month(db, _item_query(m), out / "itens" / part / "part-0.parquet")
+        finally:
+            db.close()
+        if docs or items:
+            print(f"{m:%Y-%m}: {docs} documentos, {items} itens")
+        m = next_month(m)
+
+    print(f"Fim em {time.perf_counter() - t0:.1f} s: {out}")
+
+
+if __name__ == "__main__":
+    main()
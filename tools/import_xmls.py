@@ -0,0 +1,106 @@
+"""
+Importa em massa XMLs (NF-e/CT-e) para o banco: pastas, arquivos .xml e .zip
+(ex.: a pasta ~/.xsist/nsu ou o .zip de um lote do conector).
+Reimportar o mesmo acervo só grava o que mudou (hash do conteúdo).
+
+Só entram documentos: procNFe/NFe/procCTe/CTe e, para chave sem a nota no lote, o resNFe.
+Eventos (cancelamento, CC-e, ...) e resumos de evento trazem a chave da nota e são ignorados,
+senão substituiriam a nota na mesma linha de xml_docs.
+
+Uso:
+    python -m tools.import_xmls C:\\caminho\\pasta lote.zip --batch 2000
+"""
+from __future__ import annotations
+
+import argparse
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterator
+
+from data.db import init_db
+from data.repo import save_xml_docs_bulk
+from services.xml_utils import SCHEMA_RANK, extract_key_type_schema
+
+
+def _decode(raw: bytes) -> str:
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+
+def iter_xml_files(paths: list[str]) -> Iterator[tuple[str, bytes]]:
+    for p in map(Path, paths):
+        if p.is_dir():
+            for f in sorted(p.rglob("*")):
+                if f.suffix.lower() in (".xml", ".zip"):
+                    yield from iter_xml_files([str(f)])
+        elif p.suffix.lower() == ".zip":
+            with zipfile.ZipFile(p) as zf:
+                for name in zf.namelist():
+                    if name.lower().endswith(".xml"):
+                        yield f"{p}:{name}", zf.read(name)
+        elif p.suffix.lower() == ".xml":
+            yield str(p), p.read_bytes()
+
+
+def iter_docs(paths: list[str], skipped: list[str], read: list[int]) -> Iterator[tuple[str, str, str]]:
+    # nível do que já foi enviado por chave: a nota autorizada não é trocada pelo XML sem protocolo
+    sent: dict[tuple[str, str], int] = {}
+    # resNFe fica para o fim: só entra se a nota completa não apareceu no acervo
+    summaries: dict[tuple[str, str], str] = {}
+    for name, raw in iter_xml_files(paths):
+        read[0] += 1
+        xml_text = _decode(raw)
+        chave, tipo, schema = extract_key_type_schema(xml_text)
+        rank = SCHEMA_RANK.get(schema, 0)
+        if not chave or tipo not in ("NFE", "CTE") or rank == 0:
+            skipped.append(name)
+            continue
+        key = (chave, tipo)
+        if schema == "resNFe":
+            summaries[key] = xml_text
+            continue
+        if sent.get(key, 0) > rank:
+            continue
+        sent[key] = rank
+        yield chave, tipo, xml_text
+
+    for key, xml_text in summaries.items():
+        if key not in sent:
+            yield *key, xml_text
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Importa XMLs em massa para xml_docs")
+    ap.add_argument("paths", nargs="+", help="pastas, .xml ou .zip")
+    ap.add_argument("--batch", type=int, default=1000, help="documentos por lote (conferência de hash / INSERT)")
+    ap.add_argument("--no-copy", action="store_true", help="não usar COPY (psycopg 3)")
+    args = ap.parse_args()
+
+    init_db()
+
+    skipped: list[str] = []
+    read = [0]
+    t0 = time.perf_counter()
+    total = save_xml_docs_bulk(
+        iter_docs(args.paths, skipped, read),
+        batch_size=args.batch,
+        use_copy=False if args.no_copy else None,
+    )
+    elapsed = time.perf_counter() - t0
+
+    docs = read[0] - len(skipped)
+    print(
+        f"{docs} documentos lidos em {elapsed:.1f} s ({docs / elapsed if elapsed else 0:.0f} docs/s):"
+        f" {total} gravados, {docs - total} sem alteração."
+    )
+    if skipped:
+        print(f"{len(skipped)} arquivos ignorados (eventos ou sem chave NF-e/CT-e):")
+        for name in skipped[:20]:
+            print("  -", name)
+
+
+if __name__ == "__main__":
+    main()
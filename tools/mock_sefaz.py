@@ -0,0 +1,267 @@
+"""
+SEFAZ de teste local (NFeDistribuicaoDFe) para medir o conector sem tocar na produção.
+
+Fala o mesmo SOAP que o conector envia (consChNFe e distNSU), exige certificado cliente
+(mTLS) e devolve retDistDFeInt com docZip (gzip + base64), com latência e cStat configuráveis.
+
+Uso:
+    python -m tools.mock_sefaz --port 8443 --latency-ms 150 --jitter-ms 50 --p-137 0.05
+
+Na 1ª execução gera em --out (padrão ~/.xsist/mock_sefaz) a CA, o certificado do servidor
+e um client.pfx (senha 1234, CNPJ 11222333000181). Para o conector usar este servidor:
+    set XSIST_NFE_DIST_URL=https://127.0.0.1:8443/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx
+    set XSIST_SEFAZ_CA_FILE=<out>\\ca.pem
+e configure o client.pfx no conector (tools/bench_connector.py --setup-cert faz isso).
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import datetime as dt
+import gzip
+import ipaddress
+import random
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+
+from services.sefaz_nfe import SOAP_ACTION
+
+MOCK_CNPJ = "11222333000181"
+MOCK_PFX_PASSWORD = "1234"
+DIST_PATH = "/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx"
+
+_CH_RE = re.compile(rb"<chNFe>(\d{44})</chNFe>")
+_NSU_RE = re.compile(rb"<ultNSU>(\d+)</ultNSU>")
+
+
+# ---------------- certificados de teste ----------------
+
+def _name(cn: str) -> x509.Name:
+    return x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "BR"),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "XSist Teste"),
+        x509.NameAttribute(NameOID.COMMON_NAME, cn),
+    ])
+
+
+def _issue(subject: str, issuer_name: x509.Name, issuer_key, *, ca: bool = False, san=None):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    now = dt.datetime.now(dt.timezone.utc)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(_name(subject))
+        .issuer_name(issuer_name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - dt.timedelta(days=1))
+        .not_valid_after(now + dt.timedelta(days=365))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+    )
+    if san:
+        builder = builder.add_extension(x509.SubjectAlternativeName(san), critical=False)
+    cert = builder.sign(issuer_key or key, hashes.SHA256())
+    return key, cert
+
+
+def ensure_certs(out_dir: Path) -> dict:
+    """
+    Gera (uma vez) CA, certificado do servidor e client.pfx em out_dir.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = {
+        "ca": out_dir / "ca.pem",
+        "server_cert": out_dir / "server.pem",
+        "server_key": out_dir / "server.key",
+        "client_pfx": out_dir / "client.pfx",
+    }
+    if all(p.exists() for p in paths.values()):
+        return paths
+
+    ca_key, ca_cert = _issue("XSist Mock CA", _name("XSist Mock CA"), None, ca=True)
+    srv_key, srv_cert = _issue(
+        "localhost", ca_cert.subject, ca_key,
+        san=[x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))],
+    )
+    cli_key, cli_cert = _issue(f"EMPRESA TESTE:{MOCK_CNPJ}", ca_cert.subject, ca_key)
+
+    pem = serialization.Encoding.PEM
+    paths["ca"].write_bytes(ca_cert.public_bytes(pem))
+    paths["server_cert"].write_bytes(srv_cert.public_bytes(pem) + ca_cert.public_bytes(pem))
+    paths["server_key"].write_bytes(srv_key.private_bytes(
+        pem, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    paths["client_pfx"].write_bytes(pkcs12.serialize_key_and_certificates(
+        b"xsist-mock", cli_key, cli_cert, [ca_cert],
+        serialization.BestAvailableEncryption(MOCK_PFX_PASSWORD.encode("utf-8")),
+    ))
+    return paths
+
+
+# ---------------- respostas ----------------
+
+def _nfe_proc_xml(chave: str, pad_kb: int) -> bytes:
+    # procNFe mínimo com a chave; pad_kb engorda o documento para testar payloads maiores
+    filler = "X" * (pad_kb * 1024)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe><infNFe Id="NFe{chave}" versao="4.00">\
+<ide><cUF>{chave[:2]}</cUF><mod>{chave[20:22]}</mod><serie>{int(chave[22:25])}</serie><nNF>{int(chave[25:34])}</nNF>\
+<dhEmi>2024-01-15T10:00:00-03:00</dhEmi></ide>\
+<emit><CNPJ>{chave[6:20]}</CNPJ><xNome>EMITENTE TESTE LTDA</xNome></emit>\
+<dest><CNPJ>{MOCK_CNPJ}</CNPJ><xNome>EMPRESA TESTE</xNome></dest>\
+<total><ICMSTot><vNF>100.00</vNF></ICMSTot></total>\
+<infAdic><infCpl>{filler}</infCpl></infAdic></infNFe></NFe>\
+<protNFe versao="4.00"><infProt><chNFe>{chave}</chNFe><cStat>100</cStat></infProt></protNFe></nfeProc>""".encode("utf-8")
+
+
+def _doczip(nsu: int, schema: str, xml: bytes) -> str:
+    data = base64.b64encode(gzip.compress(xml)).decode("ascii")
+    return f'<docZip NSU="{nsu:015d}" schema="{schema}">{data}</docZip>'
+
+
+def _ret(cstat: str, xmotivo: str, ult_nsu: int, max_nsu: int, docs: list[str]) -> bytes:
+    lote = f"<loteDistDFeInt>{''.join(docs)}</loteDistDFeInt>" if docs else ""
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>\
+<nfeDistDFeInteresseResponse xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe">\
+<nfeDistDFeInteresseResult><retDistDFeInt xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">\
+<tpAmb>1</tpAmb><verAplic>MOCK</verAplic><cStat>{cstat}</cStat><xMotivo>{xmotivo}</xMotivo>\
+<dhResp>{dt.datetime.now().isoformat(timespec="seconds")}-03:00</dhResp>\
+<ultNSU>{ult_nsu:015d}</ultNSU><maxNSU>{max_nsu:015d}</maxNSU>{lote}</retDistDFeInt>\
+</nfeDistDFeInteresseResult></nfeDistDFeInteresseResponse></soap:Body></soap:Envelope>""".encode("utf-8")
+
+
+class MockSefaz:
+    """
+    Regras do servidor de teste. Thread-safe (o HTTP server atende cada conexão numa thread).
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _sleep(self) -> None:
+        ms = self.args.latency_ms + random.uniform(-self.args.jitter_ms, self.args.jitter_ms)
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+    def _pick_error(self) -> bytes | None:
+        r = random.random()
+        if r < self.args.p_656:
+            return _ret("656", "Rejeicao: Consumo Indevido", 0, 0, [])
+        if r < self.args.p_656 + self.args.p_137:
+            return _ret("137", "Nenhum documento localizado", 0, 0, [])
+        return None
+
+    def handle(self, body: bytes) -> bytes:
+        with self._lock:
+            self.requests += 1
+        self._sleep()
+
+        err = self._pick_error()
+        if err:
+            return err
+
+        m = _CH_RE.search(body)
+        if m:
+            chave = m.group(1).decode("ascii")
+            doc = _doczip(1, "procNFe_v4.00.xsd", _nfe_proc_xml(chave, self.args.doc_kb))
+            return _ret("138", "Documento localizado", 0, 0, [doc])
+
+        m = _NSU_RE.search(body)
+        if m:
+            ult = int(m.group(1))
+            max_nsu = self.args.max_nsu
+            if ult >= max_nsu:
+                return _ret("137", "Nenhum documento localizado", ult, max_nsu, [])
+            last = min(max_nsu, ult + self.args.page_size)
+            docs = []
+            for nsu in range(ult + 1, last + 1):
+                chave = f"352401{random.randint(10**13, 10**14 - 1)}55001{nsu:09d}1{random.randint(0, 10**8 - 1):08d}0"
+                docs.append(_doczip(nsu, "procNFe_v4.00.xsd", _nfe_proc_xml(chave, self.args.doc_kb)))
+            return _ret("138", "Documento localizado", last, max_nsu, docs)
+
+        return _ret("215", "Rejeicao: Falha no schema XML", 0, 0, [])
+
+
+def make_handler(mock: MockSefaz):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como a SEFAZ
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path != DIST_PATH or SOAP_ACTION not in (self.headers.get("SOAPAction") or ""):
+                self._send(500, b"SOAPAction/endpoint inesperado")
+                return
+            self._send(200, mock.handle(body))
+
+        def do_GET(self):
+            # warmup do conector (e teste rápido no navegador)
+            self._send(200, b"mock NFeDistribuicaoDFe")
+
+        def _send(self, code: int, data: bytes):
+            self.send_response(code)
+            self.send_header("Content-Type", "text/xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, fmt, *args):
+            if mock.args.verbose:
+                super().log_message(fmt, *args)
+
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description="SEFAZ NFeDistribuicaoDFe de teste (mTLS)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8443)
+    ap.add_argument("--out", default=str(Path.home() / ".xsist" / "mock_sefaz"))
+    ap.add_argument("--latency-ms", type=float, default=100.0)
+    ap.add_argument("--jitter-ms", type=float, default=30.0)
+    ap.add_argument("--p-137", type=float, default=0.0, help="fração de respostas 137 (nada encontrado)")
+    ap.add_argument("--p-656", type=float, default=0.0, help="fração de respostas 656 (consumo indevido)")
+    ap.add_argument("--doc-kb", type=int, default=4, help="enchimento de cada XML, em KB")
+    ap.add_argument("--max-nsu", type=int, default=500, help="maxNSU para distNSU")
+    ap.add_argument("--page-size", type=int, default=50, help="docs por página no distNSU")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    paths = ensure_certs(Path(args.out))
+
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(paths["server_cert"], paths["server_key"])
+    ctx.load_verify_locations(cafile=str(paths["ca"]))
+    ctx.verify_mode = ssl.CERT_REQUIRED  # mTLS: sem certificado cliente, sem conversa
+
+    mock = MockSefaz(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(mock))
+    server.daemon_threads = True
+    # handshake na thread de cada conexão (não no accept), senão os handshakes viram fila
+    server.socket = ctx.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+
+    print(f"Mock SEFAZ em https://{args.host}:{args.port}{DIST_PATH}")
+    print(f"  XSIST_NFE_DIST_URL=https://{args.host}:{args.port}{DIST_PATH}")
+    print(f"  XSIST_SEFAZ_CA_FILE={paths['ca']}")
+    print(f"  PFX cliente: {paths['client_pfx']} (senha {MOCK_PFX_PASSWORD}, CNPJ {MOCK_CNPJ})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"\n{mock.requests} requisições atendidas.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Recalcula os totais do painel (data/summary.py) dos meses marcados.
+O painel faz isso sozinho ao abrir; rode à mão depois de migrar uma base grande
+(a migração marca todos os meses) para a primeira abertura não demorar.
+
+    python -m tools.refresh_summaries
+"""
+from __future__ import annotations
+
+import time
+
+from data.db import init_db
+from data.summary import refresh_summaries
+
+
+def main():
+    init_db()
+    t0 = time.perf_counter()
+    done = 0
+    while n := refresh_summaries(limit=12):
+        done += n
+        print(f"\r{done} meses recalculados...", end="", flush=True)
+    print(f"\nFim: {done} meses em {time.perf_counter() - t0:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()